@@ -0,0 +1,41 @@
+"""add knowledge_jobs table
+
+Revision ID: a7b8c9d0e1f2
+Revises: f6a7b8c9d0e1
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'a7b8c9d0e1f2'
+down_revision = 'f6a7b8c9d0e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'knowledge_jobs',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('document_id', sa.Integer(), sa.ForeignKey('knowledge_documents.id', ondelete='CASCADE'), nullable=False, index=True),
+        sa.Column('agent_id', sa.Integer(), nullable=False, comment="同一数字人的任务按 id 顺序逐个执行"),
+        sa.Column('status', sa.Enum('queued', 'running', 'succeeded', 'failed', name='job_status_enum'), nullable=False, server_default='queued'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('max_attempts', sa.Integer(), nullable=False, server_default='3'),
+        sa.Column('run_after', sa.DateTime(), nullable=False, comment="UTC，重试退避期间不可领取"),
+        sa.Column('locked_by', sa.String(64), nullable=True),
+        sa.Column('locked_until', sa.DateTime(), nullable=True, comment="UTC，租约过期后任务重新入队"),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index('ix_knowledge_jobs_status_run_after', 'knowledge_jobs', ['status', 'run_after'])
+    op.create_index('ix_knowledge_jobs_agent_id_id', 'knowledge_jobs', ['agent_id', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_knowledge_jobs_agent_id_id', table_name='knowledge_jobs')
+    op.drop_index('ix_knowledge_jobs_status_run_after', table_name='knowledge_jobs')
+    op.drop_table('knowledge_jobs')
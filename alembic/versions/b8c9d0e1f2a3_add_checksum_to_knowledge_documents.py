@@ -0,0 +1,23 @@
+"""add checksum to knowledge_documents
+
+Revision ID: b8c9d0e1f2a3
+Revises: a7b8c9d0e1f2
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'b8c9d0e1f2a3'
+down_revision = 'a7b8c9d0e1f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('knowledge_documents', sa.Column('checksum', sa.String(length=64), nullable=True, comment="上传文件内容的 sha256（十六进制）"))
+
+
+def downgrade() -> None:
+    op.drop_column('knowledge_documents', 'checksum')
@@ -0,0 +1,23 @@
+"""add llm_model to agents
+
+Revision ID: c3d4e5f6a7b8
+Revises: b2c3d4e5f6a7
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'c3d4e5f6a7b8'
+down_revision = 'b2c3d4e5f6a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('agents', sa.Column('llm_model', sa.String(100), nullable=True, comment="LLM模型名称，为空时使用默认模型"))
+
+
+def downgrade() -> None:
+    op.drop_column('agents', 'llm_model')
@@ -0,0 +1,41 @@
+"""add extraction_cache table and chunk counts to knowledge_documents
+
+Revision ID: c9d0e1f2a3b4
+Revises: b8c9d0e1f2a3
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'c9d0e1f2a3b4'
+down_revision = 'b8c9d0e1f2a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'extraction_cache',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('chunk_hash', sa.String(64), nullable=False, comment="分块文本的 sha256"),
+        sa.Column('prompt_version', sa.String(16), nullable=False, comment="抽取提示词及参数的哈希"),
+        sa.Column('model', sa.String(100), nullable=False),
+        sa.Column('result', sa.Text(), nullable=False, comment="抽取结果 JSON"),
+        sa.Column('size', sa.Integer(), nullable=False, comment="result 的字节数，用于按总大小淘汰"),
+        sa.Column('hits', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('last_used_at', sa.DateTime(), nullable=False, comment="UTC，最久未使用的先淘汰"),
+        sa.UniqueConstraint('chunk_hash', 'prompt_version', 'model', name='uq_extraction_cache_key'),
+    )
+    op.create_index('ix_extraction_cache_last_used_at', 'extraction_cache', ['last_used_at'])
+    op.add_column('knowledge_documents', sa.Column('chunk_count', sa.Integer(), nullable=True, comment="最近一次处理的分块数"))
+    op.add_column('knowledge_documents', sa.Column('cached_chunk_count', sa.Integer(), nullable=True, comment="其中命中抽取缓存的分块数"))
+
+
+def downgrade() -> None:
+    op.drop_column('knowledge_documents', 'cached_chunk_count')
+    op.drop_column('knowledge_documents', 'chunk_count')
+    op.drop_index('ix_extraction_cache_last_used_at', table_name='extraction_cache')
+    op.drop_table('extraction_cache')
@@ -0,0 +1,29 @@
+"""add knowledge_document_chunks table
+
+Revision ID: d0e1f2a3b4c5
+Revises: c9d0e1f2a3b4
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'd0e1f2a3b4c5'
+down_revision = 'c9d0e1f2a3b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'knowledge_document_chunks',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('document_id', sa.Integer(), sa.ForeignKey('knowledge_documents.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('chunk_hash', sa.String(64), nullable=False, comment="已写入图谱的分块文本 sha256，替换文档时据此比对"),
+        sa.UniqueConstraint('document_id', 'chunk_hash', name='uq_knowledge_document_chunks'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('knowledge_document_chunks')
@@ -0,0 +1,26 @@
+"""add unchanged_chunk_count to knowledge_documents
+
+Revision ID: e1f2a3b4c5d6
+Revises: d0e1f2a3b4c5
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'e1f2a3b4c5d6'
+down_revision = 'd0e1f2a3b4c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'knowledge_documents',
+        sa.Column('unchanged_chunk_count', sa.Integer(), nullable=True, comment="与上一版本相同、无需抽取的分块数"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('knowledge_documents', 'unchanged_chunk_count')
@@ -0,0 +1,23 @@
+"""add response_cache_ttl to agents
+
+Revision ID: e5f6a7b8c9d0
+Revises: d4e5f6a7b8c9
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'e5f6a7b8c9d0'
+down_revision = 'd4e5f6a7b8c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('agents', sa.Column('response_cache_ttl', sa.Integer(), nullable=True, comment="相同问题回答缓存有效期（秒），为空或0表示不缓存"))
+
+
+def downgrade() -> None:
+    op.drop_column('agents', 'response_cache_ttl')
@@ -0,0 +1,29 @@
+"""add generation stats to messages
+
+Revision ID: f6a7b8c9d0e1
+Revises: e5f6a7b8c9d0
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'f6a7b8c9d0e1'
+down_revision = 'e5f6a7b8c9d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('messages', sa.Column('llm_model', sa.String(length=100), nullable=True, comment="生成回复所用模型"))
+    op.add_column('messages', sa.Column('ttft_ms', sa.Integer(), nullable=True, comment="首个 token 延迟（毫秒）"))
+    op.add_column('messages', sa.Column('duration_ms', sa.Integer(), nullable=True, comment="生成总耗时（毫秒）"))
+    op.add_column('messages', sa.Column('output_tokens', sa.Integer(), nullable=True, comment="输出 token 数"))
+
+
+def downgrade() -> None:
+    op.drop_column('messages', 'output_tokens')
+    op.drop_column('messages', 'duration_ms')
+    op.drop_column('messages', 'ttft_ms')
+    op.drop_column('messages', 'llm_model')
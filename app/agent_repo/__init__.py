@@ -4,6 +4,8 @@ Agent Repository Layer - 数字人数据访问层
 from app.agent_repo.agent import (
     AgentRepository,
     agent_repository,
+    AsyncAgentRepository,
+    async_agent_repository,
 )
 
 
@@ -12,8 +14,16 @@ def get_agent_repository() -> AgentRepository:
     return agent_repository
 
 
+def get_async_agent_repository() -> AsyncAgentRepository:
+    """获取 AsyncAgentRepository 实例的工厂函数，用于依赖注入"""
+    return async_agent_repository
+
+
 __all__ = [
     "AgentRepository",
     "agent_repository",
+    "AsyncAgentRepository",
+    "async_agent_repository",
     "get_agent_repository",
+    "get_async_agent_repository",
 ]
@@ -1,7 +1,9 @@
 """
 Agent CRUD 操作 - 数字人数据访问层
 """
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.agent import Agent
 from app.models.user import User  # 导入 User 模型以确保外键关系正确
 from app.schemas.agent import AgentCreate, AgentUpdate
@@ -45,6 +47,8 @@ class AgentRepository:
             appearance_settings=agent.appearance_settings,
             temperature=agent.temperature,
             max_tokens=agent.max_tokens,
+            llm_model=agent.llm_model,
+            response_cache_ttl=agent.response_cache_ttl,
             system_prompt=agent.system_prompt,
             is_active=agent.is_active
         )
@@ -78,5 +82,71 @@ class AgentRepository:
         return True
 
 
+class AsyncAgentRepository:
+    """数字人数据访问层（AsyncSession 版本，供请求处理使用）"""
+
+    async def get_agent_by_id(self, db: AsyncSession, agent_id: int) -> Optional[Agent]:
+        """根据 ID 获取数字人"""
+        return await db.get(Agent, agent_id)
+
+    async def get_agents_by_user_id(self, db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100) -> List[Agent]:
+        """根据用户ID获取数字人列表"""
+        result = await db.execute(select(Agent).filter(Agent.user_id == user_id).offset(skip).limit(limit))
+        return list(result.scalars().all())
+
+    async def create_agent(self, db: AsyncSession, agent: AgentCreate, user_id: int) -> Agent:
+        """创建数字人"""
+        db_agent = Agent(
+            user_id=user_id,
+            name=agent.name,
+            description=agent.description,
+            short_description=agent.short_description,
+            avatar_url=agent.avatar_url,
+            agent_type=agent.agent_type,
+            skills=agent.skills,
+            permission=agent.permission,
+            conversation_style=agent.conversation_style,
+            personality=agent.personality,
+            voice_id=agent.voice_id,
+            voice_settings=agent.voice_settings,
+            appearance_settings=agent.appearance_settings,
+            temperature=agent.temperature,
+            max_tokens=agent.max_tokens,
+            llm_model=agent.llm_model,
+            response_cache_ttl=agent.response_cache_ttl,
+            system_prompt=agent.system_prompt,
+            is_active=agent.is_active
+        )
+        db.add(db_agent)
+        await db.commit()
+        await db.refresh(db_agent)
+        return db_agent
+
+    async def update_agent(self, db: AsyncSession, agent_id: int, agent_update: AgentUpdate) -> Optional[Agent]:
+        """更新数字人"""
+        db_agent = await self.get_agent_by_id(db, agent_id)
+        if not db_agent:
+            return None
+
+        update_data = agent_update.dict(exclude_unset=True)
+        for field, value in update_data.items():
+            setattr(db_agent, field, value)
+
+        await db.commit()
+        await db.refresh(db_agent)
+        return db_agent
+
+    async def delete_agent(self, db: AsyncSession, agent_id: int) -> bool:
+        """删除数字人"""
+        db_agent = await self.get_agent_by_id(db, agent_id)
+        if not db_agent:
+            return False
+
+        await db.delete(db_agent)
+        await db.commit()
+        return True
+
+
 # 创建默认实例供导入使用
 agent_repository = AgentRepository()
+async_agent_repository = AsyncAgentRepository()
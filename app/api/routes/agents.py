@@ -1,27 +1,27 @@
 """Agent API routes - 数字人API路由层"""
 from fastapi import APIRouter, Depends, Body
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from app.schemas.agent import AgentResponse, AgentCreate, AgentUpdate, AgentIdRequest, AgentListRequest
 from app.schemas.user import UserResponse
 from app.schemas.response import ApiResponse
 from app.core.auth import get_current_user
-from app.core.database import get_db
+from app.core.database import get_async_db
 from app.core.exceptions import ParamErrorException
 from app.services.agent_service import AgentService
-from app.agent_repo.agent import AgentRepository
+from app.agent_repo.agent import AsyncAgentRepository
 
 
 router = APIRouter()
 
 
-def get_agent_repository() -> AgentRepository:
-    """获取 AgentRepository 实例的工厂函数"""
-    return AgentRepository()
+def get_agent_repository() -> AsyncAgentRepository:
+    """获取 AsyncAgentRepository 实例的工厂函数"""
+    return AsyncAgentRepository()
 
 
 def get_agent_service(
-    agent_repo: AgentRepository = Depends(get_agent_repository)
+    agent_repo: AsyncAgentRepository = Depends(get_agent_repository)
 ) -> AgentService:
     """获取 AgentService 实例的工厂函数，用于依赖注入"""
     return AgentService(agent_repo)
@@ -32,11 +32,11 @@ def get_agent_service(
 async def create_agent_root(
     agent_create: AgentCreate = Body(...),
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     agent_service: AgentService = Depends(get_agent_service)
 ):
     """创建数字人 - POST /api/v1/agents"""
-    result = agent_service.create_agent(db, agent_create, current_user.id)
+    result = await agent_service.create_agent(db, agent_create, current_user.id)
     return ApiResponse.success(result)
 
 
@@ -44,12 +44,12 @@ async def create_agent_root(
 async def get_agents(
     request: AgentListRequest = Body(default=AgentListRequest()),
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     agent_service: AgentService = Depends(get_agent_service)
 ):
     """获取数字人列表"""
     user_id = request.user_id if request.user_id else current_user.id
-    result = agent_service.get_agents_by_user_id(db, user_id, request.skip, request.limit)
+    result = await agent_service.get_agents_by_user_id(db, user_id, request.skip, request.limit)
     return ApiResponse.success(result)
 
 
@@ -57,11 +57,11 @@ async def get_agents(
 async def get_agent(
     request: AgentIdRequest = Body(...),
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     agent_service: AgentService = Depends(get_agent_service)
 ):
     """根据ID获取数字人"""
-    result = agent_service.get_agent_by_id(db, request.agent_id, current_user.id)
+    result = await agent_service.get_agent_by_id(db, request.agent_id, current_user.id)
     return ApiResponse.success(result)
 
 
@@ -69,11 +69,11 @@ async def get_agent(
 async def create_agent(
     agent_create: AgentCreate = Body(...),
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     agent_service: AgentService = Depends(get_agent_service)
 ):
     """创建数字人"""
-    result = agent_service.create_agent(db, agent_create, current_user.id)
+    result = await agent_service.create_agent(db, agent_create, current_user.id)
     return ApiResponse.success(result)
 
 
@@ -81,7 +81,7 @@ async def create_agent(
 async def update_agent(
     request: dict = Body(...),
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     agent_service: AgentService = Depends(get_agent_service)
 ):
     """更新数字人"""
@@ -92,7 +92,7 @@ async def update_agent(
     update_data = {k: v for k, v in request.items() if k != "agent_id"}
     agent_update = AgentUpdate(**update_data)
 
-    result = agent_service.update_agent(db, agent_id, agent_update, current_user.id)
+    result = await agent_service.update_agent(db, agent_id, agent_update, current_user.id)
     return ApiResponse.success(result)
 
 
@@ -100,9 +100,9 @@ async def update_agent(
 async def delete_agent(
     request: AgentIdRequest = Body(...),
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     agent_service: AgentService = Depends(get_agent_service)
 ):
     """删除数字人"""
-    agent_service.delete_agent(db, request.agent_id, current_user.id)
+    await agent_service.delete_agent(db, request.agent_id, current_user.id)
     return ApiResponse.success(message="Agent deleted successfully")
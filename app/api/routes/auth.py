@@ -40,7 +40,7 @@ async def register(user: UserRegister):
     """
     try:
         # 调用Service层处理注册业务逻辑
-        new_user = user_service.register_user(user)
+        new_user = await user_service.register_user(user)
 
         # API层只负责生成Token和返回响应
         access_token = create_access_token(
@@ -86,7 +86,7 @@ async def login(user_login: UserLogin):
         HTTPException: 凭证无效时返回 401
     """
     # 调用Service层处理认证业务逻辑
-    user = user_service.authenticate_user(user_login.username, user_login.password)
+    user = await user_service.authenticate_user(user_login.username, user_login.password)
 
     if not user:
         raise HTTPException(
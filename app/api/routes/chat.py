@@ -1,10 +1,10 @@
 """
 Chat API routes
 """
-import json
 import logging
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from typing import Optional
+from fastapi import APIRouter, Depends, Header
+from sqlalchemy.ext.asyncio import AsyncSession
 from sse_starlette.sse import EventSourceResponse
 from app.schemas.conversation import (
     ConversationCreate, ConversationResponse, ConversationListRequest,
@@ -13,20 +13,32 @@ from app.schemas.conversation import (
 from app.schemas.response import ApiResponse
 from app.schemas.user import UserResponse
 from app.core.auth import get_current_user
-from app.core.database import get_db
+from app.core.database import get_async_db
 from app.services.chat_service import chat_service
+from app.services.chat_limiter import chat_limiter
+from app.services.stream_registry import stream_registry, TurnStream
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+async def _sse_events(stream: TurnStream, after_seq: int):
+    """Relay a turn's events to one SSE client, each with a resumable id."""
+    stream_registry.attach(stream)
+    try:
+        async for seq, event, data in stream.events_after(after_seq):
+            yield {"id": stream.event_id(seq), "event": event, "data": data}
+    finally:
+        stream_registry.detach(stream)
+
+
 @router.post("/conversations", response_model=ApiResponse[ConversationResponse])
 async def create_conversation(
     conv_create: ConversationCreate,
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    conv = chat_service.create_conversation(db, conv_create, current_user.id)
+    conv = await chat_service.create_conversation(db, conv_create, current_user.id)
     return ApiResponse.success(data=conv)
 
 
@@ -34,9 +46,9 @@ async def create_conversation(
 async def list_conversations(
     req: ConversationListRequest,
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    convs = chat_service.get_conversations(db, req.agent_id, current_user.id, req.skip, req.limit)
+    convs = await chat_service.get_conversations(db, req.agent_id, current_user.id, req.skip, req.limit)
     return ApiResponse.success(data=convs)
 
 
@@ -44,9 +56,9 @@ async def list_conversations(
 async def get_messages(
     conversation_id: int,
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    messages = chat_service.get_messages(db, conversation_id, current_user.id)
+    messages = await chat_service.get_messages(db, conversation_id, current_user.id)
     return ApiResponse.success(data=messages)
 
 
@@ -54,35 +66,59 @@ async def get_messages(
 async def delete_conversation(
     req: ConversationIdRequest,
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    success = chat_service.delete_conversation(db, req.conversation_id, current_user.id)
+    success = await chat_service.delete_conversation(db, req.conversation_id, current_user.id)
     return ApiResponse.success(data=success)
 
 
+@router.get("/stats", response_model=ApiResponse[dict])
+async def get_chat_stats(current_user: UserResponse = Depends(get_current_user)):
+    """Admission queue, cache and write queue counters of this worker."""
+    return ApiResponse.success(data=chat_service.get_stats())
+
+
+@router.post("/conversations/{conversation_id}/cancel", response_model=ApiResponse[bool])
+async def cancel_generation(
+    conversation_id: int,
+    current_user: UserResponse = Depends(get_current_user),
+):
+    """Stop the answer being generated for a conversation; false if none was running."""
+    cancelled = await chat_service.cancel_generation(conversation_id, current_user.id)
+    return ApiResponse.success(data=cancelled)
+
+
 @router.post("/conversations/{conversation_id}/stream")
 async def stream_chat(
     conversation_id: int,
     chat_request: ChatRequest,
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    last_event_id: Optional[str] = Header(None),
 ):
-    """SSE streaming chat endpoint."""
-    # Pre-flight validation: raise proper HTTP errors before entering SSE
-    chat_service.validate_stream_request(db, conversation_id, current_user.id)
-
-    async def event_generator():
-        try:
-            async for token in chat_service.stream_chat(
-                db=db,
-                conversation_id=conversation_id,
-                user_id=current_user.id,
-                user_message=chat_request.content,
-            ):
-                yield {"event": "message", "data": json.dumps({"token": token})}
-            yield {"event": "done", "data": json.dumps({"status": "complete"})}
-        except Exception as e:
-            logger.error(f"Stream error for conversation {conversation_id}: {e}", exc_info=True)
-            yield {"event": "error", "data": json.dumps({"error": "Stream interrupted"})}
-
-    return EventSourceResponse(event_generator())
+    """
+    SSE streaming chat endpoint.
+
+    Every event carries an id. A client that lost the connection repeats the
+    request with a Last-Event-ID header and gets the rest of the same answer
+    (live if still generating) instead of a new generation.
+    """
+    if last_event_id:
+        stream, after_seq = chat_service.resume_stream(conversation_id, current_user.id, last_event_id)
+        return EventSourceResponse(_sse_events(stream, after_seq))
+
+    # Wait for a generation slot before the stream opens, so a full queue or
+    # queue timeout comes back as a normal error response
+    permit = await chat_limiter.acquire(current_user.id)
+    try:
+        # DB phase runs before entering SSE: raises proper HTTP errors and releases its connection
+        turn = await chat_service.prepare_stream_turn(conversation_id, current_user.id, chat_request.content)
+    except BaseException:
+        permit.release()
+        raise
+
+    stream = chat_service.start_stream(
+        turn, permit,
+        flush_interval_ms=chat_request.flush_interval_ms,
+        flush_bytes=chat_request.flush_bytes,
+    )
+    return EventSourceResponse(_sse_events(stream, 0))
@@ -1,52 +1,104 @@
 """
 Knowledge API routes
 """
-from fastapi import APIRouter, Depends, UploadFile, File, Query
+from typing import Optional
+from fastapi import APIRouter, Depends, UploadFile, File, Query, Request
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from app.schemas.knowledge import (
-    KnowledgeDocumentResponse, DocumentListRequest, DocumentIdRequest,
+    KnowledgeDocumentResponse, DocumentListRequest, DocumentIdRequest, DocumentStatusResponse,
     GraphData, GraphNode, EntitySearchRequest,
 )
 from app.schemas.response import ApiResponse
 from app.schemas.user import UserResponse
 from app.core.auth import get_current_user
-from app.core.database import get_db
-from app.services.knowledge_service import knowledge_service
+from app.core.exceptions import ErrorCode
+from app.core.database import get_db, get_async_db
+from app.services.knowledge_service import knowledge_service, KNOWLEDGE_MAX_UPLOAD_MB
+from app.services.knowledge_jobs import knowledge_job_worker
 
 router = APIRouter()
 
 ALLOWED_EXTENSIONS = {".txt", ".md"}
-MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+MAX_FILE_SIZE = int(KNOWLEDGE_MAX_UPLOAD_MB * 1024 * 1024)
+# Room for the multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def _check_upload(request: Request, file: UploadFile) -> Optional[ApiResponse]:
+    """Error response for an upload that can be rejected before reading it, else None."""
+    # Validate file extension
+    filename = file.filename or ""
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if f".{ext}" not in ALLOWED_EXTENSIONS:
+        return ApiResponse.error(ErrorCode.PARAM_ERROR, "Only .txt and .md files are supported")
+
+    size_error = f"File size exceeds {KNOWLEDGE_MAX_UPLOAD_MB:g}MB limit"
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+        return ApiResponse.error(ErrorCode.PARAM_ERROR, size_error)
+    if file.size is not None and file.size > MAX_FILE_SIZE:
+        return ApiResponse.error(ErrorCode.PARAM_ERROR, size_error)
+    return None
 
 
 @router.post("/upload", response_model=ApiResponse[dict])
 async def upload_document(
     agent_id: int,
+    request: Request,
     file: UploadFile = File(...),
     current_user: UserResponse = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    # Validate file extension
-    filename = file.filename or ""
-    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
-    if f".{ext}" not in ALLOWED_EXTENSIONS:
-        return ApiResponse.error("Only .txt and .md files are supported")
+    error = _check_upload(request, file)
+    if error is not None:
+        return error
 
-    content = await file.read()
-    if len(content) > MAX_FILE_SIZE:
-        return ApiResponse.error("File size exceeds 5MB limit")
+    # Copied to a temp file chunk by chunk (size, UTF-8 and sha256 checked on the way),
+    # then renamed into place with a queued job; extraction runs on the job workers
+    staged = await knowledge_service.stage_upload(file, MAX_FILE_SIZE)
+    result = await run_in_threadpool(knowledge_service.upload_document, db, agent_id, current_user.id, file.filename, staged)
+    knowledge_job_worker.notify()
+    return ApiResponse.success(data=result)
 
-    result = knowledge_service.upload_document(db, agent_id, current_user.id, filename, content)
+
+@router.post("/documents/{document_id}/replace", response_model=ApiResponse[dict])
+async def replace_document(
+    document_id: int,
+    request: Request,
+    file: UploadFile = File(...),
+    current_user: UserResponse = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    error = _check_upload(request, file)
+    if error is not None:
+        return error
+
+    # Queued like an upload; the job re-extracts only chunks that changed
+    staged = await knowledge_service.stage_upload(file, MAX_FILE_SIZE)
+    result = await run_in_threadpool(knowledge_service.replace_document, db, document_id, current_user.id, file.filename, staged)
+    knowledge_job_worker.notify()
     return ApiResponse.success(data=result)
 
 
+@router.get("/documents/{document_id}/status", response_model=ApiResponse[DocumentStatusResponse])
+async def get_document_status(
+    document_id: int,
+    current_user: UserResponse = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    status = await knowledge_service.get_document_status(db, document_id, current_user.id)
+    return ApiResponse.success(data=DocumentStatusResponse(**status))
+
+
 @router.post("/documents/list", response_model=ApiResponse[list[KnowledgeDocumentResponse]])
 async def list_documents(
     req: DocumentListRequest,
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    docs = knowledge_service.get_documents(db, req.agent_id, current_user.id, req.skip, req.limit)
+    docs = await knowledge_service.get_documents(db, req.agent_id, current_user.id, req.skip, req.limit)
     return ApiResponse.success(data=[KnowledgeDocumentResponse.model_validate(d) for d in docs])
 
 
@@ -56,7 +108,7 @@ async def delete_document(
     current_user: UserResponse = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    success = knowledge_service.delete_document(db, req.document_id, current_user.id)
+    success = await run_in_threadpool(knowledge_service.delete_document, db, req.document_id, current_user.id)
     return ApiResponse.success(data=success)
 
 
@@ -66,7 +118,7 @@ async def get_graph(
     current_user: UserResponse = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    data = knowledge_service.get_graph(agent_id)
+    data = await run_in_threadpool(knowledge_service.get_graph, agent_id)
     return ApiResponse.success(data=GraphData(**data))
 
 
@@ -76,5 +128,5 @@ async def search_entities(
     current_user: UserResponse = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    results = knowledge_service.search_entities(req.agent_id, req.query)
+    results = await run_in_threadpool(knowledge_service.search_entities, req.agent_id, req.query)
     return ApiResponse.success(data=[GraphNode(**r) for r in results])
@@ -31,7 +31,7 @@ async def get_users(
     使用POST方式以便后续RPC调用兼容
     API层只负责请求处理，业务逻辑由Service层处理
     """
-    return user_service.get_all_users()
+    return await user_service.get_all_users()
 
 
 @router.post("/get", response_model=UserResponse)
@@ -45,7 +45,7 @@ async def get_user(
     使用POST方式以便后续RPC调用兼容
     API层只负责请求处理和异常转换，业务逻辑由Service层处理
     """
-    user = user_service.get_user_by_id(request.user_id)
+    user = await user_service.get_user_by_id(request.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -71,7 +71,7 @@ async def update_user(
         )
 
         # 调用Service层处理业务逻辑
-        updated_user = user_service.update_user(request.user_id, user_update)
+        updated_user = await user_service.update_user(request.user_id, user_update)
         if not updated_user:
             raise HTTPException(status_code=404, detail="User not found")
         return updated_user
@@ -91,7 +91,7 @@ async def delete_user(
     使用POST方式以便后续RPC调用兼容
     API层只负责请求处理和异常转换，业务逻辑由Service层处理
     """
-    success = user_service.delete_user(request.user_id)
+    success = await user_service.delete_user(request.user_id)
     if not success:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted successfully"}
@@ -49,7 +49,7 @@ async def get_current_user(
         )
 
     # 通过 Service 层获取用户
-    user = user_service.get_user_by_id(user_id)
+    user = await user_service.get_user_by_id(user_id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
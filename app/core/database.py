@@ -8,10 +8,15 @@ MySQL 数据库连接和操作
 - 回滚迁移: alembic downgrade -1
 """
 import os
+import logging
 from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 import pymysql
 
+logger = logging.getLogger(__name__)
+
 # 共享的 Base，所有模型都应该使用这个 Base
 Base = declarative_base()
 
@@ -21,6 +26,17 @@ _engine = None
 _SessionLocal = None
 _last_database_url = None
 
+# 异步引擎（请求处理使用），同步引擎保留给 Alembic 和脚本
+_async_engine = None
+_AsyncSessionLocal = None
+_last_async_database_url = None
+
+# 同步驱动 -> asyncio 驱动
+_ASYNC_DRIVERS = {
+    "mysql+pymysql://": "mysql+aiomysql://",
+    "mysql://": "mysql+aiomysql://",
+}
+
 
 def _get_database_url():
     """获取数据库 URL（直接从环境变量读取，避免模块加载顺序问题）"""
@@ -36,11 +52,38 @@ def _get_database_url():
     )
 
 
+def _get_async_database_url():
+    """获取异步数据库 URL（将同步驱动替换为 asyncio 驱动）"""
+    database_url = _get_database_url()
+    for sync_prefix, async_prefix in _ASYNC_DRIVERS.items():
+        if database_url.startswith(sync_prefix):
+            return async_prefix + database_url[len(sync_prefix):]
+    return database_url
+
+
 def _get_cloudsql_instance_name():
     """获取 Cloud SQL 实例名称（用于 Cloud Run）"""
     return os.getenv("CLOUDSQL_CONNECTION_NAME")
 
 
+def _get_cloudsql_async_url(instance: str) -> str:
+    """
+    Cloud SQL 的异步连接 URL：Cloud SQL 连接器不支持 aiomysql，改用 Cloud Run
+    挂载的 unix socket（/cloudsql/<实例连接名>，需 --add-cloudsql-instances）
+    """
+    password = os.getenv("DB_PASSWORD")
+    if not password:
+        raise ValueError("DB_PASSWORD environment variable is not set! It is required with CLOUDSQL_CONNECTION_NAME.")
+    url = URL.create(
+        "mysql+aiomysql",
+        username=os.getenv("DB_USER", "jwt_user"),
+        password=password,
+        database=os.getenv("DB_NAME", "jwt_auth_db"),
+        query={"unix_socket": f"/cloudsql/{instance}"},
+    )
+    return url.render_as_string(hide_password=False)
+
+
 def _init_db():
     """初始化数据库连接（每次调用都检查 URL 是否变化）"""
     global _engine, _SessionLocal, _last_database_url
@@ -108,6 +151,32 @@ def _init_db():
         print(f"[DEBUG] Reusing existing engine", file=sys.stderr)
 
 
+def _init_async_db():
+    """初始化异步数据库连接（URL 变化时重新创建）"""
+    global _async_engine, _AsyncSessionLocal, _last_async_database_url
+
+    cloudsql_instance = _get_cloudsql_instance_name()
+    current_url = _get_cloudsql_async_url(cloudsql_instance) if cloudsql_instance else _get_async_database_url()
+
+    if _async_engine is None or current_url != _last_async_database_url:
+        if cloudsql_instance:
+            logger.info(f"Async engine connects to Cloud SQL instance {cloudsql_instance} over its unix socket")
+
+        _async_engine = create_async_engine(
+            current_url,
+            pool_pre_ping=True,
+            pool_recycle=3600,
+        )
+        # expire_on_commit=False：提交后仍可读取对象属性，避免在异步上下文中触发隐式 IO
+        _AsyncSessionLocal = async_sessionmaker(
+            bind=_async_engine,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+        _last_async_database_url = current_url
+
+
 def get_engine():
     """获取数据库引擎"""
     _init_db()
@@ -140,12 +209,49 @@ def get_db_session() -> Session:
     return _SessionLocal()
 
 
+def get_async_engine():
+    """获取异步数据库引擎"""
+    _init_async_db()
+    return _async_engine
+
+
+async def get_async_db():
+    """获取异步数据库会话（用于FastAPI依赖注入，get_db 的异步版本）"""
+    _init_async_db()
+    async with _AsyncSessionLocal() as db:
+        yield db
+
+
+def get_async_db_session() -> AsyncSession:
+    """
+    获取异步数据库会话（用于Service层）
+
+    注意：调用方需要负责关闭会话（await db.close()）
+    """
+    _init_async_db()
+    return _AsyncSessionLocal()
+
+
+async def dispose_async_engine():
+    """释放异步引擎的连接池（应用关闭时调用）"""
+    global _async_engine, _AsyncSessionLocal, _last_async_database_url
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    _AsyncSessionLocal = None
+    _last_async_database_url = None
+
+
 # 导出常用的函数和属性
 __all__ = [
     'get_engine',
     'get_session_factory',
     'get_db',
     'get_db_session',
+    'get_async_engine',
+    'get_async_db',
+    'get_async_db_session',
+    'dispose_async_engine',
     'engine',
     'SessionLocal',
 ]
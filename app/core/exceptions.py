@@ -40,6 +40,7 @@ class ErrorCode(str, Enum):
     # 系统错误 5xxxx
     INTERNAL_ERROR = "50001"
     DATABASE_ERROR = "50002"
+    SERVER_BUSY = "50003"
 
 
 class BizException(Exception):
@@ -0,0 +1,121 @@
+"""
+SSE frame coalescing: batch streamed LLM tokens into fewer, larger events
+"""
+import os
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional
+
+# Defaults, overridable per request
+SSE_FLUSH_INTERVAL_MS = int(os.getenv("SSE_FLUSH_INTERVAL_MS", "50"))
+SSE_FLUSH_BYTES = int(os.getenv("SSE_FLUSH_BYTES", "512"))
+# Once this much is buffered for a slow client, stop reading from upstream
+SSE_MAX_BUFFER_BYTES = int(os.getenv("SSE_MAX_BUFFER_BYTES", "65536"))
+
+
+class TokenCoalescer:
+    """
+    Reads tokens from an upstream async iterator in a background task and
+    yields them joined into frames.
+
+    A frame is flushed when flush_bytes are buffered or flush_interval_ms has
+    passed since the previous flush; the first token is flushed immediately so
+    time-to-first-token is unchanged. While the client is slow to read, tokens
+    keep accumulating into larger frames, and past max_buffer_bytes the
+    upstream is no longer read (backpressure).
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterator[str],
+        flush_interval_ms: int = SSE_FLUSH_INTERVAL_MS,
+        flush_bytes: int = SSE_FLUSH_BYTES,
+        max_buffer_bytes: int = SSE_MAX_BUFFER_BYTES,
+    ):
+        self._source = source
+        self._flush_interval = flush_interval_ms / 1000
+        self._flush_bytes = flush_bytes
+        self._max_buffer_bytes = max(max_buffer_bytes, flush_bytes)
+        self._parts: List[str] = []
+        self._size = 0
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._data_ready = asyncio.Event()
+        self._space = asyncio.Event()
+
+    async def _pump(self) -> None:
+        try:
+            async with aclosing(self._source) as source:
+                async for token in source:
+                    while self._size >= self._max_buffer_bytes:
+                        self._space.clear()
+                        await self._space.wait()
+                    self._parts.append(token)
+                    self._size += len(token.encode("utf-8"))
+                    self._data_ready.set()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done = True
+            self._data_ready.set()
+
+    def _take_frame(self) -> str:
+        frame = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        self._space.set()
+        return frame
+
+    async def frames(self) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        pump = asyncio.ensure_future(self._pump())
+        last_flush = None
+        try:
+            while True:
+                if not self._parts and not self._done:
+                    self._data_ready.clear()
+                    await self._data_ready.wait()
+
+                # Hold the frame open until it is big enough or the interval is up
+                if self._parts and last_flush is not None:
+                    deadline = last_flush + self._flush_interval
+                    while self._size < self._flush_bytes and not self._done:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        self._data_ready.clear()
+                        try:
+                            await asyncio.wait_for(self._data_ready.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            break
+
+                if self._parts:
+                    frame = self._take_frame()
+                    last_flush = loop.time()
+                    yield frame
+                elif self._done:
+                    break
+
+            if self._error is not None:
+                raise self._error
+        finally:
+            # Consumer went away or stream ended: stop upstream and let its cleanup
+            # (e.g. persisting a partial answer) finish even under cancellation.
+            # asyncio.shield rather than an anyio shielded scope, which delays
+            # delivery of the pump's cancellation by tens of milliseconds
+            if not pump.done():
+                pump.cancel()
+            await asyncio.shield(asyncio.gather(pump, return_exceptions=True))
+
+
+def coalesce_tokens(
+    source: AsyncIterator[str],
+    flush_interval_ms: Optional[int] = None,
+    flush_bytes: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """Coalesce a token stream into SSE-sized frames, using defaults for unset options."""
+    return TokenCoalescer(
+        source,
+        flush_interval_ms=SSE_FLUSH_INTERVAL_MS if flush_interval_ms is None else flush_interval_ms,
+        flush_bytes=SSE_FLUSH_BYTES if flush_bytes is None else flush_bytes,
+    ).frames()
@@ -2,11 +2,32 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from fastapi import FastAPI
+import os
+import asyncio
+import logging
+import secrets
+from typing import Optional
+from fastapi import FastAPI, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.routes import api_router
 from app.core.handlers import register_exception_handlers
+from app.core.database import get_async_engine, dispose_async_engine
+from app.core.metrics import registry as metrics_registry
+from app.services.llm_service import llm_service
+from app.services.history_builder import load_encoding
+from app.services.message_writer import message_writer
+from app.services.stream_registry import stream_registry
+from app.services.knowledge_jobs import knowledge_job_worker
+from app.services.knowledge_service import knowledge_service
+
+logger = logging.getLogger(__name__)
+
+# 启动时补齐 Neo4j 约束和索引；关闭后需手动运行 init_neo4j_schema.py
+NEO4J_SCHEMA_ON_STARTUP = os.getenv("NEO4J_SCHEMA_ON_STARTUP", "true").lower() == "true"
+# 设置后 /metrics 需携带 Authorization: Bearer <METRICS_TOKEN>；未设置时不校验，仅适合本地压测
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -30,6 +51,34 @@ app.add_middleware(
 app.include_router(api_router, prefix=settings.API_PREFIX)
 
 
+@app.on_event("startup")
+async def startup():
+    """创建异步数据库引擎（配置错误时启动失败），预加载默认模型的 tokenizer，补齐 Neo4j 约束和索引（失败不阻止启动），启动知识库文档处理任务的 worker"""
+    get_async_engine()
+    if not METRICS_TOKEN:
+        logger.warning("METRICS_TOKEN is not set, /metrics is served without authentication")
+    # 可能需要下载 BPE 文件，放到线程中执行；失败时按估算计数，稍后重试
+    await asyncio.to_thread(load_encoding, llm_service.resolve_model())
+    if NEO4J_SCHEMA_ON_STARTUP:
+        try:
+            created = await asyncio.to_thread(knowledge_service.ensure_graph_schema)
+            if created:
+                logger.info(f"Created Neo4j schema items: {', '.join(created)}")
+        except Exception as e:
+            logger.error(f"Neo4j schema bootstrap failed, run init_neo4j_schema.py: {e}")
+    knowledge_job_worker.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """停止进行中的生成和文档任务（任务放回队列），写出排队中的聊天记录，释放异步数据库连接池和 LLM HTTP 连接池"""
+    await stream_registry.aclose()
+    await knowledge_job_worker.aclose()
+    await message_writer.close()
+    await dispose_async_engine()
+    await llm_service.aclose()
+
+
 @app.get("/")
 async def root():
     return {
@@ -39,6 +88,18 @@ async def root():
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus 文本格式的指标（LLM 首 token 延迟、流式分块间隔、吞吐，对话并发与排队等），每个 worker 各自统计"""
+    if METRICS_TOKEN and not secrets.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/debug")
 async def debug():
     import os
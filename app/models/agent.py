@@ -65,6 +65,8 @@ class Agent(Base):
     appearance_settings = Column(JSONText, nullable=True, comment="外观设置")
     temperature = Column(Float, default=0.7, comment="AI温度参数")
     max_tokens = Column(Integer, default=2048, comment="最大token数")
+    llm_model = Column(String(100), nullable=True, comment="LLM模型名称，为空时使用默认模型")
+    response_cache_ttl = Column(Integer, nullable=True, comment="相同问题回答缓存有效期（秒），为空或0表示不缓存")
     system_prompt = Column(Text, nullable=True, comment="系统提示词")
 
     # 状态
@@ -14,6 +14,9 @@ class Conversation(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     title = Column(String(200), nullable=True)
     is_active = Column(Boolean, default=True)
+    # Rolling summary of all messages with id <= summary_until_message_id
+    summary = Column(Text, nullable=True)
+    summary_until_message_id = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -26,4 +29,9 @@ class Message(Base):
     role = Column(Enum("user", "assistant", "system", name="message_role_enum"), nullable=False)
     content = Column(Text, nullable=False)
     tokens_used = Column(Integer, nullable=True)
+    # Generation stats of assistant replies (empty for user messages and cached answers)
+    llm_model = Column(String(100), nullable=True)
+    ttft_ms = Column(Integer, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,7 +1,7 @@
 """
-Knowledge document model
+Knowledge document, chunk, processing job and extraction cache models
 """
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Enum, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from app.core.database import Base
 
@@ -14,6 +14,76 @@ class KnowledgeDocument(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     filename = Column(String(255), nullable=False)
     file_size = Column(Integer, nullable=False, default=0)
+    # sha256 of the uploaded bytes (hex)
+    checksum = Column(String(64), nullable=True)
     status = Column(Enum("processing", "completed", "failed", name="doc_status_enum"), default="processing")
     entity_count = Column(Integer, default=0)
+    # Chunks of the last processing run; of those, how many were unchanged since the previous version
+    # and how many of the rest came from the extraction cache (neither needed an LLM call)
+    chunk_count = Column(Integer, nullable=True)
+    unchanged_chunk_count = Column(Integer, nullable=True)
+    cached_chunk_count = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class KnowledgeDocumentChunk(Base):
+    """A chunk of a document whose extraction is in the graph; the baseline diffed against when the document is replaced."""
+    __tablename__ = "knowledge_document_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("knowledge_documents.id", ondelete="CASCADE"), nullable=False)
+    # sha256 of the chunk text (hex); entities and relations in Neo4j carry the same hashes
+    chunk_hash = Column(String(64), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("document_id", "chunk_hash", name="uq_knowledge_document_chunks"),
+    )
+
+
+class KnowledgeJob(Base):
+    """Durable queue entry for processing one uploaded document."""
+    __tablename__ = "knowledge_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("knowledge_documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    # Jobs of one agent run one at a time, in id order
+    agent_id = Column(Integer, nullable=False)
+    status = Column(Enum("queued", "running", "succeeded", "failed", name="job_status_enum"), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    # UTC; not claimable before this (retry backoff)
+    run_after = Column(DateTime, nullable=False)
+    # Worker holding the job and until when (UTC); an expired lease puts the job back in the queue
+    locked_by = Column(String(64), nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_knowledge_jobs_status_run_after", "status", "run_after"),
+        Index("ix_knowledge_jobs_agent_id_id", "agent_id", "id"),
+    )
+
+
+class ExtractionCacheEntry(Base):
+    """LLM extraction result of one chunk, shared by every document and agent with the same chunk text."""
+    __tablename__ = "extraction_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # sha256 of the chunk text (hex)
+    chunk_hash = Column(String(64), nullable=False)
+    prompt_version = Column(String(16), nullable=False)
+    model = Column(String(100), nullable=False)
+    # {"entities": [...], "relations": [...]} as JSON
+    result = Column(Text, nullable=False)
+    size = Column(Integer, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # UTC; least recently used entries are evicted first
+    last_used_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("chunk_hash", "prompt_version", "model", name="uq_extraction_cache_key"),
+        Index("ix_extraction_cache_last_used_at", "last_used_at"),
+    )
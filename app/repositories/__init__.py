@@ -1,3 +1,9 @@
-from app.repositories.conversation_repo import ConversationRepository, conversation_repository
+from app.repositories.conversation_repo import (
+    ConversationRepository, conversation_repository,
+    AsyncConversationRepository, async_conversation_repository,
+)
 
-__all__ = ["ConversationRepository", "conversation_repository"]
+__all__ = [
+    "ConversationRepository", "conversation_repository",
+    "AsyncConversationRepository", "async_conversation_repository",
+]
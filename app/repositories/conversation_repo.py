@@ -1,13 +1,29 @@
 """
 Conversation CRUD operations
 """
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
+from sqlalchemy import select, update, insert, bindparam
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.conversation import MessageRole
 from app.models.conversation import Conversation, Message
 from app.schemas.conversation import ConversationCreate
 
 
+def _summary_update(conversation_id: int, summary: str, until_message_id: int, expected_until_id: Optional[int]):
+    """Compare-and-set UPDATE for the summary checkpoint, so concurrent summarizers cannot go backwards."""
+    stmt = update(Conversation).where(Conversation.id == conversation_id)
+    if expected_until_id is None:
+        stmt = stmt.where(Conversation.summary_until_message_id.is_(None))
+    else:
+        stmt = stmt.where(Conversation.summary_until_message_id == expected_until_id)
+    return stmt.values(
+        summary=summary,
+        summary_until_message_id=until_message_id,
+        updated_at=Conversation.updated_at,
+    )
+
+
 class ConversationRepository:
     def get_conversation_by_id(self, db: Session, conversation_id: int) -> Optional[Conversation]:
         return db.query(Conversation).filter(Conversation.id == conversation_id).first()
@@ -55,18 +71,17 @@ class ConversationRepository:
         return (
             db.query(Message)
             .filter(Message.conversation_id == conversation_id)
-            .order_by(Message.created_at.asc())
+            .order_by(Message.created_at.asc(), Message.id.asc())
             .offset(skip)
             .limit(limit)
             .all()
         )
 
-    def add_message(self, db: Session, conversation_id: int, role: str, content: str, tokens_used: Optional[int] = None) -> Message:
+    def add_message(self, db: Session, conversation_id: int, role: str, content: str) -> Message:
         msg = Message(
             conversation_id=conversation_id,
             role=role,
             content=content,
-            tokens_used=tokens_used,
         )
         db.add(msg)
         db.commit()
@@ -83,4 +98,117 @@ class ConversationRepository:
         return conv
 
 
+class AsyncConversationRepository:
+    """AsyncSession version of ConversationRepository, used by request handlers."""
+
+    async def get_conversation_by_id(self, db: AsyncSession, conversation_id: int) -> Optional[Conversation]:
+        return await db.get(Conversation, conversation_id)
+
+    async def get_conversations_by_agent(self, db: AsyncSession, agent_id: int, user_id: int, skip: int = 0, limit: int = 50) -> List[Conversation]:
+        result = await db.execute(
+            select(Conversation)
+            .filter(Conversation.agent_id == agent_id, Conversation.user_id == user_id, Conversation.is_active == True)
+            .order_by(Conversation.updated_at.desc())
+            .offset(skip)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    async def get_conversations_by_user(self, db: AsyncSession, user_id: int, skip: int = 0, limit: int = 50) -> List[Conversation]:
+        result = await db.execute(
+            select(Conversation)
+            .filter(Conversation.user_id == user_id, Conversation.is_active == True)
+            .order_by(Conversation.updated_at.desc())
+            .offset(skip)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    async def create_conversation(self, db: AsyncSession, conv_create: ConversationCreate, user_id: int) -> Conversation:
+        conv = Conversation(
+            agent_id=conv_create.agent_id,
+            user_id=user_id,
+            title=conv_create.title,
+        )
+        db.add(conv)
+        await db.commit()
+        await db.refresh(conv)
+        return conv
+
+    async def delete_conversation(self, db: AsyncSession, conversation_id: int) -> bool:
+        conv = await self.get_conversation_by_id(db, conversation_id)
+        if not conv:
+            return False
+        conv.is_active = False
+        await db.commit()
+        return True
+
+    async def get_messages(self, db: AsyncSession, conversation_id: int, skip: int = 0, limit: int = 100) -> List[Message]:
+        result = await db.execute(
+            select(Message)
+            .filter(Message.conversation_id == conversation_id)
+            .order_by(Message.created_at.asc(), Message.id.asc())
+            .offset(skip)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    async def get_recent_messages(self, db: AsyncSession, conversation_id: int, limit: int = 200, after_id: Optional[int] = None) -> List[Message]:
+        """Newest messages first, optionally only those after a message id."""
+        stmt = select(Message).filter(Message.conversation_id == conversation_id)
+        if after_id is not None:
+            stmt = stmt.filter(Message.id > after_id)
+        result = await db.execute(stmt.order_by(Message.id.desc()).limit(limit))
+        return list(result.scalars().all())
+
+    async def get_messages_between(
+        self, db: AsyncSession, conversation_id: int, after_id: Optional[int], before_id: int, limit: int = 200,
+    ) -> List[Message]:
+        """Oldest first: messages with after_id < id < before_id (after_id None = from the start)."""
+        stmt = select(Message).filter(Message.conversation_id == conversation_id, Message.id < before_id)
+        if after_id is not None:
+            stmt = stmt.filter(Message.id > after_id)
+        result = await db.execute(stmt.order_by(Message.id.asc()).limit(limit))
+        return list(result.scalars().all())
+
+    async def add_message(self, db: AsyncSession, conversation_id: int, role: str, content: str, tokens_used: Optional[int] = None, refresh: bool = True) -> Message:
+        """refresh=False skips the post-insert SELECT; only id and the given fields are loaded then."""
+        msg = Message(
+            conversation_id=conversation_id,
+            role=role,
+            content=content,
+            tokens_used=tokens_used,
+        )
+        db.add(msg)
+        await db.commit()
+        if refresh:
+            await db.refresh(msg)
+        return msg
+
+    async def update_conversation_summary(self, db: AsyncSession, conversation_id: int, summary: str, until_message_id: int, expected_until_id: Optional[int] = None) -> bool:
+        """Advance the summary checkpoint if it is still at expected_until_id. Leaves updated_at untouched."""
+        result = await db.execute(_summary_update(conversation_id, summary, until_message_id, expected_until_id))
+        await db.commit()
+        return result.rowcount > 0
+
+    async def write_batch(self, db: AsyncSession, messages: List[Dict[str, Any]], titles: Dict[int, str]) -> None:
+        """
+        Write queued title updates and messages in one transaction.
+
+        Messages go out as a single multi-row INSERT (in insertion order, so ids
+        follow it); titles as one executemany UPDATE. Updates of missing
+        conversations match no row and are ignored.
+        """
+        if titles:
+            table = Conversation.__table__
+            await db.execute(
+                update(table).where(table.c.id == bindparam("conv_id")).values(title=bindparam("conv_title")),
+                [{"conv_id": cid, "conv_title": title} for cid, title in titles.items()],
+            )
+        if messages:
+            await db.execute(insert(Message).values(messages))
+        await db.commit()
+
+
 conversation_repository = ConversationRepository()
+async_conversation_repository = AsyncConversationRepository()
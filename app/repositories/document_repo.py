@@ -1,9 +1,11 @@
 """
 Knowledge document MySQL repository
 """
-from typing import Optional, List
+from typing import Optional, List, Set
+from sqlalchemy import select, delete, insert
 from sqlalchemy.orm import Session
-from app.models.knowledge import KnowledgeDocument
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.knowledge import KnowledgeDocument, KnowledgeDocumentChunk
 
 
 class DocumentRepository:
@@ -20,19 +22,37 @@ class DocumentRepository:
             .all()
         )
 
-    def create(self, db: Session, agent_id: int, user_id: int, filename: str, file_size: int) -> KnowledgeDocument:
+    def create(
+        self, db: Session, agent_id: int, user_id: int, filename: str, file_size: int,
+        checksum: Optional[str] = None, commit: bool = True,
+    ) -> KnowledgeDocument:
+        """commit=False only flushes (the id is assigned), so the caller can add more in the same transaction."""
         doc = KnowledgeDocument(
             agent_id=agent_id,
             user_id=user_id,
             filename=filename,
             file_size=file_size,
+            checksum=checksum,
             status="processing",
+            entity_count=0,
         )
         db.add(doc)
+        if not commit:
+            db.flush()
+            return doc
         db.commit()
         db.refresh(doc)
         return doc
 
+    def replace_file(self, db: Session, doc: KnowledgeDocument, filename: str, file_size: int, checksum: str) -> KnowledgeDocument:
+        """Point a document at a new upload and mark it processing; only flushes, the caller commits."""
+        doc.filename = filename
+        doc.file_size = file_size
+        doc.checksum = checksum
+        doc.status = "processing"
+        db.flush()
+        return doc
+
     def update_status(self, db: Session, doc_id: int, status: str, entity_count: int = 0) -> Optional[KnowledgeDocument]:
         doc = self.get_by_id(db, doc_id)
         if not doc:
@@ -52,4 +72,60 @@ class DocumentRepository:
         return True
 
 
+class AsyncDocumentRepository:
+    """AsyncSession version of DocumentRepository, used by request handlers."""
+
+    async def get_by_id(self, db: AsyncSession, doc_id: int) -> Optional[KnowledgeDocument]:
+        return await db.get(KnowledgeDocument, doc_id)
+
+    async def get_by_agent(self, db: AsyncSession, agent_id: int, user_id: int, skip: int = 0, limit: int = 50) -> List[KnowledgeDocument]:
+        result = await db.execute(
+            select(KnowledgeDocument)
+            .filter(KnowledgeDocument.agent_id == agent_id, KnowledgeDocument.user_id == user_id)
+            .order_by(KnowledgeDocument.created_at.desc())
+            .offset(skip)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    async def update_status(
+        self, db: AsyncSession, doc_id: int, status: str, entity_count: int = 0,
+        chunk_count: Optional[int] = None, unchanged_chunk_count: Optional[int] = None,
+        cached_chunk_count: Optional[int] = None,
+    ) -> Optional[KnowledgeDocument]:
+        doc = await self.get_by_id(db, doc_id)
+        if not doc:
+            return None
+        doc.status = status
+        doc.entity_count = entity_count
+        if chunk_count is not None:
+            doc.chunk_count = chunk_count
+            doc.unchanged_chunk_count = unchanged_chunk_count
+            doc.cached_chunk_count = cached_chunk_count
+        await db.commit()
+        await db.refresh(doc)
+        return doc
+
+    async def get_chunk_hashes(self, db: AsyncSession, doc_id: int) -> Set[str]:
+        result = await db.execute(
+            select(KnowledgeDocumentChunk.chunk_hash).filter(KnowledgeDocumentChunk.document_id == doc_id)
+        )
+        return set(result.scalars().all())
+
+    async def set_chunk_hashes(self, db: AsyncSession, doc_id: int, hashes: Set[str]) -> None:
+        """Make hashes the document's stored chunk set, touching only the rows that change."""
+        current = await self.get_chunk_hashes(db, doc_id)
+        removed = current - hashes
+        added = hashes - current
+        if removed:
+            await db.execute(
+                delete(KnowledgeDocumentChunk)
+                .where(KnowledgeDocumentChunk.document_id == doc_id, KnowledgeDocumentChunk.chunk_hash.in_(removed))
+            )
+        if added:
+            await db.execute(insert(KnowledgeDocumentChunk), [{"document_id": doc_id, "chunk_hash": h} for h in added])
+        await db.commit()
+
+
 document_repository = DocumentRepository()
+async_document_repository = AsyncDocumentRepository()
@@ -0,0 +1,80 @@
+"""
+LLM extraction cache repository (MySQL)
+"""
+from typing import Dict, List, Tuple
+from sqlalchemy import select, update, delete, insert, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.knowledge import ExtractionCacheEntry
+from app.repositories.job_repo import utcnow
+
+
+class AsyncExtractionCacheRepository:
+    async def get_many(self, db: AsyncSession, chunk_hashes: List[str], prompt_version: str, model: str) -> Dict[str, Tuple[int, str]]:
+        """chunk hash -> (entry id, result JSON) for the hashes that are cached, in one query."""
+        if not chunk_hashes:
+            return {}
+        result = await db.execute(
+            select(ExtractionCacheEntry.id, ExtractionCacheEntry.chunk_hash, ExtractionCacheEntry.result)
+            .filter(
+                ExtractionCacheEntry.chunk_hash.in_(set(chunk_hashes)),
+                ExtractionCacheEntry.prompt_version == prompt_version,
+                ExtractionCacheEntry.model == model,
+            )
+        )
+        return {row.chunk_hash: (row.id, row.result) for row in result}
+
+    async def touch(self, db: AsyncSession, entry_ids: List[int]) -> None:
+        """Count a hit and mark the entries as recently used."""
+        if not entry_ids:
+            return
+        await db.execute(
+            update(ExtractionCacheEntry)
+            .where(ExtractionCacheEntry.id.in_(entry_ids))
+            .values(hits=ExtractionCacheEntry.hits + 1, last_used_at=utcnow())
+        )
+        await db.commit()
+
+    async def put_many(self, db: AsyncSession, rows: List[Dict]) -> None:
+        """
+        Insert {"chunk_hash", "prompt_version", "model", "result"} rows.
+
+        Keys that already exist (another worker extracted the same chunk) are skipped.
+        """
+        if not rows:
+            return
+        now = utcnow()
+        values = [dict(row, size=len(row["result"].encode("utf-8")), hits=0, last_used_at=now) for row in rows]
+        await db.execute(
+            insert(ExtractionCacheEntry).prefix_with("IGNORE", dialect="mysql"),
+            values,
+        )
+        await db.commit()
+
+    async def total_size(self, db: AsyncSession) -> int:
+        result = await db.execute(select(func.coalesce(func.sum(ExtractionCacheEntry.size), 0)))
+        return int(result.scalar_one())
+
+    async def evict(self, db: AsyncSession, bytes_to_free: int, batch_size: int = 1000) -> Tuple[int, int]:
+        """Delete least recently used entries until at least bytes_to_free are gone. Returns (entries, bytes) deleted."""
+        deleted = freed = 0
+        while freed < bytes_to_free:
+            result = await db.execute(
+                select(ExtractionCacheEntry.id, ExtractionCacheEntry.size)
+                .order_by(ExtractionCacheEntry.last_used_at, ExtractionCacheEntry.id)
+                .limit(batch_size)
+            )
+            ids = []
+            for row in result:
+                if freed >= bytes_to_free:
+                    break
+                ids.append(row.id)
+                freed += row.size
+            if not ids:
+                break
+            await db.execute(delete(ExtractionCacheEntry).where(ExtractionCacheEntry.id.in_(ids)))
+            await db.commit()
+            deleted += len(ids)
+        return deleted, freed
+
+
+async_extraction_cache_repository = AsyncExtractionCacheRepository()
@@ -0,0 +1,139 @@
+"""
+Knowledge processing job repository (MySQL-backed queue)
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List
+from sqlalchemy import select, update, and_, exists
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.knowledge import KnowledgeJob
+
+UNFINISHED = ("queued", "running")
+
+
+def utcnow() -> datetime:
+    """Naive UTC, as stored in run_after / locked_until."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class JobRepository:
+    def create(self, db: Session, document_id: int, agent_id: int, max_attempts: int, commit: bool = True) -> KnowledgeJob:
+        """commit=False only flushes, so the job is committed together with the caller's other changes."""
+        job = KnowledgeJob(
+            document_id=document_id,
+            agent_id=agent_id,
+            status="queued",
+            attempts=0,
+            max_attempts=max_attempts,
+            run_after=utcnow(),
+        )
+        db.add(job)
+        if not commit:
+            db.flush()
+            return job
+        db.commit()
+        db.refresh(job)
+        return job
+
+
+class AsyncJobRepository:
+    """Claiming, leasing and completing jobs; used by the job workers."""
+
+    async def get_latest_for_document(self, db: AsyncSession, document_id: int) -> Optional[KnowledgeJob]:
+        result = await db.execute(
+            select(KnowledgeJob)
+            .filter(KnowledgeJob.document_id == document_id)
+            .order_by(KnowledgeJob.id.desc())
+            .limit(1)
+        )
+        return result.scalars().first()
+
+    async def find_claimable(self, db: AsyncSession, limit: int) -> List[int]:
+        """
+        Ids of due queued jobs that are first in line for their agent.
+
+        A job waits while an earlier job of the same agent is queued or running,
+        so each agent's documents are processed one at a time in upload order.
+        """
+        earlier = aliased(KnowledgeJob)
+        blocked = exists().where(and_(
+            earlier.agent_id == KnowledgeJob.agent_id,
+            earlier.id < KnowledgeJob.id,
+            earlier.status.in_(UNFINISHED),
+        ))
+        result = await db.execute(
+            select(KnowledgeJob.id)
+            .filter(KnowledgeJob.status == "queued", KnowledgeJob.run_after <= utcnow(), ~blocked)
+            .order_by(KnowledgeJob.id)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    async def claim(self, db: AsyncSession, job_id: int, worker_id: str, lease_seconds: float) -> Optional[KnowledgeJob]:
+        """Take a queued job. Conditional on its status, so of several racing workers exactly one wins."""
+        result = await db.execute(
+            update(KnowledgeJob)
+            .where(KnowledgeJob.id == job_id, KnowledgeJob.status == "queued")
+            .values(
+                status="running",
+                attempts=KnowledgeJob.attempts + 1,
+                locked_by=worker_id,
+                locked_until=utcnow() + timedelta(seconds=lease_seconds),
+            )
+        )
+        await db.commit()
+        if result.rowcount != 1:
+            return None
+        return await db.get(KnowledgeJob, job_id, populate_existing=True)
+
+    async def extend_lease(self, db: AsyncSession, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+        result = await db.execute(
+            update(KnowledgeJob)
+            .where(KnowledgeJob.id == job_id, KnowledgeJob.locked_by == worker_id, KnowledgeJob.status == "running")
+            .values(locked_until=utcnow() + timedelta(seconds=lease_seconds))
+        )
+        await db.commit()
+        return result.rowcount == 1
+
+    async def finish(self, db: AsyncSession, job_id: int, worker_id: str, status: str, error: Optional[str] = None) -> None:
+        """Mark a job succeeded or failed for good."""
+        await db.execute(
+            update(KnowledgeJob)
+            .where(KnowledgeJob.id == job_id, KnowledgeJob.locked_by == worker_id)
+            .values(status=status, locked_by=None, locked_until=None, last_error=error)
+        )
+        await db.commit()
+
+    async def requeue(
+        self, db: AsyncSession, job_id: int, worker_id: str, delay_seconds: float,
+        error: Optional[str] = None, refund_attempt: bool = False,
+    ) -> None:
+        """Put a job back in the queue, after a failed attempt or on shutdown (refunding the attempt)."""
+        values = dict(
+            status="queued", locked_by=None, locked_until=None,
+            run_after=utcnow() + timedelta(seconds=delay_seconds),
+        )
+        if error is not None:
+            values["last_error"] = error
+        if refund_attempt:
+            values["attempts"] = KnowledgeJob.attempts - 1
+        await db.execute(
+            update(KnowledgeJob)
+            .where(KnowledgeJob.id == job_id, KnowledgeJob.locked_by == worker_id)
+            .values(**values)
+        )
+        await db.commit()
+
+    async def recover_expired(self, db: AsyncSession) -> int:
+        """Requeue running jobs whose worker stopped renewing the lease (crashed or was killed)."""
+        result = await db.execute(
+            update(KnowledgeJob)
+            .where(KnowledgeJob.status == "running", KnowledgeJob.locked_until < utcnow())
+            .values(status="queued", locked_by=None, locked_until=None, run_after=utcnow())
+        )
+        await db.commit()
+        return result.rowcount
+
+
+job_repository = JobRepository()
+async_job_repository = AsyncJobRepository()
@@ -5,16 +5,57 @@ import os
 import logging
 from typing import List, Dict, Optional
 from neo4j import GraphDatabase
+from neo4j.exceptions import ClientError
 
 logger = logging.getLogger(__name__)
 
+# Rows per UNWIND statement when writing a document's graph
+NEO4J_WRITE_BATCH_SIZE = int(os.getenv("NEO4J_WRITE_BATCH_SIZE", "500"))
+# How long the driver keeps retrying a write transaction on transient errors (deadlocks, leader changes)
+NEO4J_MAX_RETRY_TIME = float(os.getenv("NEO4J_MAX_RETRY_TIME", "30"))
+
+ENTITY_FULLTEXT_INDEX = "entity_fulltext"
+
+# Constraints and indexes the queries below rely on. Applied in order by
+# ensure_schema(); every statement is IF NOT EXISTS, so re-running is a no-op.
+# Append new entries rather than editing existing ones (an index whose
+# definition changes needs a new name).
+NEO4J_SCHEMA = [
+    # Backs MERGE/MATCH on (:Document {id}) and keeps one node per MySQL document
+    ("document_id_unique",
+     "CREATE CONSTRAINT document_id_unique IF NOT EXISTS FOR (d:Document) REQUIRE d.id IS UNIQUE"),
+    # Graph, retrieval and matcher queries filter on the agent
+    ("entity_agent_id",
+     "CREATE INDEX entity_agent_id IF NOT EXISTS FOR (e:Entity) ON (e.agent_id)"),
+    # MERGE of entities and relation endpoints while writing a document
+    ("entity_document_name",
+     "CREATE INDEX entity_document_name IF NOT EXISTS FOR (e:Entity) ON (e.document_id, e.name)"),
+    # Entity search; the cjk analyzer indexes Chinese text as bigrams
+    (ENTITY_FULLTEXT_INDEX,
+     f"CREATE FULLTEXT INDEX {ENTITY_FULLTEXT_INDEX} IF NOT EXISTS FOR (e:Entity) ON EACH [e.name, e.description] "
+     "OPTIONS {indexConfig: {`fulltext.analyzer`: 'cjk'}}"),
+]
+
+_LUCENE_SPECIAL = set('+-&|!(){}[]^"~*?:\\/')
+
+
+def _fulltext_query(text: str) -> str:
+    """User input as plain Lucene terms: operators escaped, AND/OR/NOT lowercased into words."""
+    return "".join("\\" + c if c in _LUCENE_SPECIAL else c for c in text.lower())
+
+
+def _batches(rows: List[Dict], size: int):
+    size = max(size, 1)
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
 
 class KnowledgeRepository:
     def __init__(self):
         uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
         user = os.getenv("NEO4J_USER", "neo4j")
         password = os.getenv("NEO4J_PASSWORD", "knowledge_graph_password")
-        self._driver = GraphDatabase.driver(uri, auth=(user, password))
+        self._driver = GraphDatabase.driver(uri, auth=(user, password), max_transaction_retry_time=NEO4J_MAX_RETRY_TIME)
 
     def close(self):
         self._driver.close()
@@ -22,57 +63,153 @@ class KnowledgeRepository:
     def _get_session(self):
         return self._driver.session()
 
-    def store_entities_and_relations(
+    def ensure_schema(self, wait_seconds: Optional[float] = None) -> List[str]:
+        """
+        Create missing constraints and indexes. Returns the names of those created.
+
+        A statement that fails (e.g. the uniqueness constraint over existing
+        duplicates) is logged and the rest still run; RuntimeError is raised
+        at the end. With wait_seconds, also waits for indexes still being
+        populated to come online.
+        """
+        created, failed = [], []
+        with self._get_session() as session:
+            for name, statement in NEO4J_SCHEMA:
+                try:
+                    counters = session.run(statement).consume().counters
+                except ClientError as e:
+                    logger.error(f"Neo4j schema item {name} could not be created: {e}")
+                    failed.append(name)
+                    continue
+                if counters.constraints_added or counters.indexes_added:
+                    created.append(name)
+            if wait_seconds:
+                session.run("CALL db.awaitIndexes($timeout)", timeout=int(wait_seconds)).consume()
+        if failed:
+            raise RuntimeError(f"Neo4j schema items failed: {', '.join(failed)}")
+        return created
+
+    def apply_document_changes(
         self,
         document_id: int,
         agent_id: int,
-        entities: List[Dict],
-        relations: List[Dict],
-    ) -> int:
-        """Store extracted entities and relations. Returns count of entities stored."""
-        entity_count = 0
+        removed_chunks: List[str],
+        added_chunks: List[Dict],
+        rebuild: bool = False,
+    ) -> List[str]:
+        """
+        Bring a document's subgraph in line with its current chunks. Returns the document's entity names afterwards.
+
+        Every entity and relation carries the hashes of the chunks it was
+        extracted from (chunks). Hashes in removed_chunks are retracted, and
+        what no remaining chunk mentions is deleted. added_chunks is a list of
+        {"hash", "entities", "relations"}, merged in order, so an entity keeps
+        the type and description of its first mention. rebuild first drops the
+        whole subgraph, for documents stored before chunk hashes were tracked.
+
+        Runs as one write transaction (retried by the driver on transient
+        errors) of UNWIND statements of at most NEO4J_WRITE_BATCH_SIZE rows.
+        """
+        entity_rows, relation_rows = [], []
+        for chunk in added_chunks:
+            for e in chunk["entities"]:
+                entity_rows.append({
+                    "name": e["name"], "type": e.get("type", "Concept"), "desc": e.get("description", ""), "hash": chunk["hash"],
+                })
+            for r in chunk["relations"]:
+                if r.get("from") and r.get("to"):
+                    relation_rows.append({
+                        "from_name": r["from"],
+                        "to_name": r["to"],
+                        "relation": r.get("relation", "RELATED_TO"),
+                        "desc": r.get("description", ""),
+                        "hash": chunk["hash"],
+                    })
         with self._get_session() as session:
-            # Create document node
-            session.run(
-                "MERGE (d:Document {id: $doc_id}) SET d.agent_id = $agent_id",
-                doc_id=document_id,
-                agent_id=agent_id,
+            return session.execute_write(
+                self._write_document_changes, document_id, agent_id, rebuild, removed_chunks, entity_rows, relation_rows,
             )
 
-            # Create entity nodes
-            for entity in entities:
-                session.run(
-                    """
-                    MERGE (e:Entity {name: $name, document_id: $doc_id})
-                    SET e.type = $type, e.description = $desc, e.agent_id = $agent_id
-                    WITH e
-                    MATCH (d:Document {id: $doc_id})
-                    MERGE (d)-[:CONTAINS]->(e)
-                    """,
-                    name=entity["name"],
-                    type=entity.get("type", "Concept"),
-                    desc=entity.get("description", ""),
-                    doc_id=document_id,
-                    agent_id=agent_id,
-                )
-                entity_count += 1
-
-            # Create relationships
-            for rel in relations:
-                session.run(
-                    """
-                    MATCH (e1:Entity {name: $from_name, document_id: $doc_id})
-                    MATCH (e2:Entity {name: $to_name, document_id: $doc_id})
-                    MERGE (e1)-[:RELATED_TO {relation: $relation, description: $desc}]->(e2)
-                    """,
-                    from_name=rel["from"],
-                    to_name=rel["to"],
-                    relation=rel.get("relation", "RELATED_TO"),
-                    desc=rel.get("description", ""),
-                    doc_id=document_id,
-                )
+    @staticmethod
+    def _write_document_changes(
+        tx, document_id: int, agent_id: int, rebuild: bool, removed_chunks: List[str],
+        entity_rows: List[Dict], relation_rows: List[Dict],
+    ) -> List[str]:
+        # Must stay idempotent: the driver re-runs it on transient failures, and a failed job re-runs it later
+        if rebuild:
+            tx.run("MATCH (e:Entity {document_id: $doc_id}) DETACH DELETE e", doc_id=document_id).consume()
+        tx.run(
+            "MERGE (d:Document {id: $doc_id}) SET d.agent_id = $agent_id",
+            doc_id=document_id,
+            agent_id=agent_id,
+        ).consume()
+        if removed_chunks:
+            tx.run(
+                """
+                MATCH (:Entity {document_id: $doc_id})-[r:RELATED_TO]->()
+                WHERE any(h IN coalesce(r.chunks, []) WHERE h IN $removed)
+                SET r.chunks = [h IN r.chunks WHERE NOT h IN $removed]
+                WITH r WHERE size(r.chunks) = 0
+                DELETE r
+                """,
+                doc_id=document_id,
+                removed=removed_chunks,
+            ).consume()
+            tx.run(
+                """
+                MATCH (e:Entity {document_id: $doc_id})
+                WHERE any(h IN coalesce(e.chunks, []) WHERE h IN $removed)
+                SET e.chunks = [h IN e.chunks WHERE NOT h IN $removed]
+                WITH e WHERE size(e.chunks) = 0
+                DETACH DELETE e
+                """,
+                doc_id=document_id,
+                removed=removed_chunks,
+            ).consume()
+        for batch in _batches(entity_rows, NEO4J_WRITE_BATCH_SIZE):
+            tx.run(
+                """
+                MATCH (d:Document {id: $doc_id})
+                UNWIND $rows AS row
+                MERGE (e:Entity {name: row.name, document_id: $doc_id})
+                ON CREATE SET e.type = row.type, e.description = row.desc, e.agent_id = $agent_id, e.chunks = []
+                SET e.chunks = CASE WHEN row.hash IN coalesce(e.chunks, []) THEN e.chunks
+                                    ELSE coalesce(e.chunks, []) + row.hash END
+                MERGE (d)-[:CONTAINS]->(e)
+                """,
+                rows=batch,
+                doc_id=document_id,
+                agent_id=agent_id,
+            ).consume()
+        for batch in _batches(relation_rows, NEO4J_WRITE_BATCH_SIZE):
+            tx.run(
+                """
+                UNWIND $rows AS row
+                MATCH (e1:Entity {name: row.from_name, document_id: $doc_id})
+                MATCH (e2:Entity {name: row.to_name, document_id: $doc_id})
+                MERGE (e1)-[r:RELATED_TO {relation: row.relation, description: row.desc}]->(e2)
+                SET r.chunks = CASE WHEN row.hash IN coalesce(r.chunks, []) THEN r.chunks
+                                    ELSE coalesce(r.chunks, []) + row.hash END
+                """,
+                rows=batch,
+                doc_id=document_id,
+            ).consume()
+        result = tx.run("MATCH (e:Entity {document_id: $doc_id}) RETURN e.name AS name", doc_id=document_id)
+        return [record["name"] for record in result]
 
-        return entity_count
+    def get_document_entity_names(self, document_id: int, removed_chunks: List[str]) -> List[str]:
+        """Names of a document's entities that some chunk other than removed_chunks still mentions."""
+        with self._get_session() as session:
+            result = session.run(
+                """
+                MATCH (e:Entity {document_id: $doc_id})
+                WHERE any(h IN coalesce(e.chunks, []) WHERE NOT h IN $removed)
+                RETURN e.name AS name
+                """,
+                doc_id=document_id,
+                removed=removed_chunks,
+            )
+            return [record["name"] for record in result]
 
     def get_graph_data(self, agent_id: int) -> Dict:
         """Get all nodes and edges for an agent's knowledge graph."""
@@ -115,36 +252,107 @@ class KnowledgeRepository:
 
         return {"nodes": nodes, "edges": edges}
 
-    def search_entities(self, agent_id: int, query: str) -> List[Dict]:
-        """Search entities by name (case-insensitive partial match)."""
+    def search_entities(self, agent_id: int, query: str, limit: int = 20) -> List[Dict]:
+        """
+        Search entities by name and description through the full-text index, best match first.
+
+        Falls back to a substring match on the name when the full-text search finds
+        nothing (partial words) or the index has not been created yet.
+        """
+        with self._get_session() as session:
+            records = []
+            terms = _fulltext_query(query).strip()
+            if terms:
+                try:
+                    records = list(session.run(
+                        f"""
+                        CALL db.index.fulltext.queryNodes('{ENTITY_FULLTEXT_INDEX}', $terms) YIELD node, score
+                        WHERE node.agent_id = $agent_id
+                        RETURN node.name AS name, node.type AS type, node.description AS description
+                        ORDER BY score DESC
+                        LIMIT $limit
+                        """,
+                        terms=terms,
+                        agent_id=agent_id,
+                        limit=limit,
+                    ))
+                except ClientError as e:
+                    logger.warning(f"Full-text entity search unavailable, using substring match: {e}")
+            if not records:
+                records = list(session.run(
+                    """
+                    MATCH (e:Entity {agent_id: $agent_id})
+                    WHERE e.name CONTAINS $query
+                    RETURN e.name AS name, e.type AS type, e.description AS description
+                    LIMIT $limit
+                    """,
+                    agent_id=agent_id,
+                    query=query,
+                    limit=limit,
+                ))
+            return [{"id": r["name"], "name": r["name"], "type": r["type"], "description": r["description"]} for r in records]
+
+    def get_entity_names(self, agent_id: int) -> List[Dict]:
+        """All (name, document_id) pairs of an agent's entities, for the chat entity matcher."""
+        with self._get_session() as session:
+            result = session.run(
+                "MATCH (e:Entity {agent_id: $agent_id}) RETURN e.name AS name, e.document_id AS doc_id",
+                agent_id=agent_id,
+            )
+            return [{"name": r["name"], "document_id": r["doc_id"]} for r in result]
+
+    def get_neighborhoods(self, agent_id: int, names: List[str], limit: int = 10) -> Dict[str, Dict]:
+        """
+        Entities with their 1-hop RELATED_TO neighborhood, in one round trip.
+
+        Returns name -> {"type", "description", "relations": [(source, relation, target)]}.
+        Names present in several documents are merged.
+        """
+        result_map: Dict[str, Dict] = {}
         with self._get_session() as session:
             result = session.run(
                 """
-                MATCH (e:Entity {agent_id: $agent_id})
-                WHERE e.name CONTAINS $query
-                RETURN e.name AS name, e.type AS type, e.description AS description
-                LIMIT 20
+                UNWIND $names AS name
+                MATCH (e:Entity {agent_id: $agent_id, name: name})
+                OPTIONAL MATCH (e)-[r:RELATED_TO]-(:Entity)
+                RETURN name, e.type AS type, e.description AS description,
+                       collect(CASE WHEN r IS NULL THEN NULL
+                               ELSE [startNode(r).name, r.relation, endNode(r).name] END)[..$limit] AS relations
                 """,
                 agent_id=agent_id,
-                query=query,
+                names=names,
+                limit=limit,
             )
-            return [{"id": r["name"], "name": r["name"], "type": r["type"], "description": r["description"]} for r in result]
+            for record in result:
+                entry = result_map.setdefault(record["name"], {"type": None, "description": None, "relations": []})
+                entry["type"] = entry["type"] or record["type"]
+                if record["description"] and not entry["description"]:
+                    entry["description"] = record["description"]
+                for rel in record["relations"]:
+                    triple = tuple(rel)
+                    if triple not in entry["relations"] and len(entry["relations"]) < limit:
+                        entry["relations"].append(triple)
+        return result_map
 
     def delete_document_data(self, document_id: int) -> bool:
         """Delete all entities and relations for a document."""
         with self._get_session() as session:
-            session.run(
-                """
-                MATCH (e:Entity {document_id: $doc_id})
-                DETACH DELETE e
-                """,
-                doc_id=document_id,
-            )
-            session.run(
-                "MATCH (d:Document {id: $doc_id}) DELETE d",
-                doc_id=document_id,
-            )
+            session.execute_write(self._delete_document, document_id)
         return True
 
+    @staticmethod
+    def _delete_document(tx, document_id: int) -> None:
+        tx.run(
+            """
+            MATCH (e:Entity {document_id: $doc_id})
+            DETACH DELETE e
+            """,
+            doc_id=document_id,
+        ).consume()
+        tx.run(
+            "MATCH (d:Document {id: $doc_id}) DETACH DELETE d",
+            doc_id=document_id,
+        ).consume()
+
 
 knowledge_repository = KnowledgeRepository()
@@ -33,6 +33,8 @@ class AgentCreate(AgentBase):
     appearance_settings: Optional[Dict[str, Any]] = Field(None, description="外观设置")
     temperature: Optional[float] = Field(0.7, ge=0, le=2, description="AI温度参数")
     max_tokens: Optional[int] = Field(2048, ge=1, le=8192, description="最大token数")
+    llm_model: Optional[str] = Field(None, max_length=100, description="LLM模型名称，不传则使用默认模型")
+    response_cache_ttl: Optional[int] = Field(None, ge=0, le=604800, description="相同问题回答缓存有效期（秒），适合低温度的问答类数字人，不传或0表示不缓存")
     system_prompt: Optional[str] = Field(None, description="系统提示词")
     is_active: Optional[bool] = Field(True, description="是否激活")
 
@@ -53,6 +55,8 @@ class AgentUpdate(BaseModel):
     appearance_settings: Optional[Dict[str, Any]] = None
     temperature: Optional[float] = Field(None, ge=0, le=2)
     max_tokens: Optional[int] = Field(None, ge=1, le=8192)
+    llm_model: Optional[str] = Field(None, max_length=100)
+    response_cache_ttl: Optional[int] = Field(None, ge=0, le=604800)
     system_prompt: Optional[str] = None
     is_active: Optional[bool] = None
 
@@ -71,6 +75,8 @@ class AgentResponse(AgentBase):
     appearance_settings: Optional[Dict[str, Any]] = None
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 2048
+    llm_model: Optional[str] = None
+    response_cache_ttl: Optional[int] = None
     system_prompt: Optional[str] = None
     is_active: bool = True
     created_at: Optional[datetime] = None
@@ -36,6 +36,10 @@ class MessageResponse(BaseModel):
     role: MessageRole
     content: str
     tokens_used: Optional[int]
+    llm_model: Optional[str] = None
+    ttft_ms: Optional[int] = None
+    duration_ms: Optional[int] = None
+    output_tokens: Optional[int] = None
     created_at: Optional[datetime]
 
     model_config = {"from_attributes": True}
@@ -43,6 +47,9 @@ class MessageResponse(BaseModel):
 
 class ChatRequest(BaseModel):
     content: str = Field(..., min_length=1, max_length=10000)
+    # SSE frame coalescing; unset uses the server defaults, flush_interval_ms=0 sends every token as it arrives
+    flush_interval_ms: Optional[int] = Field(None, ge=0, le=1000)
+    flush_bytes: Optional[int] = Field(None, ge=1, le=65536)
 
 
 class ConversationListRequest(BaseModel):
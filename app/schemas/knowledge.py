@@ -19,13 +19,40 @@ class KnowledgeDocumentResponse(BaseModel):
     user_id: int
     filename: str
     file_size: int
+    checksum: Optional[str] = None
     status: DocStatus
     entity_count: int
+    chunk_count: Optional[int] = None
+    unchanged_chunk_count: Optional[int] = None
+    cached_chunk_count: Optional[int] = None
     created_at: Optional[datetime]
 
     model_config = {"from_attributes": True}
 
 
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+class DocumentStatusResponse(BaseModel):
+    id: int
+    status: DocStatus
+    entity_count: int
+    chunk_count: Optional[int] = None
+    unchanged_chunk_count: Optional[int] = None
+    cached_chunk_count: Optional[int] = None
+    # Share of the last run's extraction cache lookups that hit (unchanged chunks are not looked up)
+    cache_hit_ratio: Optional[float] = None
+    job_status: Optional[JobStatus] = None
+    attempts: int = 0
+    max_attempts: int = 0
+    last_error: Optional[str] = None
+    updated_at: Optional[datetime] = None
+
+
 class DocumentListRequest(BaseModel):
     agent_id: int
     skip: int = Field(0, ge=0)
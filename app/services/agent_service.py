@@ -1,8 +1,10 @@
 """Agent service layer - 数字人业务逻辑层"""
 from typing import List
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.agent import AgentCreate, AgentUpdate, AgentResponse
-from app.agent_repo.agent import AgentRepository
+from app.agent_repo.agent import AsyncAgentRepository
+from app.services.context_cache import context_cache
+from app.services.response_cache import response_cache
 from app.core.exceptions import (
     NotFoundException,
     PermissionDeniedException,
@@ -14,7 +16,7 @@ from app.core.exceptions import (
 class AgentService:
     """数字人业务逻辑服务类"""
 
-    def __init__(self, agent_repo: AgentRepository):
+    def __init__(self, agent_repo: AsyncAgentRepository):
         """初始化服务
 
         Args:
@@ -22,7 +24,7 @@ class AgentService:
         """
         self._agent_repo = agent_repo
 
-    def get_agents_by_user_id(self, db: Session, user_id: int, skip: int = 0, limit: int = 100) -> List[AgentResponse]:
+    async def get_agents_by_user_id(self, db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100) -> List[AgentResponse]:
         """获取用户的数字人列表
 
         Args:
@@ -34,10 +36,10 @@ class AgentService:
         Returns:
             数字人响应列表
         """
-        agents = self._agent_repo.get_agents_by_user_id(db, user_id, skip, limit)
+        agents = await self._agent_repo.get_agents_by_user_id(db, user_id, skip, limit)
         return [AgentResponse.model_validate(a) for a in agents]
 
-    def get_agent_by_id(self, db: Session, agent_id: int, user_id: int) -> AgentResponse:
+    async def get_agent_by_id(self, db: AsyncSession, agent_id: int, user_id: int) -> AgentResponse:
         """根据ID获取数字人
 
         Args:
@@ -52,14 +54,14 @@ class AgentService:
             NotFoundException: 数字人不存在
             PermissionDeniedException: 无权限访问
         """
-        agent = self._agent_repo.get_agent_by_id(db, agent_id)
+        agent = await self._agent_repo.get_agent_by_id(db, agent_id)
         if not agent:
             raise NotFoundException("Agent not found", ErrorCode.AGENT_NOT_FOUND)
         if agent.user_id != user_id:
             raise PermissionDeniedException("No permission to access this agent")
         return AgentResponse.model_validate(agent)
 
-    def create_agent(self, db: Session, agent_create: AgentCreate, user_id: int) -> AgentResponse:
+    async def create_agent(self, db: AsyncSession, agent_create: AgentCreate, user_id: int) -> AgentResponse:
         """创建数字人
 
         Args:
@@ -70,10 +72,10 @@ class AgentService:
         Returns:
             创建的数字人响应对象
         """
-        created_agent = self._agent_repo.create_agent(db, agent_create, user_id)
+        created_agent = await self._agent_repo.create_agent(db, agent_create, user_id)
         return AgentResponse.model_validate(created_agent)
 
-    def update_agent(self, db: Session, agent_id: int, agent_update: AgentUpdate, user_id: int) -> AgentResponse:
+    async def update_agent(self, db: AsyncSession, agent_id: int, agent_update: AgentUpdate, user_id: int) -> AgentResponse:
         """更新数字人
 
         Args:
@@ -89,18 +91,21 @@ class AgentService:
             NotFoundException: 数字人不存在
             PermissionDeniedException: 无权限修改
         """
-        existing_agent = self._agent_repo.get_agent_by_id(db, agent_id)
+        existing_agent = await self._agent_repo.get_agent_by_id(db, agent_id)
         if not existing_agent:
             raise NotFoundException("Agent not found", ErrorCode.AGENT_NOT_FOUND)
         if existing_agent.user_id != user_id:
             raise PermissionDeniedException("No permission to update this agent")
 
-        updated_agent = self._agent_repo.update_agent(db, agent_id, agent_update)
+        updated_agent = await self._agent_repo.update_agent(db, agent_id, agent_update)
         if not updated_agent:
             raise BizException(ErrorCode.AGENT_UPDATE_FAILED, "Failed to update agent")
+        # 对话上下文缓存中保存了数字人配置，回答缓存依赖提示词和模型，更新后都需要失效
+        context_cache.invalidate_agent(agent_id)
+        response_cache.invalidate_agent(agent_id)
         return AgentResponse.model_validate(updated_agent)
 
-    def delete_agent(self, db: Session, agent_id: int, user_id: int) -> bool:
+    async def delete_agent(self, db: AsyncSession, agent_id: int, user_id: int) -> bool:
         """删除数字人
 
         Args:
@@ -115,17 +120,19 @@ class AgentService:
             NotFoundException: 数字人不存在
             PermissionDeniedException: 无权限删除
         """
-        existing_agent = self._agent_repo.get_agent_by_id(db, agent_id)
+        existing_agent = await self._agent_repo.get_agent_by_id(db, agent_id)
         if not existing_agent:
             raise NotFoundException("Agent not found", ErrorCode.AGENT_NOT_FOUND)
         if existing_agent.user_id != user_id:
             raise PermissionDeniedException("No permission to delete this agent")
 
-        success = self._agent_repo.delete_agent(db, agent_id)
+        success = await self._agent_repo.delete_agent(db, agent_id)
+        context_cache.invalidate_agent(agent_id)
+        response_cache.invalidate_agent(agent_id)
         if not success:
             raise BizException(ErrorCode.AGENT_DELETE_FAILED, "Failed to delete agent")
         return True
 
 
 # 创建默认实例供导入使用
-agent_service = AgentService(AgentRepository())
+agent_service = AgentService(AsyncAgentRepository())
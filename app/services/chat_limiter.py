@@ -0,0 +1,217 @@
+"""
+Admission control for streaming chat: global and per-user concurrency limits with a fair wait queue
+"""
+import os
+import asyncio
+import bisect
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Tuple
+from app.core.exceptions import BizException, ErrorCode
+from app.core.metrics import registry
+
+# Generations running at once on this worker
+CHAT_MAX_CONCURRENT_STREAMS = int(os.getenv("CHAT_MAX_CONCURRENT_STREAMS", "64"))
+CHAT_MAX_STREAMS_PER_USER = int(os.getenv("CHAT_MAX_STREAMS_PER_USER", "2"))
+# Requests allowed to wait for a slot; beyond this they are rejected at once
+CHAT_STREAM_QUEUE_SIZE = int(os.getenv("CHAT_STREAM_QUEUE_SIZE", "256"))
+CHAT_STREAM_QUEUE_TIMEOUT = float(os.getenv("CHAT_STREAM_QUEUE_TIMEOUT", "10"))
+
+# Upper bounds (seconds) of the wait-time histogram buckets
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+QUEUE_WAIT = registry.histogram(
+    "chat_queue_wait_seconds", "Time a chat request waited for a stream slot (0 when admitted at once)", (), WAIT_BUCKETS,
+)
+QUEUE_TIMEOUTS = registry.counter(
+    "chat_queue_timeouts", "Chat requests rejected after waiting CHAT_STREAM_QUEUE_TIMEOUT for a slot",
+)
+
+
+class StreamPermit:
+    """A granted slot. release() is idempotent, so every exit path may call it."""
+
+    def __init__(self, limiter: "ChatLimiter", user_id: int):
+        self._limiter = limiter
+        self._user_id = user_id
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._limiter._release(self._user_id)
+
+
+class ChatLimiter:
+    """
+    Per-worker limiter in front of chat generation.
+
+    A request runs at once if both the global and its user's limit allow it.
+    Otherwise it waits in its user's FIFO queue. Freed slots go round-robin
+    across users with waiters, skipping users at their own limit, so one
+    user's burst cannot push other users to the back of a single long line.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = CHAT_MAX_CONCURRENT_STREAMS,
+        max_per_user: int = CHAT_MAX_STREAMS_PER_USER,
+        max_queue: int = CHAT_STREAM_QUEUE_SIZE,
+        queue_timeout: float = CHAT_STREAM_QUEUE_TIMEOUT,
+    ):
+        self._max_concurrent = max(max_concurrent, 1)
+        self._max_per_user = max(max_per_user, 1)
+        self._max_queue = max_queue
+        self._queue_timeout = queue_timeout
+        self._active = 0
+        self._user_active: Dict[int, int] = {}
+        # user id -> that user's waiters; dict order is the round-robin order
+        self._waiters: "OrderedDict[int, Deque[asyncio.Future]]" = OrderedDict()
+        self._queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queued = 0
+        self.wait_count = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self._wait_buckets: List[int] = [0] * (len(WAIT_BUCKETS) + 1)
+
+    def _can_run(self, user_id: int) -> bool:
+        return self._active < self._max_concurrent and self._user_active.get(user_id, 0) < self._max_per_user
+
+    def _start(self, user_id: int) -> None:
+        self._active += 1
+        self._user_active[user_id] = self._user_active.get(user_id, 0) + 1
+        self.admitted += 1
+
+    def _record_wait(self, seconds: float) -> None:
+        self.wait_count += 1
+        self.wait_sum += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        self._wait_buckets[bisect.bisect_left(WAIT_BUCKETS, seconds)] += 1
+        QUEUE_WAIT.observe(seconds)
+
+    async def acquire(self, user_id: int) -> StreamPermit:
+        """
+        Wait for a slot for user_id.
+
+        Raises:
+            BizException(SERVER_BUSY): the queue is full or the wait timed out
+        """
+        # Waiters that could run are always dispatched as soon as a slot frees,
+        # so a free slot here means nobody eligible is queued ahead of us
+        if self._can_run(user_id):
+            self._start(user_id)
+            self._record_wait(0.0)
+            return StreamPermit(self, user_id)
+        if self._queued >= self._max_queue:
+            self.rejected += 1
+            raise BizException(ErrorCode.SERVER_BUSY, "Too many chat requests in progress, please retry later")
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.setdefault(user_id, deque()).append(waiter)
+        self._queued += 1
+        self.max_queued = max(self.max_queued, self._queued)
+        started = loop.time()
+        try:
+            # shield: on timeout the future must stay intact to tell "granted just now" from "still waiting"
+            await asyncio.wait_for(asyncio.shield(waiter), self._queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                self._remove_waiter(user_id, waiter)
+                self.timed_out += 1
+                QUEUE_TIMEOUTS.inc()
+                raise BizException(ErrorCode.SERVER_BUSY, "Timed out waiting for a chat slot, please retry later")
+        except asyncio.CancelledError:
+            # Client went away while queued
+            if waiter.done():
+                self._release(user_id)
+            else:
+                self._remove_waiter(user_id, waiter)
+            raise
+        self._record_wait(loop.time() - started)
+        return StreamPermit(self, user_id)
+
+    def _remove_waiter(self, user_id: int, waiter: asyncio.Future) -> None:
+        queue = self._waiters.get(user_id)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._queued -= 1
+            if not queue:
+                del self._waiters[user_id]
+        waiter.cancel()
+
+    def _release(self, user_id: int) -> None:
+        self._active -= 1
+        remaining = self._user_active.get(user_id, 0) - 1
+        if remaining > 0:
+            self._user_active[user_id] = remaining
+        else:
+            self._user_active.pop(user_id, None)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting users in round-robin order."""
+        while self._waiters and self._active < self._max_concurrent:
+            user_id = next((uid for uid in self._waiters if self._user_active.get(uid, 0) < self._max_per_user), None)
+            if user_id is None:
+                return
+            queue = self._waiters[user_id]
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._waiters.move_to_end(user_id)
+            else:
+                del self._waiters[user_id]
+            self._start(user_id)
+            waiter.set_result(None)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def active_by_user(self) -> List[Tuple[Dict[str, object], int]]:
+        """Running streams per user, as (labels, value) pairs for the per-user gauge."""
+        return [({"user_id": user_id}, n) for user_id, n in list(self._user_active.items())]
+
+    def stats(self) -> Dict[str, object]:
+        # Cumulative, like Prometheus "le" buckets
+        buckets = {}
+        total = 0
+        for bound, n in zip(WAIT_BUCKETS + ("inf",), self._wait_buckets):
+            total += n
+            buckets[f"le_{bound}"] = total
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "max_queued": self.max_queued,
+            "waiting_users": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_seconds_avg": self.wait_sum / self.wait_count if self.wait_count else 0.0,
+            "wait_seconds_max": self.wait_max,
+            "wait_seconds_buckets": buckets,
+        }
+
+
+chat_limiter = ChatLimiter()
+
+registry.gauge(
+    "chat_active_streams", "Chat generations running on this worker",
+    collect=lambda: [({}, chat_limiter.active)],
+)
+# Only users with a running stream have a series
+registry.gauge(
+    "chat_user_active_streams", "Chat generations running per user", ("user_id",),
+    collect=chat_limiter.active_by_user,
+)
+registry.gauge(
+    "chat_queued_requests", "Chat requests waiting for a stream slot",
+    collect=lambda: [({}, chat_limiter.queued)],
+)
@@ -1,111 +1,339 @@
 """
 Chat service: orchestrates conversation management and LLM calls
 """
+import asyncio
 import logging
-from typing import List, AsyncGenerator, Optional
-from sqlalchemy.orm import Session
-from app.repositories.conversation_repo import conversation_repository
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import List, Dict, AsyncGenerator, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.repositories.conversation_repo import async_conversation_repository as conversation_repository
 from app.services.llm_service import llm_service
+from app.services.llm_metrics import GenerationStats
+from app.services.history_builder import (
+    CHAT_HISTORY_FETCH_LIMIT, count_message_tokens, history_token_budget, select_history,
+)
+from app.services.summary_service import summary_service
+from app.services.message_writer import message_writer
+from app.services.response_cache import response_cache, make_response_key, iter_chunks
+from app.services.chat_limiter import chat_limiter, StreamPermit
+from app.services.stream_registry import stream_registry, TurnStream
+from app.services.knowledge_retrieval import knowledge_retriever
+from app.core.sse import coalesce_tokens
+from app.services.context_cache import (
+    context_cache, ConversationContext, AgentConfig, CachedMessage,
+)
 from app.schemas.conversation import ConversationCreate, ConversationResponse, MessageResponse
-from app.agent_repo.agent import AgentRepository
+from app.agent_repo.agent import async_agent_repository as agent_repository
+from app.core.database import get_async_db_session
 from app.core.exceptions import NotFoundException, ErrorCode
 
 logger = logging.getLogger(__name__)
-agent_repository = AgentRepository()
+
+
+@dataclass
+class ChatTurn:
+    """Everything the generation phase needs, detached from any DB session."""
+    conversation_id: int
+    user_id: int
+    user_message: str
+    system_prompt: str
+    temperature: float
+    max_tokens: int
+    model: str
+    history: List[Dict[str, str]]
+    summary: Optional[str] = None
+    # Unsummarized history has passed the threshold; fold it after the response is delivered
+    needs_summary: bool = False
+    agent_id: Optional[int] = None
+    # Set when the agent opted into response caching
+    cache_key: Optional[str] = None
+    cache_ttl: int = 0
 
 
 class ChatService:
 
-    def create_conversation(self, db: Session, conv_create: ConversationCreate, user_id: int) -> ConversationResponse:
+    async def create_conversation(self, db: AsyncSession, conv_create: ConversationCreate, user_id: int) -> ConversationResponse:
         # Verify agent exists and belongs to user
-        agent = agent_repository.get_agent_by_id(db, conv_create.agent_id)
+        agent = await agent_repository.get_agent_by_id(db, conv_create.agent_id)
         if not agent:
             raise NotFoundException("Agent not found", ErrorCode.AGENT_NOT_FOUND)
         if agent.user_id != user_id:
             raise NotFoundException("Agent not found", ErrorCode.AGENT_NOT_FOUND)
 
-        conv = conversation_repository.create_conversation(db, conv_create, user_id)
+        conv = await conversation_repository.create_conversation(db, conv_create, user_id)
+        # Prime the context cache: the first turn usually follows right away
+        context_cache.put(ConversationContext(
+            conversation_id=conv.id,
+            user_id=conv.user_id,
+            title=conv.title,
+            summary=None,
+            summary_until_message_id=None,
+            agent=AgentConfig.from_row(agent),
+        ))
         return ConversationResponse.model_validate(conv)
 
-    def get_conversations(self, db: Session, agent_id: Optional[int], user_id: int, skip: int = 0, limit: int = 50) -> List[ConversationResponse]:
+    def get_stats(self) -> Dict[str, Dict]:
+        """Counters of this worker's admission queue, chat caches and write-behind queue."""
+        return {
+            "admission": chat_limiter.stats(),
+            "streams": stream_registry.stats(),
+            "llm_backends": llm_service.stats(),
+            "knowledge": knowledge_retriever.stats(),
+            "context_cache": context_cache.stats(),
+            "response_cache": response_cache.stats(),
+            "message_writer": message_writer.stats(),
+        }
+
+    async def get_conversations(self, db: AsyncSession, agent_id: Optional[int], user_id: int, skip: int = 0, limit: int = 50) -> List[ConversationResponse]:
         if agent_id:
-            convs = conversation_repository.get_conversations_by_agent(db, agent_id, user_id, skip, limit)
+            convs = await conversation_repository.get_conversations_by_agent(db, agent_id, user_id, skip, limit)
         else:
-            convs = conversation_repository.get_conversations_by_user(db, user_id, skip, limit)
+            convs = await conversation_repository.get_conversations_by_user(db, user_id, skip, limit)
         return [ConversationResponse.model_validate(c) for c in convs]
 
-    def get_messages(self, db: Session, conversation_id: int, user_id: int) -> List[MessageResponse]:
+    async def get_messages(self, db: AsyncSession, conversation_id: int, user_id: int) -> List[MessageResponse]:
         # Authorization check: conversation must belong to user
-        conv = conversation_repository.get_conversation_by_id(db, conversation_id)
+        conv = await conversation_repository.get_conversation_by_id(db, conversation_id)
         if not conv or conv.user_id != user_id:
             raise NotFoundException("Conversation not found", ErrorCode.PARAM_ERROR)
-        messages = conversation_repository.get_messages(db, conversation_id)
+        await message_writer.flush_conversation(conversation_id)
+        messages = await conversation_repository.get_messages(db, conversation_id)
         return [MessageResponse.model_validate(m) for m in messages]
 
-    def delete_conversation(self, db: Session, conversation_id: int, user_id: int) -> bool:
-        conv = conversation_repository.get_conversation_by_id(db, conversation_id)
+    async def delete_conversation(self, db: AsyncSession, conversation_id: int, user_id: int) -> bool:
+        conv = await conversation_repository.get_conversation_by_id(db, conversation_id)
         if not conv or conv.user_id != user_id:
             raise NotFoundException("Conversation not found", ErrorCode.PARAM_ERROR)
-        return conversation_repository.delete_conversation(db, conversation_id)
+        context_cache.invalidate(conversation_id)
+        return await conversation_repository.delete_conversation(db, conversation_id)
 
-    def validate_stream_request(self, db: Session, conversation_id: int, user_id: int):
-        """Pre-flight validation for streaming. Raises proper HTTP exceptions before SSE starts."""
-        conv = conversation_repository.get_conversation_by_id(db, conversation_id)
-        if not conv or conv.user_id != user_id:
+    async def prepare_stream_turn(self, conversation_id: int, user_id: int, user_message: str) -> ChatTurn:
+        """
+        DB phase of a chat turn: validate, load agent and history, queue the user message.
+
+        Runs before the SSE stream opens so errors surface as normal responses,
+        and releases its connection before generation starts. Follow-up turns in
+        an active conversation read everything from the context cache; writes go
+        through the write-behind queue, so such turns touch the DB not at all.
+        """
+        db = get_async_db_session()
+        try:
+            ctx = context_cache.get(conversation_id)
+            if ctx is None:
+                ctx = await self._load_context(db, conversation_id)
+            if ctx.user_id != user_id:
+                raise NotFoundException("Conversation not found", ErrorCode.PARAM_ERROR)
+            agent = ctx.agent
+
+            # Auto-title on first message
+            if not ctx.title:
+                title = user_message[:20] + ("..." if len(user_message) > 20 else "")
+                message_writer.set_title(conversation_id, title)
+                ctx.title = title
+
+            model = llm_service.resolve_model(agent.llm_model)
+            system_prompt = agent.system_prompt or f"You are {agent.name}, a helpful AI assistant."
+            max_tokens = agent.max_tokens or 2048
+            # Ground the answer in the agent's knowledge graph; counted against the history budget below
+            knowledge = await knowledge_retriever.retrieve(agent.id, user_message, model)
+            if knowledge:
+                system_prompt = f"{system_prompt}\n\n{knowledge}"
+
+            # Newest messages after the summary checkpoint that fit the prompt budget
+            # (taken before saving the new one)
+            budget = history_token_budget(model, max_tokens, system_prompt, user_message)
+            if ctx.summary:
+                budget -= count_message_tokens(ctx.summary, model)
+            history = select_history(list(reversed(ctx.messages)), max(budget, 0), model)
+            unsummarized_tokens = sum(
+                m.tokens_used if m.tokens_used is not None else count_message_tokens(m.content, model)
+                for m in ctx.messages
+            )
+
+            # Save user message with its token count so later turns need no re-tokenization
+            user_tokens = count_message_tokens(user_message, model)
+            message_writer.add_message(conversation_id, "user", user_message, tokens_used=user_tokens)
+            context_cache.append_message(conversation_id, CachedMessage(None, "user", user_message, user_tokens))
+
+            temperature = agent.temperature or 0.7
+            cache_ttl = agent.response_cache_ttl or 0
+            return ChatTurn(
+                conversation_id=conversation_id,
+                user_id=user_id,
+                user_message=user_message,
+                system_prompt=system_prompt,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                model=model,
+                history=history,
+                summary=ctx.summary,
+                needs_summary=summary_service.needs_summary(unsummarized_tokens + user_tokens),
+                agent_id=agent.id,
+                cache_key=make_response_key(
+                    system_prompt, ctx.summary, history, user_message, model, temperature,
+                ) if cache_ttl > 0 else None,
+                cache_ttl=cache_ttl,
+            )
+        finally:
+            await db.close()
+
+    async def _load_context(self, db: AsyncSession, conversation_id: int) -> ConversationContext:
+        """Cache miss: load conversation, agent and recent messages, and cache them."""
+        await message_writer.flush_conversation(conversation_id)
+        conv = await conversation_repository.get_conversation_by_id(db, conversation_id)
+        if not conv:
             raise NotFoundException("Conversation not found", ErrorCode.PARAM_ERROR)
-        agent = agent_repository.get_agent_by_id(db, conv.agent_id)
+
+        agent = await agent_repository.get_agent_by_id(db, conv.agent_id)
         if not agent:
             raise NotFoundException("Agent not found", ErrorCode.AGENT_NOT_FOUND)
 
-    async def stream_chat(
+        recent_msgs = await conversation_repository.get_recent_messages(
+            db, conversation_id, CHAT_HISTORY_FETCH_LIMIT, after_id=conv.summary_until_message_id,
+        )
+        ctx = ConversationContext(
+            conversation_id=conv.id,
+            user_id=conv.user_id,
+            title=conv.title,
+            summary=conv.summary,
+            summary_until_message_id=conv.summary_until_message_id,
+            agent=AgentConfig.from_row(agent),
+            messages=[CachedMessage.from_row(m) for m in reversed(recent_msgs)],
+        )
+        context_cache.put(ctx)
+        return ctx
+
+    async def stream_chat(self, turn: ChatTurn) -> AsyncGenerator[str, None]:
+        """Generation phase: stream the LLM response without holding a DB connection."""
+        parts: List[str] = []
+        if turn.cache_key is not None:
+            cached = response_cache.get(turn.cache_key)
+            if cached is not None:
+                self._persist_assistant_message(turn.conversation_id, cached, turn.model)
+                # Replay in chunks so clients see the same event stream as a live answer
+                for chunk in iter_chunks(cached):
+                    yield chunk
+                return
+        complete = False
+        stats = GenerationStats()
+        try:
+            # Closed explicitly so a cancelled turn stops the upstream request now, not at garbage collection
+            async with aclosing(llm_service.stream_chat(
+                system_prompt=turn.system_prompt,
+                history=turn.history,
+                user_message=turn.user_message,
+                temperature=turn.temperature,
+                max_tokens=turn.max_tokens,
+                model=turn.model,
+                summary=turn.summary,
+                agent_id=turn.agent_id,
+                call_site="chat",
+                stats=stats,
+            )) as tokens:
+                async for token in tokens:
+                    parts.append(token)
+                    yield token
+            complete = True
+        finally:
+            # Persist whatever response we got (full or partial) even on disconnect;
+            # queuing does not await, so cancellation cannot interrupt it
+            if parts:
+                content = "".join(parts)
+                self._persist_assistant_message(turn.conversation_id, content, turn.model, stats)
+                # Only complete answers are cached, never ones cut short by a disconnect or error
+                if complete and turn.cache_key is not None:
+                    response_cache.put(turn.cache_key, turn.agent_id, content, turn.cache_ttl)
+
+    def start_stream(
         self,
-        db: Session,
-        conversation_id: int,
-        user_id: int,
-        user_message: str,
-    ) -> AsyncGenerator[str, None]:
-        """Stream chat response and persist messages."""
-        # Validate conversation
-        conv = conversation_repository.get_conversation_by_id(db, conversation_id)
-        if not conv or conv.user_id != user_id:
-            raise NotFoundException("Conversation not found", ErrorCode.PARAM_ERROR)
+        turn: ChatTurn,
+        permit: StreamPermit,
+        flush_interval_ms: Optional[int] = None,
+        flush_bytes: Optional[int] = None,
+    ) -> TurnStream:
+        """
+        Run the generation in a task of its own that publishes into a replay buffer.
 
-        # Get agent config
-        agent = agent_repository.get_agent_by_id(db, conv.agent_id)
-        if not agent:
-            raise NotFoundException("Agent not found", ErrorCode.AGENT_NOT_FOUND)
+        The generation is decoupled from the SSE connection: a client that drops
+        can reattach with Last-Event-ID and pick up where it left off.
+        """
+        stream = stream_registry.create(turn.conversation_id, turn.user_id)
+        stream.task = asyncio.create_task(self._produce(stream, turn, permit, flush_interval_ms, flush_bytes))
+        return stream
 
-        # Auto-title on first message
-        if not conv.title:
-            title = user_message[:20] + ("..." if len(user_message) > 20 else "")
-            conversation_repository.update_conversation_title(db, conversation_id, title)
+    def resume_stream(self, conversation_id: int, user_id: int, last_event_id: str) -> Tuple[TurnStream, int]:
+        """Find the stream a Last-Event-ID belongs to; returns it with the last sequence number seen."""
+        stream_id, _, seq = last_event_id.partition(":")
+        stream = stream_registry.get(stream_id)
+        if stream is None or stream.conversation_id != conversation_id or stream.user_id != user_id:
+            raise NotFoundException("Stream not found or expired", ErrorCode.RESOURCE_NOT_FOUND)
+        return stream, int(seq) if seq.isdigit() else 0
 
-        # Save user message
-        conversation_repository.add_message(db, conversation_id, "user", user_message)
+    async def cancel_generation(self, conversation_id: int, user_id: int) -> bool:
+        """
+        Stop the running generation(s) of a conversation.
 
-        # Build history from existing messages only (exclude the one we just saved)
-        history_msgs = conversation_repository.get_messages(db, conversation_id)
-        history = [{"role": m.role, "content": m.content} for m in history_msgs[:-1]]
+        Cancels the producer task, which closes the upstream LLM stream and saves
+        the partial answer through stream_chat's finally block. Returns False if
+        nothing was running.
+        """
+        streams = stream_registry.running(conversation_id)
+        if any(s.user_id != user_id for s in streams):
+            raise NotFoundException("Conversation not found", ErrorCode.PARAM_ERROR)
+        if not streams:
+            return False
+        await stream_registry.cancel(streams)
+        return True
 
-        # Stream response with disconnect protection
-        full_response = ""
+    async def _produce(
+        self,
+        stream: TurnStream,
+        turn: ChatTurn,
+        permit: StreamPermit,
+        flush_interval_ms: Optional[int],
+        flush_bytes: Optional[int],
+    ) -> None:
         try:
-            async for token in llm_service.stream_chat(
-                system_prompt=agent.system_prompt or f"You are {agent.name}, a helpful AI assistant.",
-                history=history,
-                user_message=user_message,
-                temperature=agent.temperature or 0.7,
-                max_tokens=agent.max_tokens or 2048,
-            ):
-                full_response += token
-                yield token
+            # Cancellation usually lands in wait_for_reader; closing the frames stops the
+            # coalescer's pump and the upstream LLM stream before the turn counts as finished
+            async with aclosing(coalesce_tokens(
+                self.stream_chat(turn), flush_interval_ms=flush_interval_ms, flush_bytes=flush_bytes,
+            )) as frames:
+                async for frame in frames:
+                    stream.publish("message", {"token": frame})
+                    # While the client lags, tokens pile up in the coalescer and go out as larger frames
+                    await stream.wait_for_reader()
+            stream.publish("done", {"status": "complete"})
+        except asyncio.CancelledError:
+            # Cancel request, nobody reattached in time, or shutdown; the partial answer is already saved
+            stream.publish("done", {"status": "cancelled"})
+            return
+        except Exception as e:
+            logger.error(f"Stream error for conversation {turn.conversation_id}: {e}", exc_info=True)
+            stream.publish("error", {"error": "Stream interrupted"})
+            return
         finally:
-            # Persist whatever response we got (full or partial) even on disconnect
-            if full_response:
-                try:
-                    conversation_repository.add_message(db, conversation_id, "assistant", full_response)
-                except Exception as e:
-                    logger.error(f"Failed to persist response for conversation {conversation_id}: {e}")
+            permit.release()
+            stream_registry.finish(stream)
+        # Summarization runs after the answer is complete, never on the streaming path
+        await self.summarize_after_turn(turn)
+
+    async def summarize_after_turn(self, turn: ChatTurn) -> None:
+        """Post-response phase: fold older turns into the rolling summary if due."""
+        if turn.needs_summary:
+            await summary_service.summarize_conversation(turn.conversation_id, turn.model)
+
+    def _persist_assistant_message(
+        self, conversation_id: int, content: str, model: str, stats: Optional[GenerationStats] = None,
+    ) -> None:
+        """Persist phase: queue the assistant reply, with its generation stats, on the write-behind queue."""
+        tokens = count_message_tokens(content, model)
+        message_writer.add_message(
+            conversation_id, "assistant", content, tokens_used=tokens,
+            generation=stats.as_columns() if stats is not None else None,
+        )
+        context_cache.append_message(conversation_id, CachedMessage(None, "assistant", content, tokens))
 
 
 chat_service = ChatService()
@@ -0,0 +1,123 @@
+"""
+Per-worker LRU cache of conversation context (conversation row, agent config, recent messages)
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Dict
+from app.services.history_builder import CHAT_HISTORY_FETCH_LIMIT
+
+CHAT_CONTEXT_CACHE_SIZE = int(os.getenv("CHAT_CONTEXT_CACHE_SIZE", "1024"))
+# Entries are per worker; the TTL bounds staleness when another worker writes to the same conversation
+CHAT_CONTEXT_CACHE_TTL = float(os.getenv("CHAT_CONTEXT_CACHE_TTL", "300"))
+
+
+@dataclass
+class CachedMessage:
+    # None until the write-behind queue has inserted the row
+    id: Optional[int]
+    role: str
+    content: str
+    tokens_used: Optional[int]
+
+    @classmethod
+    def from_row(cls, msg) -> "CachedMessage":
+        return cls(id=msg.id, role=msg.role, content=msg.content, tokens_used=msg.tokens_used)
+
+
+@dataclass
+class AgentConfig:
+    id: int
+    name: str
+    system_prompt: Optional[str]
+    temperature: Optional[float]
+    max_tokens: Optional[int]
+    llm_model: Optional[str]
+    response_cache_ttl: Optional[int]
+
+    @classmethod
+    def from_row(cls, agent) -> "AgentConfig":
+        return cls(
+            id=agent.id,
+            name=agent.name,
+            system_prompt=agent.system_prompt,
+            temperature=agent.temperature,
+            max_tokens=agent.max_tokens,
+            llm_model=agent.llm_model,
+            response_cache_ttl=agent.response_cache_ttl,
+        )
+
+
+@dataclass
+class ConversationContext:
+    conversation_id: int
+    user_id: int
+    title: Optional[str]
+    summary: Optional[str]
+    summary_until_message_id: Optional[int]
+    agent: AgentConfig
+    # Messages after the summary checkpoint, oldest first
+    messages: List[CachedMessage] = field(default_factory=list)
+    expires_at: float = 0.0
+
+
+class ConversationContextCache:
+    """LRU + TTL cache keyed by conversation id. Entries are detached from any DB session."""
+
+    def __init__(self, max_size: int = CHAT_CONTEXT_CACHE_SIZE, ttl: float = CHAT_CONTEXT_CACHE_TTL):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: "OrderedDict[int, ConversationContext]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conversation_id: int) -> Optional[ConversationContext]:
+        with self._lock:
+            ctx = self._entries.get(conversation_id)
+            if ctx is None or ctx.expires_at < time.monotonic():
+                if ctx is not None:
+                    del self._entries[conversation_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(conversation_id)
+            self.hits += 1
+            return ctx
+
+    def put(self, ctx: ConversationContext) -> None:
+        if self._max_size <= 0:
+            return
+        ctx.expires_at = time.monotonic() + self._ttl
+        with self._lock:
+            self._entries[ctx.conversation_id] = ctx
+            self._entries.move_to_end(ctx.conversation_id)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def append_message(self, conversation_id: int, msg: CachedMessage) -> None:
+        """Append a message that has just been saved (or queued for saving)."""
+        with self._lock:
+            ctx = self._entries.get(conversation_id)
+            if ctx is None:
+                return
+            ctx.messages.append(msg)
+            if len(ctx.messages) > CHAT_HISTORY_FETCH_LIMIT:
+                del ctx.messages[:len(ctx.messages) - CHAT_HISTORY_FETCH_LIMIT]
+
+    def invalidate(self, conversation_id: int) -> None:
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+
+    def invalidate_agent(self, agent_id: int) -> None:
+        """Drop every conversation of an agent (after the agent is updated or deleted)."""
+        with self._lock:
+            for cid in [cid for cid, ctx in self._entries.items() if ctx.agent.id == agent_id]:
+                del self._entries[cid]
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+context_cache = ConversationContextCache()
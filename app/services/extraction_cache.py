@@ -0,0 +1,125 @@
+"""
+Content-addressed cache of LLM extraction results, shared by all documents and agents
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Dict, List, Optional
+from app.repositories.extraction_cache_repo import async_extraction_cache_repository as cache_repository
+from app.core.database import get_async_db_session
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_EXTRACTION_CACHE_ENABLED = os.getenv("KNOWLEDGE_EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+# Total size of cached results; least recently used entries are evicted beyond it
+KNOWLEDGE_EXTRACTION_CACHE_MB = float(os.getenv("KNOWLEDGE_EXTRACTION_CACHE_MB", "256"))
+# Eviction trims to this fraction of the limit, so it does not run again after the next document
+KNOWLEDGE_EXTRACTION_CACHE_LOW_WATERMARK = 0.9
+# Larger results are not cached (the column is a TEXT)
+MAX_ENTRY_BYTES = 60 * 1024
+# The total size is tracked in memory between writes and re-read from the table at most this
+# often (other workers write and evict too), or when the running total says it is over the limit
+SIZE_RESYNC_SECONDS = 300
+
+cache_lookups = registry.counter(
+    "knowledge_extraction_cache_lookups", "Chunk lookups in the extraction cache", ("outcome",),
+)
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Extraction results keyed by (sha256 of chunk text, prompt version, model), stored in MySQL.
+
+    Lookups and writes are batched per document. The cache is an optimisation
+    only: database errors are logged and treated as misses.
+    """
+
+    def __init__(self, max_bytes: int = int(KNOWLEDGE_EXTRACTION_CACHE_MB * 1024 * 1024), enabled: bool = KNOWLEDGE_EXTRACTION_CACHE_ENABLED):
+        self._max_bytes = max_bytes
+        self.enabled = enabled and max_bytes > 0
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.errors = 0
+        self._size: Optional[int] = None
+        self._size_read_at = 0.0
+
+    async def get_many(self, chunk_hashes: List[str], prompt_version: str, model: str) -> Dict[str, dict]:
+        """chunk hash -> cached result, for the hashes that are cached."""
+        if not self.enabled or not chunk_hashes:
+            return {}
+        db = get_async_db_session()
+        try:
+            found = await cache_repository.get_many(db, chunk_hashes, prompt_version, model)
+            await cache_repository.touch(db, [entry_id for entry_id, _ in found.values()])
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Extraction cache lookup failed: {e}")
+            return {}
+        finally:
+            await db.close()
+        results = {h: json.loads(result) for h, (_, result) in found.items()}
+        hits = sum(1 for h in chunk_hashes if h in results)
+        self.hits += hits
+        self.misses += len(chunk_hashes) - hits
+        cache_lookups.inc(hits, outcome="hit")
+        cache_lookups.inc(len(chunk_hashes) - hits, outcome="miss")
+        return results
+
+    async def put_many(self, results: Dict[str, dict], prompt_version: str, model: str) -> None:
+        """Store fresh results (chunk hash -> result), then evict if the cache is over its size limit."""
+        if not self.enabled or not results:
+            return
+        rows = []
+        added = 0
+        for h, result in results.items():
+            encoded = json.dumps(result, ensure_ascii=False)
+            size = len(encoded.encode("utf-8"))
+            if size <= MAX_ENTRY_BYTES:
+                rows.append({"chunk_hash": h, "prompt_version": prompt_version, "model": model, "result": encoded})
+                added += size
+        db = get_async_db_session()
+        try:
+            await cache_repository.put_many(db, rows)
+            self.stored += len(rows)
+            now = time.monotonic()
+            if self._size is not None and now - self._size_read_at < SIZE_RESYNC_SECONDS:
+                self._size += added
+            if self._size is None or now - self._size_read_at >= SIZE_RESYNC_SECONDS or self._size > self._max_bytes:
+                # Confirm with the table before evicting: the running total misses other workers' changes
+                self._size = await cache_repository.total_size(db)
+                self._size_read_at = now
+            if self._size > self._max_bytes:
+                target = int(self._max_bytes * KNOWLEDGE_EXTRACTION_CACHE_LOW_WATERMARK)
+                deleted, freed = await cache_repository.evict(db, self._size - target)
+                self._size -= freed
+                self.evicted += deleted
+                logger.info(f"Evicted {deleted} extraction cache entries ({freed} bytes)")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Extraction cache write failed: {e}")
+        finally:
+            await db.close()
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "stored": self.stored,
+            "evicted": self.evicted,
+            "errors": self.errors,
+        }
+
+
+extraction_cache = ExtractionCache()
@@ -0,0 +1,166 @@
+"""
+Token counting and token-budgeted chat history selection
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import List, Dict, Optional, Sequence, Set
+
+logger = logging.getLogger(__name__)
+
+# Context window sizes by model prefix (longest prefix wins)
+MODEL_CONTEXT_SIZES = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+}
+DEFAULT_CONTEXT_SIZE = int(os.getenv("LLM_CONTEXT_SIZE", "8192"))
+
+# Per-message framing overhead of the chat format (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Headroom for tokenizer mismatch between our count and the provider's
+PROMPT_SAFETY_MARGIN = int(os.getenv("CHAT_PROMPT_SAFETY_MARGIN", "256"))
+# Optional hard cap on history tokens regardless of context size (0 = no cap)
+CHAT_HISTORY_MAX_TOKENS = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "0"))
+# How many of the newest messages to load as candidates for the window
+CHAT_HISTORY_FETCH_LIMIT = int(os.getenv("CHAT_HISTORY_FETCH_LIMIT", "200"))
+# After a failed tokenizer load, token counts are estimated for this long before loading is tried again
+TIKTOKEN_RETRY_SECONDS = float(os.getenv("TIKTOKEN_RETRY_SECONDS", "300"))
+
+# Loaded encodings by model. Failures are not cached, only when they happened
+_encodings: Dict[str, object] = {}
+_failed_at: Dict[str, float] = {}
+_loading: Set[str] = set()
+
+
+def load_encoding(model: str):
+    """
+    Load the tiktoken encoding for a model, or None if unavailable (e.g. the BPE
+    file cannot be downloaded). Blocking: may download, so call it off the event
+    loop (startup preloads the default model; the image bakes in TIKTOKEN_CACHE_DIR).
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        _failed_at[model] = time.monotonic()
+        logger.warning(
+            f"tiktoken unavailable for model {model}, using estimated token counts "
+            f"(retrying in {TIKTOKEN_RETRY_SECONDS:g}s): {e}"
+        )
+        return None
+    _encodings[model] = encoding
+    _failed_at.pop(model, None)
+    return encoding
+
+
+def _load_in_background(model: str) -> None:
+    try:
+        load_encoding(model)
+    finally:
+        _loading.discard(model)
+
+
+def _get_encoding(model: str):
+    """The model's encoding if usable now; None means estimate."""
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    failed = _failed_at.get(model)
+    if failed is not None and time.monotonic() - failed < TIKTOKEN_RETRY_SECONDS:
+        return None
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Worker thread or script: blocking is fine
+        return load_encoding(model)
+    # On the event loop: load in a thread and estimate until it is there
+    if model not in _loading:
+        _loading.add(model)
+        loop.run_in_executor(None, _load_in_background, model)
+    return None
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough count when no tokenizer is available: ~4 chars per token, 1 per CJK char."""
+    wide = sum(1 for ch in text if ord(ch) > 0x2E7F)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Count tokens in text with the model's local tokenizer."""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return _estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(content: str, model: str) -> int:
+    """Token cost of one chat message, including framing overhead. Stored in Message.tokens_used."""
+    return count_tokens(content, model) + MESSAGE_OVERHEAD_TOKENS
+
+
+def get_context_size(model: str) -> int:
+    """Context window of a model, matched by longest known prefix."""
+    best = None
+    for prefix in MODEL_CONTEXT_SIZES:
+        if model.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return MODEL_CONTEXT_SIZES[best] if best else DEFAULT_CONTEXT_SIZE
+
+
+def history_token_budget(model: str, max_tokens: int, system_prompt: str, user_message: str) -> int:
+    """Tokens left for history after the system prompt, current message and reserved completion."""
+    budget = (
+        get_context_size(model)
+        - max_tokens
+        - count_message_tokens(system_prompt, model)
+        - count_message_tokens(user_message, model)
+        - PROMPT_SAFETY_MARGIN
+    )
+    if CHAT_HISTORY_MAX_TOKENS > 0:
+        budget = min(budget, CHAT_HISTORY_MAX_TOKENS)
+    return max(budget, 0)
+
+
+def select_history(messages_newest_first: Sequence, budget: int, model: str) -> List[Dict[str, str]]:
+    """
+    Pick the newest messages whose stored token counts fit the budget.
+
+    Args:
+        messages_newest_first: Message rows ordered newest first
+        budget: token budget for history
+        model: model name, only used for rows written before tokens_used was stored
+
+    Returns:
+        History dicts in chronological order
+    """
+    selected = []
+    used = 0
+    for msg in messages_newest_first:
+        if msg.role not in ("user", "assistant"):
+            continue
+        tokens = msg.tokens_used
+        if tokens is None:
+            tokens = count_message_tokens(msg.content, model)
+        if used + tokens > budget:
+            break
+        used += tokens
+        selected.append({"role": msg.role, "content": msg.content})
+    selected.reverse()
+    return selected
@@ -0,0 +1,177 @@
+"""
+Worker pool for knowledge document processing, fed by the knowledge_jobs table
+"""
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from app.repositories.job_repo import async_job_repository as job_repository
+from app.services.knowledge_service import knowledge_service, DocumentProcessingError
+from app.core.database import get_async_db_session
+
+logger = logging.getLogger(__name__)
+
+# Concurrent jobs per process (0 disables the workers, e.g. for API-only instances)
+KNOWLEDGE_JOB_WORKERS = int(os.getenv("KNOWLEDGE_JOB_WORKERS", "2"))
+# Idle workers look for new jobs this often; uploads to this process wake them at once
+KNOWLEDGE_JOB_POLL_INTERVAL = float(os.getenv("KNOWLEDGE_JOB_POLL_INTERVAL", "2"))
+# A running job is requeued if its worker has not renewed the lease for this long
+KNOWLEDGE_JOB_LEASE_SECONDS = float(os.getenv("KNOWLEDGE_JOB_LEASE_SECONDS", "300"))
+# Delay before retry n is KNOWLEDGE_JOB_RETRY_BACKOFF * 2^(n-1) seconds
+KNOWLEDGE_JOB_RETRY_BACKOFF = float(os.getenv("KNOWLEDGE_JOB_RETRY_BACKOFF", "30"))
+
+
+class KnowledgeJobWorker:
+    """
+    Runs queued document jobs on this process's event loop.
+
+    Jobs are claimed with a conditional UPDATE, so any number of processes
+    can share the table. A claimed job carries a lease that a heartbeat
+    renews; when a process dies, its jobs are requeued once the lease runs
+    out. Failures are retried with exponential backoff up to the job's
+    max_attempts, after which the document is marked failed.
+    """
+
+    def __init__(self, workers: int = KNOWLEDGE_JOB_WORKERS):
+        self._workers = workers
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        # job id -> document id, for jobs running in this process
+        self._running: Dict[int, int] = {}
+        self._last_recovery = 0.0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.recovered = 0
+
+    def start(self) -> None:
+        if self._tasks or self._workers <= 0:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self._workers)]
+        logger.info(f"Started {self._workers} knowledge job workers as {self.worker_id}")
+
+    def notify(self) -> None:
+        """A job was queued by this process; skip the poll delay."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def aclose(self) -> None:
+        """Stop the workers; jobs they were running go back to the queue without using up an attempt."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                job = await self._claim_next()
+            except Exception as e:
+                logger.error(f"Knowledge job worker could not poll the queue: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), KNOWLEDGE_JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            await self._execute(job)
+
+    async def _claim_next(self):
+        db = get_async_db_session()
+        try:
+            now = time.monotonic()
+            # Any idle worker may sweep expired leases, at most once per poll interval per process
+            if now - self._last_recovery >= KNOWLEDGE_JOB_POLL_INTERVAL:
+                self._last_recovery = now
+                recovered = await job_repository.recover_expired(db)
+                if recovered:
+                    self.recovered += recovered
+                    logger.warning(f"Requeued {recovered} knowledge jobs with expired leases")
+            for job_id in await job_repository.find_claimable(db, limit=self._workers * 2):
+                job = await job_repository.claim(db, job_id, self.worker_id, KNOWLEDGE_JOB_LEASE_SECONDS)
+                if job is not None:
+                    return job
+            return None
+        finally:
+            await db.close()
+
+    async def _execute(self, job) -> None:
+        self._running[job.id] = job.document_id
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        try:
+            if job.attempts > job.max_attempts:
+                # Requeued by lease expiry after its last attempt: the worker died on it every time
+                raise DocumentProcessingError("Worker lost on every attempt")
+            entity_count = await knowledge_service.process_document(job.document_id)
+        except asyncio.CancelledError:
+            await asyncio.shield(self._release(job.id))
+            raise
+        except Exception as e:
+            await self._handle_failure(job, e)
+        else:
+            await self._update(job_repository.finish, job.id, self.worker_id, "succeeded")
+            self.succeeded += 1
+            logger.info(f"Knowledge job {job.id} processed document {job.document_id}: {entity_count} entities")
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job.id, None)
+
+    async def _handle_failure(self, job, error: Exception) -> None:
+        message = f"{type(error).__name__}: {error}"[:2000]
+        permanent = isinstance(error, DocumentProcessingError)
+        if not permanent and job.attempts < job.max_attempts:
+            delay = KNOWLEDGE_JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+            logger.warning(f"Knowledge job {job.id} attempt {job.attempts} failed, retrying in {delay:.0f}s: {message}")
+            await self._update(job_repository.requeue, job.id, self.worker_id, delay, message)
+            self.retried += 1
+            return
+        logger.error(f"Knowledge job {job.id} failed for document {job.document_id}: {message}")
+        await self._update(job_repository.finish, job.id, self.worker_id, "failed", message)
+        await knowledge_service.mark_failed(job.document_id)
+        self.failed += 1
+
+    async def _release(self, job_id: int) -> None:
+        try:
+            await self._update(job_repository.requeue, job_id, self.worker_id, 0, refund_attempt=True)
+        except Exception as e:
+            # The lease runs out and another worker picks it up
+            logger.warning(f"Could not release knowledge job {job_id} on shutdown: {e}")
+
+    async def _heartbeat(self, job_id: int) -> None:
+        while True:
+            await asyncio.sleep(KNOWLEDGE_JOB_LEASE_SECONDS / 3)
+            try:
+                if not await self._update(job_repository.extend_lease, job_id, self.worker_id, KNOWLEDGE_JOB_LEASE_SECONDS):
+                    logger.warning(f"Lost the lease on knowledge job {job_id}")
+                    return
+            except Exception as e:
+                logger.warning(f"Could not renew the lease on knowledge job {job_id}: {e}")
+
+    @staticmethod
+    async def _update(method, *args, **kwargs):
+        db = get_async_db_session()
+        try:
+            return await method(db, *args, **kwargs)
+        finally:
+            await db.close()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "worker_id": self.worker_id,
+            "workers": len(self._tasks),
+            "running": dict(self._running),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "recovered": self.recovered,
+        }
+
+
+knowledge_job_worker = KnowledgeJobWorker()
@@ -0,0 +1,413 @@
+"""
+Knowledge-graph retrieval for chat: match entity names in the user message and
+render their 1-hop neighborhood into the system prompt within a token budget
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Set, Tuple
+from neo4j.exceptions import AuthError, ServiceUnavailable, SessionExpired
+from app.repositories.knowledge_repo import knowledge_repository
+from app.services.history_builder import count_tokens
+
+logger = logging.getLogger(__name__)
+
+KG_RETRIEVAL_ENABLED = os.getenv("KG_RETRIEVAL_ENABLED", "true").lower() == "true"
+# Prompt tokens the knowledge block may use
+KG_CONTEXT_MAX_TOKENS = int(os.getenv("KG_CONTEXT_MAX_TOKENS", "512"))
+KG_MAX_MATCHED_ENTITIES = int(os.getenv("KG_MAX_MATCHED_ENTITIES", "8"))
+KG_NEIGHBORS_PER_ENTITY = int(os.getenv("KG_NEIGHBORS_PER_ENTITY", "10"))
+# Shorter names match too much noise
+KG_MIN_ENTITY_CHARS = int(os.getenv("KG_MIN_ENTITY_CHARS", "2"))
+# Matchers are per worker; documents added through another worker show up after this
+KG_MATCHER_REFRESH_SECONDS = float(os.getenv("KG_MATCHER_REFRESH_SECONDS", "300"))
+KG_MAX_AGENT_INDEXES = int(os.getenv("KG_MAX_AGENT_INDEXES", "256"))
+KG_NEIGHBORHOOD_CACHE_SIZE = int(os.getenv("KG_NEIGHBORHOOD_CACHE_SIZE", "4096"))
+KG_NEIGHBORHOOD_CACHE_TTL = float(os.getenv("KG_NEIGHBORHOOD_CACHE_TTL", "300"))
+# After a failure, chat skips what failed (Neo4j as a whole, or one agent) for this long instead of waiting on it every turn
+KG_RETRY_AFTER = float(os.getenv("KG_RETRY_AFTER", "30"))
+
+# Errors meaning Neo4j itself is unusable, as opposed to one agent's query failing
+_CONNECTION_ERRORS = (ServiceUnavailable, SessionExpired, AuthError, OSError)
+# Failure-window key shared by all agents
+_NEO4J = "neo4j"
+
+KNOWLEDGE_HEADER = "Relevant facts from your knowledge base (use them if they help answer):"
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and (ch.isalnum() or ch == "_")
+
+
+class EntityMatcher:
+    """
+    Aho–Corasick automaton over lowercased entity names.
+
+    Names are inserted into the trie as they arrive; failure links are
+    recomputed lazily (one linear pass) before the next search. Removed names
+    stay in the trie but are filtered out, until compact() rebuilds it.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Keys ending exactly at a node, and the nearest node on the failure chain that has any
+        self._out: List[List[str]] = [[]]
+        self._dict_link: List[int] = [0]
+        self._dirty = False
+        self.keys: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: str) -> None:
+        if key in self.keys:
+            return
+        node = 0
+        for ch in key:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._dict_link.append(0)
+            node = nxt
+        if key not in self._out[node]:
+            self._out[node].append(key)
+        self.keys.add(key)
+        self._dirty = True
+
+    def discard(self, key: str) -> None:
+        self.keys.discard(key)
+
+    @property
+    def dead_keys(self) -> int:
+        return sum(len(out) for out in self._out) - len(self.keys)
+
+    def compact(self) -> "EntityMatcher":
+        """A fresh automaton with only the live keys."""
+        matcher = EntityMatcher()
+        for key in self.keys:
+            matcher.add(key)
+        return matcher
+
+    def _build(self) -> None:
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            self._dict_link[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._dict_link[child] = self._fail[child] if self._out[self._fail[child]] else self._dict_link[self._fail[child]]
+                queue.append(child)
+        self._dirty = False
+
+    def find(self, text: str) -> List[str]:
+        """
+        Keys found in text, longest-leftmost and non-overlapping, in order of appearance.
+
+        Keys that start or end with an ASCII letter or digit only match on word
+        boundaries, so "AI" does not match inside "said"; CJK names match anywhere.
+        """
+        if not self.keys:
+            return []
+        if self._dirty:
+            self._build()
+        text = text.lower()
+        spans: List[Tuple[int, int, str]] = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            hit = node if self._out[node] else self._dict_link[node]
+            while hit:
+                for key in self._out[hit]:
+                    start = i - len(key) + 1
+                    if key in self.keys and self._on_boundary(text, start, i + 1, key):
+                        spans.append((start, i + 1, key))
+                hit = self._dict_link[hit]
+        spans.sort(key=lambda s: (s[0], s[0] - s[1]))
+        found: List[str] = []
+        end = 0
+        for start, stop, key in spans:
+            if start >= end:
+                if key not in found:
+                    found.append(key)
+                end = stop
+        return found
+
+    @staticmethod
+    def _on_boundary(text: str, start: int, end: int, key: str) -> bool:
+        if _is_word_char(key[0]) and start > 0 and _is_word_char(text[start - 1]):
+            return False
+        if _is_word_char(key[-1]) and end < len(text) and _is_word_char(text[end]):
+            return False
+        return True
+
+
+class _AgentIndex:
+    """Entity names of one agent: the matcher plus which documents contribute each name."""
+
+    def __init__(self, version: int):
+        self.matcher = EntityMatcher()
+        self.doc_names: Dict[int, Set[str]] = {}
+        # name -> number of documents containing it; key (lowercased) -> original names
+        self.refs: Dict[str, int] = {}
+        self.originals: Dict[str, Set[str]] = {}
+        self.loaded_at = time.monotonic()
+        self.version = version
+
+    def add_document(self, doc_id: int, names) -> None:
+        names = {n.strip() for n in names if n and len(n.strip()) >= KG_MIN_ENTITY_CHARS}
+        new = names - self.doc_names.get(doc_id, set())
+        self.doc_names.setdefault(doc_id, set()).update(new)
+        for name in new:
+            self.refs[name] = self.refs.get(name, 0) + 1
+            key = name.lower()
+            self.originals.setdefault(key, set()).add(name)
+            self.matcher.add(key)
+
+    def remove_document(self, doc_id: int) -> None:
+        for name in self.doc_names.pop(doc_id, ()):
+            self.refs[name] -= 1
+            if self.refs[name] > 0:
+                continue
+            del self.refs[name]
+            key = name.lower()
+            self.originals[key].discard(name)
+            if not self.originals[key]:
+                del self.originals[key]
+                self.matcher.discard(key)
+        if self.matcher.dead_keys > max(len(self.matcher), 64):
+            self.matcher = self.matcher.compact()
+
+    def match(self, text: str) -> List[str]:
+        names: List[str] = []
+        for key in self.matcher.find(text):
+            names.extend(sorted(self.originals.get(key, ())))
+        return names
+
+
+class KnowledgeRetriever:
+    """
+    Per-worker knowledge-graph retrieval for chat turns.
+
+    Each agent's entity names are loaded from Neo4j into an EntityMatcher in a
+    background task, never on a chat turn: turns before the first load finishes
+    go without knowledge. The index is kept current by add_document /
+    remove_document as documents are processed or deleted, and reloaded in the
+    background every KG_MATCHER_REFRESH_SECONDS to pick up changes made by
+    other workers, while the old one keeps serving. Neighborhood lookups are
+    cached per agent; any document change of the agent invalidates them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[int, _AgentIndex]" = OrderedDict()
+        # Bumped on every document change, so a load racing with a change is discarded
+        self._versions: Dict[int, int] = {}
+        self._neighborhoods: "OrderedDict[Tuple[int, int, str], Tuple[float, Optional[Dict]]]" = OrderedDict()
+        # Index loads in flight, one per agent; only touched from the event loop
+        self._loading: Dict[int, asyncio.Task] = {}
+        # _NEO4J or an agent id -> monotonic time until which it is skipped
+        self._unavailable_until: Dict[object, float] = {}
+        self.retrievals = 0
+        self.matched = 0
+        self.index_misses = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.failures = 0
+        self.time_sum = 0.0
+
+    def add_document(self, agent_id: int, doc_id: int, names: List[str]) -> None:
+        """Index the entity names of a newly processed document. Safe to call from worker threads."""
+        with self._lock:
+            self._versions[agent_id] = self._versions.get(agent_id, 0) + 1
+            index = self._indexes.get(agent_id)
+            if index is not None:
+                index.add_document(doc_id, names)
+                index.version = self._versions[agent_id]
+
+    def remove_document(self, agent_id: int, doc_id: int) -> None:
+        """Drop the entity names of a deleted document. Safe to call from worker threads."""
+        with self._lock:
+            self._versions[agent_id] = self._versions.get(agent_id, 0) + 1
+            index = self._indexes.get(agent_id)
+            if index is not None:
+                index.remove_document(doc_id)
+                index.version = self._versions[agent_id]
+
+    async def retrieve(self, agent_id: int, text: str, model: str, max_tokens: int = KG_CONTEXT_MAX_TOKENS) -> Optional[str]:
+        """
+        Knowledge block for the system prompt, or None when nothing in text matches.
+
+        Never raises: retrieval is an optional enrichment and must not fail a chat turn.
+        """
+        if not KG_RETRIEVAL_ENABLED or max_tokens <= 0 or not self._available(agent_id):
+            return None
+        started = time.monotonic()
+        try:
+            index = self._get_index(agent_id)
+            if index is None:
+                self.index_misses += 1
+                return None
+            with self._lock:
+                names = index.match(text)[:KG_MAX_MATCHED_ENTITIES]
+                version = index.version
+            if not names:
+                return None
+            self.matched += 1
+            neighborhoods = await self._get_neighborhoods(agent_id, version, names)
+            return self._render(names, neighborhoods, model, max_tokens)
+        except Exception as e:
+            self._record_failure(agent_id, "retrieval", e)
+            return None
+        finally:
+            self.retrievals += 1
+            self.time_sum += time.monotonic() - started
+
+    def _available(self, agent_id: int) -> bool:
+        now = time.monotonic()
+        return now >= self._unavailable_until.get(_NEO4J, 0.0) and now >= self._unavailable_until.get(agent_id, 0.0)
+
+    def _record_failure(self, agent_id: int, what: str, error: Exception) -> None:
+        """Skip retrieval for KG_RETRY_AFTER: for every agent if Neo4j is unreachable, else for this agent only."""
+        self.failures += 1
+        now = time.monotonic()
+        key = _NEO4J if isinstance(error, _CONNECTION_ERRORS) else agent_id
+        for expired in [k for k, until in self._unavailable_until.items() if until <= now]:
+            del self._unavailable_until[expired]
+        self._unavailable_until[key] = now + KG_RETRY_AFTER
+        scope = "all agents" if key == _NEO4J else f"agent {agent_id}"
+        logger.warning(f"Knowledge {what} failed for agent {agent_id}, skipping {scope} for {KG_RETRY_AFTER:.0f}s: {error}")
+
+    def _get_index(self, agent_id: int) -> Optional[_AgentIndex]:
+        """The agent's index, stale or not, or None before its first load; starts a background load when due."""
+        with self._lock:
+            index = self._indexes.get(agent_id)
+            if index is not None:
+                self._indexes.move_to_end(agent_id)
+                if time.monotonic() - index.loaded_at < KG_MATCHER_REFRESH_SECONDS:
+                    return index
+        if agent_id not in self._loading:
+            task = asyncio.create_task(self._load_index(agent_id))
+            self._loading[agent_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(agent_id, None))
+        return index
+
+    async def _load_index(self, agent_id: int) -> None:
+        with self._lock:
+            version = self._versions.get(agent_id, 0)
+        try:
+            rows = await asyncio.to_thread(knowledge_repository.get_entity_names, agent_id)
+        except Exception as e:
+            # A stale index, if any, keeps serving until the next attempt
+            self._record_failure(agent_id, "index load", e)
+            return
+        loaded = _AgentIndex(version)
+        by_doc: Dict[int, List[str]] = {}
+        for row in rows:
+            by_doc.setdefault(row["document_id"], []).append(row["name"])
+        for doc_id, names in by_doc.items():
+            loaded.add_document(doc_id, names)
+        with self._lock:
+            current = self._versions.get(agent_id, 0)
+            if current != version:
+                # A document changed while loading and may be missing here; serve it, but reload on the next turn
+                loaded.version = current
+                loaded.loaded_at = float("-inf")
+            self._indexes[agent_id] = loaded
+            self._indexes.move_to_end(agent_id)
+            while len(self._indexes) > KG_MAX_AGENT_INDEXES:
+                self._indexes.popitem(last=False)
+
+    async def _get_neighborhoods(self, agent_id: int, version: int, names: List[str]) -> Dict[str, Dict]:
+        now = time.monotonic()
+        found: Dict[str, Dict] = {}
+        missing: List[str] = []
+        with self._lock:
+            for name in names:
+                entry = self._neighborhoods.get((agent_id, version, name))
+                if entry is not None and entry[0] > now:
+                    self._neighborhoods.move_to_end((agent_id, version, name))
+                    self.cache_hits += 1
+                    if entry[1] is not None:
+                        found[name] = entry[1]
+                else:
+                    missing.append(name)
+        if missing:
+            self.cache_misses += len(missing)
+            fetched = await asyncio.to_thread(
+                knowledge_repository.get_neighborhoods, agent_id, missing, KG_NEIGHBORS_PER_ENTITY,
+            )
+            found.update(fetched)
+            expires = time.monotonic() + KG_NEIGHBORHOOD_CACHE_TTL
+            with self._lock:
+                for name in missing:
+                    # Cache misses too (entity deleted meanwhile), as None
+                    self._neighborhoods[(agent_id, version, name)] = (expires, fetched.get(name))
+                while len(self._neighborhoods) > KG_NEIGHBORHOOD_CACHE_SIZE:
+                    self._neighborhoods.popitem(last=False)
+        return found
+
+    @staticmethod
+    def _render(names: List[str], neighborhoods: Dict[str, Dict], model: str, max_tokens: int) -> Optional[str]:
+        """Entities in order of mention, each with its relations, until the token budget runs out."""
+        lines = [KNOWLEDGE_HEADER]
+        used = count_tokens(KNOWLEDGE_HEADER, model)
+        for name in names:
+            hood = neighborhoods.get(name)
+            if hood is None:
+                continue
+            head = f"- {name}"
+            if hood.get("type"):
+                head += f" ({hood['type']})"
+            if hood.get("description"):
+                head += f": {hood['description']}"
+            cost = count_tokens(head, model) + 1
+            if used + cost > max_tokens:
+                break
+            lines.append(head)
+            used += cost
+            for source, relation, target in hood.get("relations", ()):
+                line = f"  - {source} -[{relation or 'RELATED_TO'}]-> {target}"
+                cost = count_tokens(line, model) + 1
+                if used + cost > max_tokens:
+                    break
+                lines.append(line)
+                used += cost
+        return "\n".join(lines) if len(lines) > 1 else None
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            indexed = {agent_id: len(index.matcher) for agent_id, index in self._indexes.items()}
+            cached = len(self._neighborhoods)
+        return {
+            "agents_indexed": len(indexed),
+            "entity_names": sum(indexed.values()),
+            "neighborhoods_cached": cached,
+            "retrievals": self.retrievals,
+            "matched": self.matched,
+            "index_misses": self.index_misses,
+            "index_loads_pending": len(self._loading),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "failures": self.failures,
+            "retrieval_ms_avg": self.time_sum / self.retrievals * 1000 if self.retrievals else 0.0,
+        }
+
+
+knowledge_retriever = KnowledgeRetriever()
@@ -2,150 +2,571 @@
 Knowledge service: document parsing, LLM extraction, graph management
 """
 import json
+import codecs
+import hashlib
 import logging
 import os
+import time
+import uuid
 import asyncio
-from typing import List, Dict, Optional
+import itertools
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Dict, Iterator, Optional, Set, Tuple
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.repositories.knowledge_repo import knowledge_repository
-from app.repositories.document_repo import document_repository
+from app.repositories.document_repo import document_repository, async_document_repository
+from app.repositories.job_repo import job_repository, async_job_repository
 from app.agent_repo.agent import AgentRepository
 from app.services.llm_service import llm_service
-from app.core.exceptions import NotFoundException, ErrorCode
+from app.services.knowledge_retrieval import knowledge_retriever
+from app.services.extraction_cache import extraction_cache, chunk_hash
+from app.services.text_chunker import TextChunker
+from app.services.history_builder import count_tokens
+from app.core.database import get_async_db_session
+from app.core.exceptions import NotFoundException, ParamErrorException, ErrorCode
 
 logger = logging.getLogger(__name__)
 agent_repository = AgentRepository()
 
+# Job workers read uploads from here; with several instances it must be shared storage
 UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+KNOWLEDGE_JOB_MAX_ATTEMPTS = int(os.getenv("KNOWLEDGE_JOB_MAX_ATTEMPTS", "3"))
+# Uploads are streamed to disk, so memory per upload does not grow with this limit
+KNOWLEDGE_MAX_UPLOAD_MB = float(os.getenv("KNOWLEDGE_MAX_UPLOAD_MB", "20"))
+# Read size when copying an upload to disk and when reading a document back for chunking
+FILE_IO_CHUNK_SIZE = 64 * 1024
+# LLM extraction calls in flight per document (each job worker processes one document)
+KNOWLEDGE_EXTRACTION_CONCURRENCY = int(os.getenv("KNOWLEDGE_EXTRACTION_CONCURRENCY", "8"))
+# Chunks read and extracted at a time, so a document's text is never all in memory
+EXTRACTION_WINDOW_CHUNKS = 64
+
+EXTRACTION_SYSTEM_PROMPT = "You are a knowledge graph construction assistant. Always respond with valid JSON only."
+EXTRACTION_TEMPERATURE = 0.1
+EXTRACTION_MAX_TOKENS = 2000
+
 EXTRACTION_PROMPT = """You are a knowledge graph construction assistant. Extract entities and their relationships from the following text.
 
 Output strict JSON only (no markdown, no explanation):
-{
+{{
   "entities": [
     {{"name": "entity name", "type": "Person|Organization|Technology|Concept|Event|Location", "description": "brief description"}}
   ],
   "relations": [
     {{"from": "source entity name", "to": "target entity name", "relation": "relationship type", "description": "relationship description"}}
   ]
-}
+}}
 
 Text:
 {content}"""
 
+# Consecutive chunks are packed into one extraction call up to this many input tokens (0 = one call per chunk, the default)
+KNOWLEDGE_EXTRACTION_BATCH_TOKENS = int(os.getenv("KNOWLEDGE_EXTRACTION_BATCH_TOKENS", "0"))
+KNOWLEDGE_EXTRACTION_BATCH_MAX_CHUNKS = int(os.getenv("KNOWLEDGE_EXTRACTION_BATCH_MAX_CHUNKS", "4"))
+# Output limit the model allows per call; every chunk in a batch gets EXTRACTION_MAX_TOKENS of it,
+# as in a call of its own, so this also caps the chunks per batch
+KNOWLEDGE_EXTRACTION_BATCH_OUTPUT_TOKENS = int(os.getenv("KNOWLEDGE_EXTRACTION_BATCH_OUTPUT_TOKENS", "8000"))
+
+EXTRACTION_BATCH_PROMPT = """You are a knowledge graph construction assistant. The text below consists of several sections, each starting with a line "### Section <id>". Extract entities and their relationships from every section separately: a relation only connects entities of the same section, and an entity mentioned in several sections is listed in each of them.
+
+Output strict JSON only (no markdown, no explanation), with one object per section:
+{{
+  "sections": [
+    {{
+      "id": "section id",
+      "entities": [
+        {{"name": "entity name", "type": "Person|Organization|Technology|Concept|Event|Location", "description": "brief description"}}
+      ],
+      "relations": [
+        {{"from": "source entity name", "to": "target entity name", "relation": "relationship type", "description": "relationship description"}}
+      ]
+    }}
+  ]
+}}
+
+{sections}"""
+
+# Part of the extraction cache key: editing the prompts or parameters above invalidates cached results
+EXTRACTION_PROMPT_VERSION = hashlib.sha256(
+    json.dumps([
+        EXTRACTION_SYSTEM_PROMPT, EXTRACTION_PROMPT, EXTRACTION_TEMPERATURE, EXTRACTION_MAX_TOKENS,
+        EXTRACTION_BATCH_PROMPT,
+    ]).encode("utf-8")
+).hexdigest()[:16]
+
+
+class DocumentProcessingError(Exception):
+    """Processing can never succeed (file missing, not UTF-8); the job is failed without retrying."""
 
-def asyncio_run(coro):
-    """Run async coroutine synchronously."""
-    try:
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            import concurrent.futures
-            with concurrent.futures.ThreadPoolExecutor() as pool:
-                return pool.submit(asyncio.run, coro).result()
-        return loop.run_until_complete(coro)
-    except RuntimeError:
-        return asyncio.run(coro)
+
+@dataclass
+class StagedUpload:
+    """An upload written to a temporary file in UPLOAD_DIR, not yet attached to a document."""
+    path: str
+    size: int
+    checksum: str
+
+    def discard(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
 
 
 class KnowledgeService:
 
-    def upload_document(self, db: Session, agent_id: int, user_id: int, filename: str, content: bytes) -> dict:
-        """Upload and process a document."""
-        # Validate agent ownership
-        agent = agent_repository.get_agent_by_id(db, agent_id)
-        if not agent or agent.user_id != user_id:
-            raise NotFoundException("Agent not found", ErrorCode.AGENT_NOT_FOUND)
+    async def stage_upload(self, source, max_bytes: int = None) -> StagedUpload:
+        """
+        Stream an upload to a temporary file in FILE_IO_CHUNK_SIZE reads.
+
+        source is anything with an async read(size), such as an UploadFile.
+        The size limit, UTF-8 validity and sha256 are all checked on the way,
+        so at most one chunk is held in memory and an oversized or binary
+        upload is rejected at the first chunk past the problem.
+        """
+        max_bytes = int(KNOWLEDGE_MAX_UPLOAD_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        path = os.path.join(UPLOAD_DIR, f".upload-{uuid.uuid4().hex}.part")
+        staged = StagedUpload(path=path, size=0, checksum="")
+        digest = hashlib.sha256()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            with open(path, "wb") as f:
+                while True:
+                    chunk = await source.read(FILE_IO_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    staged.size += len(chunk)
+                    if staged.size > max_bytes:
+                        raise ParamErrorException(f"File size exceeds {max_bytes / (1024 * 1024):g}MB limit")
+                    decoder.decode(chunk)
+                    digest.update(chunk)
+                    await asyncio.to_thread(f.write, chunk)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            staged.discard()
+            raise ParamErrorException("File must be UTF-8 encoded text")
+        except BaseException:
+            staged.discard()
+            raise
+        staged.checksum = digest.hexdigest()
+        return staged
+
+    def upload_document(self, db: Session, agent_id: int, user_id: int, filename: str, staged: StagedUpload) -> dict:
+        """
+        Attach a staged upload to a new document and queue it for processing.
 
-        file_size = len(content)
+        Returns at once with status "processing". The staged file is moved into
+        place with an atomic rename, or removed if anything fails.
+        """
+        try:
+            # Validate agent ownership
+            agent = agent_repository.get_agent_by_id(db, agent_id)
+            if not agent or agent.user_id != user_id:
+                raise NotFoundException("Agent not found", ErrorCode.AGENT_NOT_FOUND)
 
-        # Save to MySQL
-        doc = document_repository.create(db, agent_id, user_id, filename, file_size)
+            # Document row, file and job go in together: no document without a job to process it
+            doc = document_repository.create(db, agent_id, user_id, filename, staged.size, checksum=staged.checksum, commit=False)
+            file_path = self._version_path(doc.id, filename, staged.checksum)
+            try:
+                os.replace(staged.path, file_path)
+                job_repository.create(db, doc.id, agent_id, KNOWLEDGE_JOB_MAX_ATTEMPTS)
+            except Exception:
+                db.rollback()
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                raise
+        finally:
+            staged.discard()
+
+        return {
+            "id": doc.id,
+            "filename": doc.filename,
+            "status": doc.status,
+            "entity_count": doc.entity_count or 0,
+            "file_size": doc.file_size,
+            "checksum": doc.checksum,
+        }
+
+    def replace_document(self, db: Session, doc_id: int, user_id: int, filename: str, staged: StagedUpload) -> dict:
+        """
+        Swap a staged upload in as the new version of a document and queue it.
+
+        The job diffs the new chunks against the ones already in the graph, so
+        only added or changed chunks are extracted and only removed ones are
+        retracted; the rest of the document's subgraph is left alone.
+        """
+        try:
+            doc = document_repository.get_by_id(db, doc_id)
+            if not doc or doc.user_id != user_id:
+                raise NotFoundException("Document not found", ErrorCode.PARAM_ERROR)
+
+            old_path = self._document_path(doc)
+            # Each version has a file of its own: until the commit the row still points at
+            # the old one, and a job still reading the old version never sees the new bytes
+            file_path = self._version_path(doc.id, filename, staged.checksum)
+            document_repository.replace_file(db, doc, filename, staged.size, staged.checksum)
+            job_repository.create(db, doc.id, doc.agent_id, KNOWLEDGE_JOB_MAX_ATTEMPTS, commit=False)
+            try:
+                os.replace(staged.path, file_path)
+                db.commit()
+            except Exception:
+                db.rollback()
+                if file_path != old_path and os.path.exists(file_path):
+                    os.remove(file_path)
+                raise
+            # A job that opened the old file keeps reading it; one that had not yet sees it superseded
+            if old_path != file_path and os.path.exists(old_path):
+                os.remove(old_path)
+        finally:
+            staged.discard()
+
+        return {
+            "id": doc.id,
+            "filename": doc.filename,
+            "status": doc.status,
+            "entity_count": doc.entity_count or 0,
+            "file_size": doc.file_size,
+            "checksum": doc.checksum,
+        }
+
+    async def process_document(self, document_id: int) -> Optional[int]:
+        """
+        Extract a queued document into the knowledge graph (run by the job workers).
+
+        Returns the entity count, or None if the document was deleted meanwhile.
+        Raises DocumentProcessingError for permanent failures; anything else is retried.
+        """
+        db = get_async_db_session()
+        try:
+            doc = await async_document_repository.get_by_id(db, document_id)
+        finally:
+            await db.close()
+        if doc is None:
+            return None
+
+        db = get_async_db_session()
+        try:
+            stored = await async_document_repository.get_chunk_hashes(db, doc.id)
+        finally:
+            await db.close()
+
+        file_path = self._document_path(doc)
+        # Decoded incrementally and chunked as it is read, EXTRACTION_WINDOW_CHUNKS chunks at a time
+        chunks = self._chunker().chunks(self._read_text(file_path))
+        try:
+            try:
+                first = await asyncio.to_thread(self._take_window, chunks)
+            except FileNotFoundError:
+                if await self._superseded(doc):
+                    logger.info(f"Doc {doc.id} was replaced before its file was read, leaving it to the newer job")
+                    return None
+                raise DocumentProcessingError(f"Uploaded file {file_path} not found")
+            except UnicodeDecodeError as e:
+                raise DocumentProcessingError(f"Document is not valid UTF-8: {e}")
+            entity_count, kept, chunk_count, unchanged, cached = await self._process_chunks(
+                doc.id, doc.agent_id, self._windows(first, chunks), stored,
+            )
+        finally:
+            chunks.close()
 
-        # Save file to disk
-        file_path = os.path.join(UPLOAD_DIR, f"{doc.id}_{filename}")
-        with open(file_path, "wb") as f:
-            f.write(content)
+        db = get_async_db_session()
+        try:
+            # Baseline for the next replace first: a crash after it only repeats an idempotent run
+            if await async_document_repository.get_by_id(db, doc.id) is not None:
+                await async_document_repository.set_chunk_hashes(db, doc.id, kept)
+            updated = await async_document_repository.update_status(
+                db, doc.id, "completed", entity_count, chunk_count=chunk_count,
+                unchanged_chunk_count=unchanged, cached_chunk_count=cached,
+            )
+            if updated is None:
+                # Deleted while we were extracting: do not leave its entities behind
+                await asyncio.to_thread(knowledge_repository.delete_document_data, doc.id)
+                knowledge_retriever.remove_document(doc.agent_id, doc.id)
+                return None
+        finally:
+            await db.close()
+        return entity_count
 
-        # Process asynchronously (in background for now, synchronous for simplicity)
+    async def mark_failed(self, document_id: int) -> None:
+        db = get_async_db_session()
         try:
-            text = content.decode("utf-8")
-            entity_count = self._process_document(db, doc.id, agent_id, text)
-            document_repository.update_status(db, doc.id, "completed", entity_count)
-        except Exception as e:
-            logger.error(f"Failed to process document {doc.id}: {e}")
-            document_repository.update_status(db, doc.id, "failed", 0)
-
-        doc = document_repository.get_by_id(db, doc.id)
-        return {"id": doc.id, "filename": doc.filename, "status": doc.status, "entity_count": doc.entity_count}
-
-    def _process_document(self, db: Session, doc_id: int, agent_id: int, text: str) -> int:
-        """Split text into chunks and extract entities/relations via LLM."""
-        chunks = self._split_text(text, chunk_size=800)
-        all_entities = []
-        all_relations = []
-
-        for chunk in chunks:
+            await async_document_repository.update_status(db, document_id, "failed", 0)
+        finally:
+            await db.close()
+
+    @staticmethod
+    def _take_window(chunks: Iterator[str]) -> List[str]:
+        return list(itertools.islice(chunks, EXTRACTION_WINDOW_CHUNKS))
+
+    async def _windows(self, first: List[str], chunks: Iterator[str]) -> AsyncIterator[List[str]]:
+        """first, then the following windows of chunks, each read off the event loop."""
+        window = first
+        while window:
+            yield window
             try:
-                result = self._extract_with_llm(chunk)
-                all_entities.extend(result.get("entities", []))
-                all_relations.extend(result.get("relations", []))
-            except Exception as e:
-                logger.warning(f"LLM extraction failed for chunk in doc {doc_id}: {e}")
-                continue
-
-        # Deduplicate entities by name
-        seen = set()
-        unique_entities = []
-        for e in all_entities:
-            key = e["name"].lower().strip()
-            if key not in seen:
-                seen.add(key)
-                unique_entities.append(e)
-
-        # Store in Neo4j
-        if unique_entities:
-            count = knowledge_repository.store_entities_and_relations(
-                document_id=doc_id,
-                agent_id=agent_id,
-                entities=unique_entities,
-                relations=all_relations,
+                window = await asyncio.to_thread(self._take_window, chunks)
+            except UnicodeDecodeError as e:
+                raise DocumentProcessingError(f"Document is not valid UTF-8: {e}")
+
+    async def _process_chunks(
+        self, doc_id: int, agent_id: int, windows: AsyncIterator[List[str]], stored: Set[str],
+    ) -> Tuple[int, Set[str], int, int, int]:
+        """
+        Bring the document's graph in line with its chunks, given the hashes of the chunks already in it.
+
+        Only chunks not in stored are extracted, a window at a time, so only
+        hashes and extraction results accumulate over the document, never its
+        text; entities and relations that only came from chunks no longer
+        present are retracted. With nothing stored (new document, or one stored
+        before chunk hashes were tracked) the subgraph is rebuilt. The graph is
+        written once, after the last window. Returns (entity count, chunk
+        hashes now in the graph, chunk count, chunks unchanged since the stored
+        version, chunks served from the extraction cache).
+        """
+        seen: Set[str] = set()
+        cache_hit_hashes: Set[str] = set()
+        # (hash, result) of every chunk text extracted, in document order
+        results: List[Tuple[str, dict]] = []
+        chunk_count = unchanged = cached = attempted = 0
+        async for window in windows:
+            hashes = [chunk_hash(chunk) for chunk in window]
+            # First occurrence of every chunk text that is not in the graph yet
+            added: Dict[str, str] = {}
+            for h, chunk in zip(hashes, window):
+                if h not in stored and h not in seen and h not in added:
+                    added[h] = chunk
+            seen.update(hashes)
+            if added:
+                extracted, from_cache = await self._extract_chunks(doc_id, agent_id, list(added.values()))
+                attempted += len(added)
+                results.extend((h, result) for h, result in zip(added, extracted) if result is not None)
+                cache_hit_hashes.update(h for h, hit in zip(added, from_cache) if hit)
+            chunk_count += len(window)
+            unchanged += sum(1 for h in hashes if h in stored)
+            cached += sum(1 for h in hashes if h in cache_hit_hashes)
+        removed = stored - seen
+
+        if attempted and not results:
+            # Nothing extracted at all: more likely the LLM is down than the text empty, so retry the job
+            raise RuntimeError(f"LLM extraction failed for all {attempted} changed chunks of doc {doc_id}")
+
+        # Entity names are deduplicated case-insensitively, keeping the first mention's spelling;
+        # on a replace that includes entities kept from unchanged chunks, as a fresh ingest would
+        canonical: Dict[str, str] = {}
+        if stored and results:
+            kept_names = await asyncio.to_thread(knowledge_repository.get_document_entity_names, doc_id, sorted(removed))
+            for name in kept_names:
+                canonical.setdefault(name.lower().strip(), name)
+        added_chunks = []
+        for h, result in results:
+            entities, names_seen = [], set()
+            for e in result.get("entities", []):
+                key = e["name"].lower().strip()
+                if key not in names_seen:
+                    names_seen.add(key)
+                    entities.append(dict(e, name=canonical.setdefault(key, e["name"])))
+            added_chunks.append({"hash": h, "entities": entities, "relations": result.get("relations", [])})
+
+        # Neo4j is blocking, keep it off the event loop
+        names = await asyncio.to_thread(
+            knowledge_repository.apply_document_changes,
+            document_id=doc_id,
+            agent_id=agent_id,
+            removed_chunks=sorted(removed),
+            added_chunks=added_chunks,
+            rebuild=not stored,
+        )
+        knowledge_retriever.remove_document(agent_id, doc_id)
+        knowledge_retriever.add_document(agent_id, doc_id, names)
+
+        # Failed chunks stay out of the baseline, so the next run extracts them again
+        kept = (stored - removed) | {h for h, _ in results}
+        logger.info(
+            f"Doc {doc_id}: {chunk_count} chunks, {attempted} new or changed, {len(removed)} removed, "
+            f"{len(names)} entities"
+        )
+        return len(names), kept, chunk_count, unchanged, cached
+
+    async def _extract_chunks(self, doc_id: int, agent_id: int, chunks: List[str]) -> Tuple[List[Optional[dict]], List[bool]]:
+        """
+        Extract all chunks concurrently, at most KNOWLEDGE_EXTRACTION_CONCURRENCY calls at a time.
+
+        Chunks whose text was extracted before with the same prompt and model
+        come from the extraction cache, and repeated chunks are extracted once.
+        The rest are packed into batched calls (see _plan_batches); a chunk a
+        batched call failed on or left out is retried in a call of its own.
+        Returns one result per chunk in chunk order (None where extraction
+        failed) and whether each chunk was served from the cache.
+        """
+        model = llm_service.resolve_model()
+        hashes = [chunk_hash(chunk) for chunk in chunks]
+        cached = await extraction_cache.get_many(hashes, EXTRACTION_PROMPT_VERSION, model)
+        # First chunk index of every distinct text that still needs the LLM
+        pending: Dict[str, int] = {}
+        for index, h in enumerate(hashes):
+            if h not in cached and h not in pending:
+                pending[h] = index
+        texts = [chunks[i] for i in pending.values()]
+
+        semaphore = asyncio.Semaphore(max(KNOWLEDGE_EXTRACTION_CONCURRENCY, 1))
+        latencies: List[float] = []
+
+        async def extract(batch: List[int]) -> List[Optional[dict]]:
+            async with semaphore:
+                started = time.monotonic()
+                try:
+                    if len(batch) == 1:
+                        return [await self._extract_with_llm(texts[batch[0]], agent_id)]
+                    return await self._extract_batch_with_llm([texts[i] for i in batch], agent_id)
+                except Exception as e:
+                    logger.warning(f"LLM extraction failed for {len(batch)} chunks in doc {doc_id}: {e}")
+                    return [None] * len(batch)
+                finally:
+                    latencies.append(time.monotonic() - started)
+
+        started = time.monotonic()
+        batches = self._plan_batches(texts, model)
+        extracted: List[Optional[dict]] = [None] * len(texts)
+        retry: List[int] = []
+        for batch, output in zip(batches, await asyncio.gather(*(extract(b) for b in batches))):
+            for i, result in zip(batch, output):
+                extracted[i] = result
+                if result is None and len(batch) > 1:
+                    retry.append(i)
+        if retry:
+            logger.info(f"Doc {doc_id}: retrying {len(retry)} chunks missing from batched extraction one by one")
+            for i, output in zip(retry, await asyncio.gather(*(extract([i]) for i in retry))):
+                extracted[i] = output[0]
+        fresh = {h: result for h, result in zip(pending, extracted) if result is not None}
+        await extraction_cache.put_many(fresh, EXTRACTION_PROMPT_VERSION, model)
+
+        results = [cached.get(h, fresh.get(h)) for h in hashes]
+        from_cache = [h in cached for h in hashes]
+        cache_hits = sum(from_cache)
+        if chunks:
+            ordered = sorted(latencies) or [0.0]
+            logger.info(
+                f"Extracted doc {doc_id}: {len(chunks)} chunks in {time.monotonic() - started:.2f}s, "
+                f"{cache_hits} from cache ({cache_hits / len(chunks):.0%}), {len(pending)} extracted in "
+                f"{len(latencies)} LLM calls (concurrency {KNOWLEDGE_EXTRACTION_CONCURRENCY}), "
+                f"per call p50 {ordered[len(ordered) // 2]:.2f}s "
+                f"p95 {ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]:.2f}s max {ordered[-1]:.2f}s, "
+                f"{sum(1 for r in results if r is None)} failed"
             )
-            return count
-        return 0
-
-    def _split_text(self, text: str, chunk_size: int = 800) -> List[str]:
-        """Split text into chunks by paragraphs."""
-        paragraphs = text.split("\n\n")
-        chunks = []
-        current_chunk = ""
-
-        for para in paragraphs:
-            para = para.strip()
-            if not para:
-                continue
-            if len(current_chunk) + len(para) > chunk_size and current_chunk:
-                chunks.append(current_chunk.strip())
-                current_chunk = para
-            else:
-                current_chunk += "\n\n" + para if current_chunk else para
-
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
-
-        return chunks if chunks else [text[:chunk_size]]
-
-    def _extract_with_llm(self, content: str) -> dict:
+        return results, from_cache
+
+    @staticmethod
+    def _plan_batches(texts: List[str], model: str) -> List[List[int]]:
+        """
+        Group consecutive texts into extraction calls.
+
+        A batch holds at most KNOWLEDGE_EXTRACTION_BATCH_MAX_CHUNKS texts (and
+        no more than fit EXTRACTION_MAX_TOKENS of output each) of
+        KNOWLEDGE_EXTRACTION_BATCH_TOKENS tokens together; a text over the
+        budget gets a call of its own.
+        """
+        max_chunks = min(KNOWLEDGE_EXTRACTION_BATCH_MAX_CHUNKS, KNOWLEDGE_EXTRACTION_BATCH_OUTPUT_TOKENS // EXTRACTION_MAX_TOKENS)
+        if KNOWLEDGE_EXTRACTION_BATCH_TOKENS <= 0 or max_chunks <= 1:
+            return [[i] for i in range(len(texts))]
+        batches: List[List[int]] = []
+        current: List[int] = []
+        total = 0
+        for index, text in enumerate(texts):
+            tokens = count_tokens(text, model)
+            if current and (total + tokens > KNOWLEDGE_EXTRACTION_BATCH_TOKENS
+                            or len(current) >= max_chunks):
+                batches.append(current)
+                current, total = [], 0
+            current.append(index)
+            total += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def _version_path(doc_id: int, filename: str, checksum: str) -> str:
+        """Where a document version is stored; named by checksum so a replace never overwrites a file in use."""
+        return os.path.join(UPLOAD_DIR, f"{doc_id}_{checksum[:16]}_{filename}")
+
+    def _document_path(self, doc) -> str:
+        """File of a document's current version (files stored before versioning carry only id and filename)."""
+        if doc.checksum:
+            path = self._version_path(doc.id, doc.filename, doc.checksum)
+            if os.path.exists(path):
+                return path
+        return os.path.join(UPLOAD_DIR, f"{doc.id}_{doc.filename}")
+
+    @staticmethod
+    async def _superseded(doc) -> bool:
+        """Whether the document was replaced (or deleted) since doc was read."""
+        db = get_async_db_session()
+        try:
+            current = await async_document_repository.get_by_id(db, doc.id)
+        finally:
+            await db.close()
+        return current is None or (current.filename, current.checksum) != (doc.filename, doc.checksum)
+
+    @staticmethod
+    def _read_text(file_path: str) -> Iterator[str]:
+        """Decode a UTF-8 file in FILE_IO_CHUNK_SIZE pieces (universal newlines, so CRLF files split into paragraphs too)."""
+        with open(file_path, "r", encoding="utf-8") as f:
+            while True:
+                piece = f.read(FILE_IO_CHUNK_SIZE)
+                if not piece:
+                    return
+                yield piece
+
+    @staticmethod
+    def _chunker() -> TextChunker:
+        """Chunker counting tokens with the extraction model's tokenizer."""
+        model = llm_service.resolve_model()
+        return TextChunker(lambda text: count_tokens(text, model))
+
+    async def _extract_with_llm(self, content: str, agent_id: Optional[int] = None) -> dict:
         """Call LLM to extract entities and relations from text."""
         prompt = EXTRACTION_PROMPT.format(content=content)
-        response = asyncio_run(llm_service.chat(
-            system_prompt="You are a knowledge graph construction assistant. Always respond with valid JSON only.",
+        response = await llm_service.chat(
+            system_prompt=EXTRACTION_SYSTEM_PROMPT,
             history=[],
             user_message=prompt,
-            temperature=0.1,
-            max_tokens=2000,
-        ))
-        # Parse JSON from response (handle markdown code blocks)
+            temperature=EXTRACTION_TEMPERATURE,
+            max_tokens=EXTRACTION_MAX_TOKENS,
+            agent_id=agent_id,
+            call_site="extraction",
+        )
+        return self._parse_json(response)
+
+    async def _extract_batch_with_llm(self, contents: List[str], agent_id: Optional[int] = None) -> List[Optional[dict]]:
+        """
+        Extract several texts in one LLM call, as numbered sections of one prompt.
+
+        Returns one {"entities", "relations"} result per text, in order; None
+        for a section the response left out.
+        """
+        sections = "\n\n".join(f"### Section {i}\n{content}" for i, content in enumerate(contents, 1))
+        response = await llm_service.chat(
+            system_prompt=EXTRACTION_SYSTEM_PROMPT,
+            history=[],
+            user_message=EXTRACTION_BATCH_PROMPT.format(sections=sections),
+            temperature=EXTRACTION_TEMPERATURE,
+            max_tokens=EXTRACTION_MAX_TOKENS * len(contents),
+            agent_id=agent_id,
+            call_site="extraction_batch",
+        )
+        by_id = {}
+        for section in self._parse_json(response).get("sections") or []:
+            if isinstance(section, dict) and "id" in section:
+                by_id[str(section["id"]).strip()] = {
+                    "entities": section.get("entities") or [],
+                    "relations": section.get("relations") or [],
+                }
+        return [by_id.get(str(i)) for i in range(1, len(contents) + 1)]
+
+    @staticmethod
+    def _parse_json(response: str) -> dict:
+        """Parse JSON from an LLM response (handle markdown code blocks)."""
         response = response.strip()
         if response.startswith("```"):
             response = response.split("```")[1]
@@ -154,8 +575,33 @@ class KnowledgeService:
             response = response.strip()
         return json.loads(response)
 
-    def get_documents(self, db: Session, agent_id: int, user_id: int, skip: int = 0, limit: int = 50) -> list:
-        return document_repository.get_by_agent(db, agent_id, user_id, skip, limit)
+    async def get_document_status(self, db: AsyncSession, doc_id: int, user_id: int) -> dict:
+        """Processing status of a document together with its job (attempts, last error)."""
+        doc = await async_document_repository.get_by_id(db, doc_id)
+        if not doc or doc.user_id != user_id:
+            raise NotFoundException("Document not found", ErrorCode.PARAM_ERROR)
+        job = await async_job_repository.get_latest_for_document(db, doc_id)
+        # Chunks that went to the extraction cache: all but those unchanged since the previous version
+        looked_up = (doc.chunk_count or 0) - (doc.unchanged_chunk_count or 0)
+        return {
+            "id": doc.id,
+            "status": doc.status,
+            "entity_count": doc.entity_count or 0,
+            "chunk_count": doc.chunk_count,
+            "unchanged_chunk_count": doc.unchanged_chunk_count,
+            "cached_chunk_count": doc.cached_chunk_count,
+            "cache_hit_ratio": (
+                round(doc.cached_chunk_count / looked_up, 4) if doc.cached_chunk_count is not None and looked_up else None
+            ),
+            "job_status": job.status if job else None,
+            "attempts": job.attempts if job else 0,
+            "max_attempts": job.max_attempts if job else 0,
+            "last_error": job.last_error if job else None,
+            "updated_at": job.updated_at if job else None,
+        }
+
+    async def get_documents(self, db: AsyncSession, agent_id: int, user_id: int, skip: int = 0, limit: int = 50) -> list:
+        return await async_document_repository.get_by_agent(db, agent_id, user_id, skip, limit)
 
     def delete_document(self, db: Session, doc_id: int, user_id: int) -> bool:
         doc = document_repository.get_by_id(db, doc_id)
@@ -163,8 +609,9 @@ class KnowledgeService:
             raise NotFoundException("Document not found", ErrorCode.PARAM_ERROR)
         # Clean up Neo4j
         knowledge_repository.delete_document_data(doc_id)
+        knowledge_retriever.remove_document(doc.agent_id, doc_id)
         # Clean up file
-        file_path = os.path.join(UPLOAD_DIR, f"{doc_id}_{doc.filename}")
+        file_path = self._document_path(doc)
         if os.path.exists(file_path):
             os.remove(file_path)
         return document_repository.delete(db, doc_id)
@@ -175,5 +622,9 @@ class KnowledgeService:
     def search_entities(self, agent_id: int, query: str) -> list:
         return knowledge_repository.search_entities(agent_id, query)
 
+    def ensure_graph_schema(self, wait_seconds: Optional[float] = None) -> List[str]:
+        """Create the Neo4j constraints and indexes that are missing; returns their names."""
+        return knowledge_repository.ensure_schema(wait_seconds)
+
 
 knowledge_service = KnowledgeService()
@@ -0,0 +1,105 @@
+"""
+Generation metrics of LLM calls: TTFT, gaps between streamed chunks, output tokens and decode throughput
+"""
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from app.core.metrics import registry, LATENCY_BUCKETS, TOKEN_BUCKETS, RATE_BUCKETS
+
+# Where the call comes from: "chat", "summary" or "extraction"; model is the one the serving backend ran
+LABELS = ("call_site", "model", "agent_id")
+
+TTFT = registry.histogram(
+    "llm_ttft_seconds", "Time from request to first streamed chunk", LABELS, LATENCY_BUCKETS,
+)
+# A streamed chunk may hold several tokens, so this is not per-token latency
+INTER_CHUNK = registry.histogram(
+    "llm_inter_chunk_seconds", "Gap between consecutive streamed chunks", LABELS,
+    (0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0),
+)
+DURATION = registry.histogram(
+    "llm_request_duration_seconds", "Wall time of an LLM call until its last token", LABELS, LATENCY_BUCKETS,
+)
+OUTPUT_TOKENS = registry.histogram(
+    "llm_output_tokens", "Output tokens per call (provider-reported usage, else counted with the model's tokenizer)",
+    LABELS, TOKEN_BUCKETS,
+)
+TOKENS_PER_SECOND = registry.histogram(
+    "llm_tokens_per_second", "Output tokens per second after the first chunk (whole call when not streaming)",
+    LABELS, RATE_BUCKETS,
+)
+REQUESTS = registry.counter(
+    "llm_requests", "LLM calls by outcome (ok, error, cancelled)", LABELS + ("outcome",),
+)
+
+
+@dataclass
+class GenerationStats:
+    """
+    Timings of one LLM call, filled in while it runs.
+
+    Callers that want the numbers afterwards (e.g. to store them with the
+    message) pass their own instance; LLMService records the histograms either way.
+    """
+    call_site: str = "chat"
+    agent_id: Optional[int] = None
+    model: Optional[str] = None
+    backend: Optional[str] = None
+    ttft: Optional[float] = None
+    duration: Optional[float] = None
+    output_tokens: int = 0
+    chunks: int = 0
+    started: float = field(default_factory=time.monotonic, init=False)
+    _last_chunk: Optional[float] = field(default=None, init=False, repr=False)
+
+    @property
+    def labels(self) -> Dict[str, object]:
+        return {"call_site": self.call_site, "model": self.model, "agent_id": self.agent_id}
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if self.duration is None:
+            return None
+        if self.ttft is None:
+            # Non-streaming: only the total is known
+            return self.output_tokens / self.duration if self.output_tokens and self.duration > 0 else None
+        decode = self.duration - self.ttft
+        return (self.output_tokens - 1) / decode if self.output_tokens > 1 and decode > 0 else None
+
+    def chunk(self) -> None:
+        """Record the arrival of one streamed chunk."""
+        now = time.monotonic()
+        if self.ttft is None:
+            self.ttft = now - self.started
+            TTFT.observe(self.ttft, **self.labels)
+        else:
+            INTER_CHUNK.observe(now - self._last_chunk, **self.labels)
+        self._last_chunk = now
+        self.chunks += 1
+
+    def finish(self, outcome: str, output_tokens: Optional[int] = None) -> None:
+        """Record the end of the call, with the tokens of the text generated so far."""
+        if self.duration is not None:
+            return
+        if output_tokens is not None:
+            self.output_tokens = output_tokens
+        end = self._last_chunk if self._last_chunk is not None and outcome == "ok" else time.monotonic()
+        self.duration = end - self.started
+        labels = self.labels
+        REQUESTS.inc(outcome=outcome, **labels)
+        if outcome != "ok":
+            return
+        DURATION.observe(self.duration, **labels)
+        OUTPUT_TOKENS.observe(self.output_tokens, **labels)
+        rate = self.tokens_per_second
+        if rate is not None:
+            TOKENS_PER_SECOND.observe(rate, **labels)
+
+    def as_columns(self) -> Dict[str, Optional[int]]:
+        """Per-turn numbers as stored on the assistant message."""
+        return {
+            "llm_model": self.model,
+            "ttft_ms": round(self.ttft * 1000) if self.ttft is not None else None,
+            "duration_ms": round(self.duration * 1000) if self.duration is not None else None,
+            "output_tokens": self.output_tokens if self.duration is not None else None,
+        }
@@ -0,0 +1,208 @@
+"""
+Routing across OpenAI-compatible LLM backends: rolling health, circuit breaking and hedge delays
+"""
+import os
+import json
+import time
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# JSON list of {"name", "base_url", "api_key", "model"}; api_key and model are optional.
+# Unset means a single backend from OPENAI_BASE_URL / OPENAI_API_KEY.
+LLM_BACKENDS = os.getenv("LLM_BACKENDS", "")
+# Samples kept per backend for TTFT percentiles and error rate
+LLM_HEALTH_WINDOW = int(os.getenv("LLM_HEALTH_WINDOW", "100"))
+# Circuit opens after this many consecutive failures...
+LLM_CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", "5"))
+# ...or when the windowed error rate passes this (with at least LLM_CIRCUIT_MIN_SAMPLES outcomes)
+LLM_CIRCUIT_ERROR_RATE = float(os.getenv("LLM_CIRCUIT_ERROR_RATE", "0.5"))
+LLM_CIRCUIT_MIN_SAMPLES = int(os.getenv("LLM_CIRCUIT_MIN_SAMPLES", "20"))
+# Seconds an open circuit waits before letting one trial request through
+LLM_CIRCUIT_COOLDOWN = float(os.getenv("LLM_CIRCUIT_COOLDOWN", "30"))
+# Hedged streaming requests: start a second backend when the first token is later than the primary's p95
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.2"))
+# Hedge delay until a backend has LLM_HEDGE_MIN_SAMPLES TTFT samples
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "2.0"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class LLMUnavailableError(Exception):
+    """No backend could serve the request."""
+
+
+@dataclass
+class LLMBackend:
+    name: str
+    base_url: Optional[str]
+    api_key: Optional[str]
+    # Overrides the requested model on this backend (e.g. a local model)
+    model: Optional[str] = None
+
+
+def load_backends(default_base_url: Optional[str], default_api_key: Optional[str]) -> List[LLMBackend]:
+    """Backends from LLM_BACKENDS, falling back to the single default endpoint."""
+    if not LLM_BACKENDS.strip():
+        return [LLMBackend("default", default_base_url, default_api_key)]
+    backends = []
+    for i, item in enumerate(json.loads(LLM_BACKENDS)):
+        backends.append(LLMBackend(
+            name=item.get("name") or f"backend{i}",
+            base_url=item.get("base_url"),
+            api_key=item.get("api_key") or default_api_key,
+            model=item.get("model"),
+        ))
+    return backends
+
+
+def _percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class BackendHealth:
+    """Rolling TTFT and outcome window plus circuit state of one backend."""
+
+    def __init__(self, backend: LLMBackend, window: int = LLM_HEALTH_WINDOW):
+        self.backend = backend
+        self.ttfts: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.requests = 0
+        self.failures = 0
+        self.hedges = 0
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def ttft_percentile(self, q: float) -> Optional[float]:
+        return _percentile(self.ttfts, q) if self.ttfts else None
+
+    def score(self) -> float:
+        """Lower is healthier: median TTFT inflated by the error rate. Untried backends score 0 so they get explored."""
+        median = self.ttft_percentile(0.5) or 0.0
+        return median * (1 + 10 * self.error_rate)
+
+
+class LLMRouter:
+    """
+    Picks backends for each request, healthiest first.
+
+    Backends with an open circuit are skipped until their cooldown is over;
+    then a single trial request decides whether the circuit closes again.
+    """
+
+    def __init__(self, backends: List[LLMBackend]):
+        if not backends:
+            raise ValueError("At least one LLM backend is required")
+        self._health: Dict[str, BackendHealth] = {b.name: BackendHealth(b) for b in backends}
+
+    @property
+    def backends(self) -> List[LLMBackend]:
+        return [h.backend for h in self._health.values()]
+
+    def _available(self, health: BackendHealth, now: float) -> bool:
+        if health.state == CLOSED:
+            return True
+        if health.state == OPEN and now - health.opened_at >= LLM_CIRCUIT_COOLDOWN:
+            health.state = HALF_OPEN
+            health.trial_in_flight = False
+        return health.state == HALF_OPEN and not health.trial_in_flight
+
+    def candidates(self) -> List[LLMBackend]:
+        """
+        Usable backends ordered by health.
+
+        A half-open backend comes first so it gets its trial request (failing
+        over to the healthy ones if the trial fails); begin() takes the slot.
+        """
+        now = time.monotonic()
+        usable = [h for h in self._health.values() if self._available(h, now)]
+        usable.sort(key=lambda h: (h.state == CLOSED, h.score()))
+        return [h.backend for h in usable]
+
+    def begin(self, backend: LLMBackend) -> None:
+        health = self._health[backend.name]
+        health.requests += 1
+        if health.state == HALF_OPEN:
+            health.trial_in_flight = True
+
+    def record_ttft(self, backend: LLMBackend, seconds: float) -> None:
+        self._health[backend.name].ttfts.append(seconds)
+
+    def record_success(self, backend: LLMBackend) -> None:
+        health = self._health[backend.name]
+        health.outcomes.append(True)
+        health.consecutive_failures = 0
+        if health.state != CLOSED:
+            logger.info(f"LLM backend {backend.name} recovered, closing circuit")
+        health.state = CLOSED
+        health.trial_in_flight = False
+
+    def record_failure(self, backend: LLMBackend) -> None:
+        health = self._health[backend.name]
+        health.outcomes.append(False)
+        health.failures += 1
+        health.consecutive_failures += 1
+        trips = (
+            health.state == HALF_OPEN
+            or health.consecutive_failures >= LLM_CIRCUIT_FAILURES
+            or (len(health.outcomes) >= LLM_CIRCUIT_MIN_SAMPLES and health.error_rate >= LLM_CIRCUIT_ERROR_RATE)
+        )
+        if trips and health.state != OPEN:
+            logger.warning(f"Opening circuit for LLM backend {backend.name} (error rate {health.error_rate:.0%})")
+        if trips:
+            health.state = OPEN
+            health.opened_at = time.monotonic()
+        health.trial_in_flight = False
+
+    def record_abandoned(self, backend: LLMBackend, waited: Optional[float] = None) -> None:
+        """
+        A request was dropped (lost a hedge race, or the caller went away): neither success nor failure.
+
+        waited, if given, is how long it went without a first token, kept as a lower-bound TTFT sample.
+        """
+        health = self._health[backend.name]
+        health.trial_in_flight = False
+        if waited is not None:
+            health.ttfts.append(waited)
+
+    def record_hedge(self, backend: LLMBackend) -> None:
+        self._health[backend.name].hedges += 1
+
+    def hedge_delay(self, backend: LLMBackend) -> Optional[float]:
+        """Seconds to wait for the first token before hedging, or None when hedging is off."""
+        if not LLM_HEDGE_ENABLED or len(self._health) < 2:
+            return None
+        health = self._health[backend.name]
+        if len(health.ttfts) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return max(health.ttft_percentile(0.95), LLM_HEDGE_MIN_DELAY)
+
+    def stats(self) -> Dict[str, Dict]:
+        result = {}
+        for name, h in self._health.items():
+            p50 = h.ttft_percentile(0.5)
+            p95 = h.ttft_percentile(0.95)
+            result[name] = {
+                "state": h.state,
+                "requests": h.requests,
+                "failures": h.failures,
+                "hedges": h.hedges,
+                "error_rate": round(h.error_rate, 4),
+                "ttft_ms_p50": round(p50 * 1000, 1) if p50 is not None else None,
+                "ttft_ms_p95": round(p95 * 1000, 1) if p95 is not None else None,
+            }
+        return result
@@ -2,35 +2,155 @@
 LLM service using LangChain + OpenAI with streaming support
 """
 import os
-from typing import AsyncGenerator, List, Dict
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncGenerator, AsyncIterator, List, Dict, Optional, Tuple
+import httpx
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from app.services.llm_router import LLMRouter, LLMBackend, LLMUnavailableError, load_backends
+from app.services.llm_metrics import GenerationStats
+from app.services.history_builder import count_tokens
+
+logger = logging.getLogger(__name__)
+
+LLM_CLIENT_POOL_SIZE = int(os.getenv("LLM_CLIENT_POOL_SIZE", "32"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "120"))
+
+# (backend, model, temperature, max_tokens, streaming)
+ClientKey = Tuple[str, str, float, int, bool]
+
+
+class _ClientPool:
+    """LRU pool of ChatOpenAI clients sharing one keep-alive HTTP connection pool.
+
+    httpx.AsyncClient connections are bound to the event loop that opened them,
+    so there is one pool per running loop (in practice, one per worker process).
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=LLM_HTTP_TIMEOUT,
+        )
+        self.models: "OrderedDict[ClientKey, ChatOpenAI]" = OrderedDict()
+
+    def get(self, key: ClientKey) -> Optional[ChatOpenAI]:
+        chat_model = self.models.get(key)
+        if chat_model is not None:
+            self.models.move_to_end(key)
+        return chat_model
+
+    def put(self, key: ClientKey, chat_model: ChatOpenAI) -> None:
+        self.models[key] = chat_model
+        self.models.move_to_end(key)
+        # Evicted clients hold no connections of their own, nothing to close
+        while len(self.models) > self.max_size:
+            self.models.popitem(last=False)
+
+
+async def _content_tokens(chunks) -> AsyncIterator[str]:
+    """Non-empty content of streamed chunks. Closing this closes the upstream request."""
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            if chunk.content:
+                yield chunk.content
+
+
+# (backend, token stream, first token or None if the answer was empty)
+OpenedStream = Tuple[LLMBackend, AsyncIterator[str], Optional[str]]
 
 
 class LLMService:
     def __init__(self):
         self._api_key = os.getenv("OPENAI_API_KEY")
+        # Any OpenAI-compatible endpoint, e.g. fake_llm_server.py for offline load tests
+        self._base_url = os.getenv("OPENAI_BASE_URL") or None
+        self._router = LLMRouter(load_backends(self._base_url, self._api_key))
+        # With several backends, fail over to another one instead of retrying the same
+        self._client_retries = 0 if len(self._router.backends) > 1 else 2
         self._model_name = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+        self._pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _ClientPool]" = weakref.WeakKeyDictionary()
+        self._pools_lock = threading.Lock()
 
-    def _get_chat_model(self, temperature: float = 0.7, max_tokens: int = 2048) -> ChatOpenAI:
-        return ChatOpenAI(
-            api_key=self._api_key,
-            model=self._model_name,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            streaming=True,
-        )
+    def resolve_model(self, model: Optional[str] = None) -> str:
+        """Model name to use for a request: the agent's choice or the default."""
+        return model or self._model_name
+
+    def _backend_model(self, backend: LLMBackend, model: Optional[str] = None) -> str:
+        """Model a backend actually runs for a request: its own configured model overrides the requested one."""
+        return backend.model or self.resolve_model(model)
+
+    def _get_pool(self) -> _ClientPool:
+        loop = asyncio.get_running_loop()
+        with self._pools_lock:
+            pool = self._pools.get(loop)
+            if pool is None:
+                pool = _ClientPool(LLM_CLIENT_POOL_SIZE)
+                self._pools[loop] = pool
+            return pool
+
+    def _get_chat_model(
+        self,
+        temperature: float = 0.7,
+        max_tokens: int = 2048,
+        model: Optional[str] = None,
+        streaming: bool = True,
+        backend: Optional[LLMBackend] = None,
+    ) -> ChatOpenAI:
+        """Return a pooled client for (backend, model, temperature, max_tokens, streaming)."""
+        pool = self._get_pool()
+        backend = backend or self._router.backends[0]
+        key = (backend.name, self._backend_model(backend, model), temperature, max_tokens, streaming)
+        chat_model = pool.get(key)
+        if chat_model is None:
+            chat_model = ChatOpenAI(
+                api_key=backend.api_key,
+                base_url=backend.base_url,
+                model=key[1],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                streaming=streaming,
+                max_retries=self._client_retries,
+                http_async_client=pool.http_client,
+            )
+            pool.put(key, chat_model)
+        return chat_model
+
+    async def aclose(self) -> None:
+        """Close the HTTP connection pool owned by the current event loop."""
+        loop = asyncio.get_running_loop()
+        with self._pools_lock:
+            pool = self._pools.pop(loop, None)
+        if pool is not None:
+            await pool.http_client.aclose()
 
     def build_messages(
         self,
         system_prompt: str,
         history: List[Dict[str, str]],
         user_message: str,
+        summary: Optional[str] = None,
     ) -> List:
-        """Build LangChain message list from history and current input."""
+        """Build LangChain message list from the summary of earlier turns, recent history and current input."""
         messages = []
         if system_prompt:
             messages.append(SystemMessage(content=system_prompt))
+        if summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
         for msg in history:
             if msg["role"] == "user":
                 messages.append(HumanMessage(content=msg["content"]))
@@ -46,15 +166,149 @@ class LLMService:
         user_message: str,
         temperature: float = 0.7,
         max_tokens: int = 2048,
+        model: Optional[str] = None,
+        summary: Optional[str] = None,
+        agent_id: Optional[int] = None,
+        call_site: str = "chat",
+        stats: Optional[GenerationStats] = None,
     ) -> AsyncGenerator[str, None]:
-        """Stream chat tokens as an async generator."""
-        chat_model = self._get_chat_model(temperature=temperature, max_tokens=max_tokens)
-        messages = self.build_messages(system_prompt, history, user_message)
+        """
+        Stream chat tokens as an async generator, from the healthiest backend.
 
-        async for chunk in chat_model.astream(messages):
-            token = chunk.content
-            if token:
+        TTFT, gaps between chunks, output tokens and throughput are recorded
+        into the LLM metrics and, if given, into stats, labelled with the model
+        of the backend that served the call.
+        """
+        stats = self._start_stats(stats, model, agent_id, call_site)
+        messages = self.build_messages(system_prompt, history, user_message, summary)
+        try:
+            backend, stream, first = await self._open_routed_stream(messages, temperature, max_tokens, model)
+        except Exception:
+            stats.finish("error")
+            raise
+        except BaseException:
+            stats.finish("cancelled")
+            raise
+        stats.backend = backend.name
+        stats.model = self._backend_model(backend, model)
+        # Chunks can hold several tokens each; the text is tokenized once at the end
+        parts: List[str] = []
+        try:
+            if first:
+                stats.chunk()
+                parts.append(first)
+                yield first
+            async for token in stream:
+                stats.chunk()
+                parts.append(token)
                 yield token
+        except Exception:
+            self._router.record_failure(backend)
+            stats.finish("error", output_tokens=count_tokens("".join(parts), stats.model))
+            raise
+        except BaseException:
+            # Consumer went away (disconnect, cancel): says nothing about the backend
+            self._router.record_abandoned(backend)
+            stats.finish("cancelled", output_tokens=count_tokens("".join(parts), stats.model))
+            raise
+        else:
+            self._router.record_success(backend)
+            stats.finish("ok", output_tokens=count_tokens("".join(parts), stats.model))
+        finally:
+            await stream.aclose()
+
+    def _start_stats(
+        self, stats: Optional[GenerationStats], model: Optional[str], agent_id: Optional[int], call_site: str,
+    ) -> GenerationStats:
+        stats = stats if stats is not None else GenerationStats()
+        stats.call_site = call_site
+        stats.agent_id = agent_id
+        stats.model = self.resolve_model(model)
+        stats.started = time.monotonic()
+        return stats
+
+    async def _open_stream(
+        self, backend: LLMBackend, messages: List, temperature: float, max_tokens: int, model: Optional[str],
+    ) -> OpenedStream:
+        """Start a streaming request on one backend and wait for its first token."""
+        chat_model = self._get_chat_model(temperature=temperature, max_tokens=max_tokens, model=model, backend=backend)
+        self._router.begin(backend)
+        started = time.monotonic()
+        stream = _content_tokens(chat_model.astream(messages))
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            await stream.aclose()
+            raise
+        self._router.record_ttft(backend, time.monotonic() - started)
+        return backend, stream, first
+
+    async def _open_routed_stream(
+        self, messages: List, temperature: float, max_tokens: int, model: Optional[str],
+    ) -> OpenedStream:
+        """
+        Open a stream on the healthiest backend.
+
+        Fails over to the next backend if a request errors before its first
+        token. With hedging on, a second backend is started when the first token
+        is later than the primary's p95 TTFT, and whichever answers first wins.
+        """
+        candidates = self._router.candidates()
+        if not candidates:
+            raise LLMUnavailableError("All LLM backends are unavailable")
+        # task -> (backend, start time)
+        attempts: Dict[asyncio.Task, Tuple[LLMBackend, float]] = {}
+
+        def launch() -> LLMBackend:
+            backend = candidates.pop(0)
+            task = asyncio.create_task(self._open_stream(backend, messages, temperature, max_tokens, model))
+            attempts[task] = (backend, time.monotonic())
+            return backend
+
+        hedge_delay = self._router.hedge_delay(launch())
+        winner: Optional[OpenedStream] = None
+        last_error: Optional[BaseException] = None
+        try:
+            while winner is None:
+                done, _ = await asyncio.wait(
+                    attempts, timeout=hedge_delay if candidates else None, return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    # First token is late: race the next healthiest backend
+                    self._router.record_hedge(launch())
+                    hedge_delay = None
+                    continue
+                for task in done:
+                    backend, _ = attempts.pop(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        logger.warning(f"LLM backend {backend.name} failed before first token: {last_error}")
+                        self._router.record_failure(backend)
+                        # Fail over, also when a hedge fails while the primary is still pending
+                        if winner is None and candidates:
+                            launch()
+                    elif winner is None:
+                        winner = task.result()
+                    else:
+                        await task.result()[1].aclose()
+                        self._router.record_abandoned(backend)
+                if winner is None and not attempts:
+                    raise last_error
+        finally:
+            # Cancel the losers of a hedge (or everything, if we are cancelled ourselves)
+            for task in attempts:
+                task.cancel()
+            results = await asyncio.gather(*attempts, return_exceptions=True)
+            now = time.monotonic()
+            for (backend, started), result in zip(attempts.values(), results):
+                if isinstance(result, tuple):
+                    await result[1].aclose()
+                # A loser had no first token for at least this long; count that as a TTFT sample
+                # so a consistently slow backend stops being picked as primary
+                self._router.record_abandoned(backend, now - started)
+        return winner
 
     async def chat(
         self,
@@ -63,13 +317,51 @@ class LLMService:
         user_message: str,
         temperature: float = 0.7,
         max_tokens: int = 2048,
+        model: Optional[str] = None,
+        agent_id: Optional[int] = None,
+        call_site: str = "chat",
+        stats: Optional[GenerationStats] = None,
     ) -> str:
-        """Non-streaming chat, returns full response."""
-        chat_model = self._get_chat_model(temperature=temperature, max_tokens=max_tokens)
-        chat_model.streaming = False
+        """Non-streaming chat, returns full response. Fails over across backends in health order."""
+        stats = self._start_stats(stats, model, agent_id, call_site)
         messages = self.build_messages(system_prompt, history, user_message)
-        response = await chat_model.ainvoke(messages)
-        return response.content
+        candidates = self._router.candidates()
+        if not candidates:
+            stats.finish("error")
+            raise LLMUnavailableError("All LLM backends are unavailable")
+        last_error: Optional[Exception] = None
+        for backend in candidates:
+            chat_model = self._get_chat_model(
+                temperature=temperature, max_tokens=max_tokens, model=model, streaming=False, backend=backend,
+            )
+            self._router.begin(backend)
+            try:
+                response = await chat_model.ainvoke(messages)
+            except Exception as e:
+                last_error = e
+                logger.warning(f"LLM backend {backend.name} failed: {e}")
+                self._router.record_failure(backend)
+                continue
+            except BaseException:
+                self._router.record_abandoned(backend)
+                stats.finish("cancelled")
+                raise
+            self._router.record_success(backend)
+            stats.backend = backend.name
+            stats.model = self._backend_model(backend, model)
+            # Providers that report no usage get a local count
+            usage = getattr(response, "usage_metadata", None) or {}
+            output_tokens = usage.get("output_tokens")
+            if output_tokens is None:
+                output_tokens = count_tokens(response.content, stats.model)
+            stats.finish("ok", output_tokens=output_tokens)
+            return response.content
+        stats.finish("error")
+        raise last_error
+
+    def stats(self) -> Dict[str, Dict]:
+        """Health and circuit state per backend."""
+        return self._router.stats()
 
 
 llm_service = LLMService()
@@ -0,0 +1,223 @@
+"""
+Write-behind queue for chat persistence: batch message inserts and title updates
+"""
+import os
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional
+from sqlalchemy.exc import IntegrityError
+from app.repositories.conversation_repo import async_conversation_repository as conversation_repository
+from app.core.database import get_async_db_session
+
+logger = logging.getLogger(__name__)
+
+# How long queued writes may wait to be grouped with others
+CHAT_WRITE_FLUSH_INTERVAL_MS = int(os.getenv("CHAT_WRITE_FLUSH_INTERVAL_MS", "50"))
+# Rows per multi-row INSERT; larger queues flush in several transactions
+CHAT_WRITE_MAX_BATCH = int(os.getenv("CHAT_WRITE_MAX_BATCH", "500"))
+CHAT_WRITE_MAX_RETRIES = int(os.getenv("CHAT_WRITE_MAX_RETRIES", "3"))
+CHAT_WRITE_RETRY_BACKOFF = float(os.getenv("CHAT_WRITE_RETRY_BACKOFF", "0.2"))
+# Past this many queued messages (e.g. the DB has been down for a while), the oldest are dropped
+CHAT_WRITE_MAX_PENDING = int(os.getenv("CHAT_WRITE_MAX_PENDING", "50000"))
+
+
+class MessageWriter:
+    """
+    Per-worker write-behind queue.
+
+    Chat turns enqueue their writes and return immediately; a background task
+    flushes everything queued within one interval as a single transaction, so
+    concurrent turns share one commit. Failed batches are retried with backoff
+    and re-queued if the DB stays unavailable. Readers that need to see a
+    conversation's own writes (cache reloads, message listing, summarization)
+    call flush_conversation() first.
+    """
+
+    def __init__(self, flush_interval_ms: int = CHAT_WRITE_FLUSH_INTERVAL_MS, max_batch: int = CHAT_WRITE_MAX_BATCH):
+        self._flush_interval = flush_interval_ms / 1000
+        self._max_batch = max(max_batch, 1)
+        self._messages: List[Dict[str, Any]] = []
+        self._titles: Dict[int, str] = {}
+        # Conversations with writes queued or in a batch being written
+        self._in_flight: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.commits = 0
+        self.rows = 0
+        self.retries = 0
+        self.dropped = 0
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = None
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    def _track(self, conversation_id: int, delta: int) -> None:
+        count = self._in_flight.get(conversation_id, 0) + delta
+        if count > 0:
+            self._in_flight[conversation_id] = count
+        else:
+            self._in_flight.pop(conversation_id, None)
+
+    def add_message(
+        self,
+        conversation_id: int,
+        role: str,
+        content: str,
+        tokens_used: Optional[int] = None,
+        generation: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Queue a message insert. Must be called from the event loop.
+
+        generation holds the reply's stats columns (GenerationStats.as_columns()).
+        """
+        self._ensure_started()
+        generation = generation or {}
+        # Every row needs the same keys for the multi-row INSERT
+        self._messages.append({
+            "conversation_id": conversation_id,
+            "role": role,
+            "content": content,
+            "tokens_used": tokens_used,
+            "llm_model": generation.get("llm_model"),
+            "ttft_ms": generation.get("ttft_ms"),
+            "duration_ms": generation.get("duration_ms"),
+            "output_tokens": generation.get("output_tokens"),
+        })
+        self._track(conversation_id, 1)
+        if len(self._messages) > CHAT_WRITE_MAX_PENDING:
+            lost = self._messages.pop(0)
+            self._track(lost["conversation_id"], -1)
+            self.dropped += 1
+            logger.error(f"Write-behind queue full, dropped a message of conversation {lost['conversation_id']}")
+        self._wakeup.set()
+
+    def set_title(self, conversation_id: int, title: str) -> None:
+        """Queue a title update; a later update of the same conversation replaces it."""
+        self._ensure_started()
+        if conversation_id not in self._titles:
+            self._track(conversation_id, 1)
+        self._titles[conversation_id] = title
+        self._wakeup.set()
+
+    def has_pending(self, conversation_id: int) -> bool:
+        return conversation_id in self._in_flight
+
+    async def flush_conversation(self, conversation_id: int) -> None:
+        """Make a conversation's queued writes visible to readers (read-your-writes)."""
+        if self.has_pending(conversation_id):
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write everything queued so far, including a batch already being written."""
+        self._ensure_started()
+        async with self._flush_lock:
+            while self._messages or self._titles:
+                if not await self._write_next_batch():
+                    break
+
+    async def close(self) -> None:
+        """Stop the background task and flush what is left (application shutdown)."""
+        if self._loop is not asyncio.get_running_loop():
+            return
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        async with self._flush_lock:
+            while self._messages or self._titles:
+                if not await self._write_next_batch():
+                    lost = len(self._messages) + len(self._titles)
+                    self.dropped += lost
+                    logger.error(f"Write-behind queue could not be flushed on shutdown, {lost} writes lost")
+                    self._messages, self._titles = [], {}
+                    self._in_flight.clear()
+                    break
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Let concurrent turns join the batch
+            await asyncio.sleep(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                # A cancelled loop (shutdown) leaves the flush running; close() waits for it via the lock
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
+
+    async def _write_next_batch(self) -> bool:
+        """Write one batch, retrying with backoff. On failure re-queue it and return False."""
+        messages = self._messages[:self._max_batch]
+        del self._messages[:len(messages)]
+        titles, self._titles = self._titles, {}
+
+        delay = CHAT_WRITE_RETRY_BACKOFF
+        for attempt in range(CHAT_WRITE_MAX_RETRIES + 1):
+            try:
+                await self._write(messages, titles)
+                break
+            except IntegrityError as e:
+                # e.g. the agent (and with it the conversation) was deleted meanwhile;
+                # write row by row so one bad row does not sink the others
+                logger.warning(f"Write-behind batch rejected, retrying row by row: {e}")
+                await self._write_rows(messages, titles)
+                break
+            except Exception as e:
+                if attempt == CHAT_WRITE_MAX_RETRIES:
+                    logger.error(f"Write-behind batch of {len(messages)} messages failed, re-queued: {e}")
+                    self._messages[:0] = messages
+                    self._titles = {**titles, **self._titles}
+                    return False
+                self.retries += 1
+                logger.warning(f"Write-behind batch failed (attempt {attempt + 1}), retrying: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+
+        for msg in messages:
+            self._track(msg["conversation_id"], -1)
+        for cid in titles:
+            self._track(cid, -1)
+        return True
+
+    async def _write(self, messages: List[Dict[str, Any]], titles: Dict[int, str]) -> None:
+        db = get_async_db_session()
+        try:
+            await conversation_repository.write_batch(db, messages, titles)
+            self.commits += 1
+            self.rows += len(messages) + len(titles)
+        finally:
+            await db.close()
+
+    async def _write_rows(self, messages: List[Dict[str, Any]], titles: Dict[int, str]) -> None:
+        for cid, title in titles.items():
+            await self._write_one([], {cid: title})
+        for msg in messages:
+            await self._write_one([msg], {})
+
+    async def _write_one(self, messages: List[Dict[str, Any]], titles: Dict[int, str]) -> None:
+        try:
+            await self._write(messages, titles)
+        except Exception as e:
+            self.dropped += len(messages) + len(titles)
+            logger.error(f"Dropped a queued chat write: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._messages) + len(self._titles),
+            "commits": self.commits,
+            "rows": self.rows,
+            "retries": self.retries,
+            "dropped": self.dropped,
+        }
+
+
+message_writer = MessageWriter()
@@ -0,0 +1,118 @@
+"""
+Per-worker exact-match cache of LLM responses for agents that opt in
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Iterator
+
+# How many of the newest history messages take part in the key
+CHAT_RESPONSE_CACHE_HISTORY_TAIL = int(os.getenv("CHAT_RESPONSE_CACHE_HISTORY_TAIL", "4"))
+CHAT_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+CHAT_RESPONSE_CACHE_MAX_BYTES = int(os.getenv("CHAT_RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Characters per chunk when replaying a cached response as a token stream
+CHAT_RESPONSE_CACHE_CHUNK_CHARS = int(os.getenv("CHAT_RESPONSE_CACHE_CHUNK_CHARS", "24"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    """Whitespace-insensitive form of a message, so trivially different inputs share an entry."""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def make_response_key(
+    system_prompt: str,
+    summary: Optional[str],
+    history: List[Dict[str, str]],
+    user_message: str,
+    model: str,
+    temperature: float,
+) -> str:
+    """Hash of everything that determines the response; only the newest history messages count."""
+    tail = history[-CHAT_RESPONSE_CACHE_HISTORY_TAIL:] if CHAT_RESPONSE_CACHE_HISTORY_TAIL > 0 else []
+    payload = json.dumps(
+        [
+            system_prompt,
+            _normalize(summary) if summary else None,
+            [[m["role"], _normalize(m["content"])] for m in tail],
+            _normalize(user_message),
+            model,
+            temperature,
+        ],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def iter_chunks(text: str, size: int = CHAT_RESPONSE_CACHE_CHUNK_CHARS) -> Iterator[str]:
+    """Split a cached response into token-sized pieces for streaming."""
+    size = max(size, 1)
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+@dataclass
+class _Entry:
+    agent_id: int
+    response: str
+    size: int
+    expires_at: float
+
+
+class ResponseCache:
+    """LRU cache keyed by response key, bounded by entry count and total response bytes, with per-entry TTL."""
+
+    def __init__(self, max_entries: int = CHAT_RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = CHAT_RESPONSE_CACHE_MAX_BYTES):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.response
+
+    def put(self, key: str, agent_id: int, response: str, ttl: float) -> None:
+        size = len(response.encode("utf-8"))
+        if ttl <= 0 or self._max_entries <= 0 or size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(agent_id, response, size, time.monotonic() + ttl)
+            self._bytes += size
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def invalidate_agent(self, agent_id: int) -> None:
+        """Drop every response of an agent (after the agent is updated or deleted)."""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e.agent_id == agent_id]:
+                self._remove(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+response_cache = ResponseCache()
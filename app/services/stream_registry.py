@@ -0,0 +1,264 @@
+"""
+Replay buffers for streamed chat turns, so a dropped SSE client can reattach with Last-Event-ID
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from app.core.sse import SSE_MAX_BUFFER_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Finished turns stay replayable this long
+CHAT_STREAM_REPLAY_TTL = float(os.getenv("CHAT_STREAM_REPLAY_TTL", "300"))
+# Total buffered event bytes per worker, running turns included; the oldest finished turns are
+# evicted first, and while running turns alone exceed it their generation keeps pace with the client
+CHAT_STREAM_REPLAY_MAX_BYTES = int(os.getenv("CHAT_STREAM_REPLAY_MAX_BYTES", str(64 * 1024 * 1024)))
+# A generation nobody has been listening to for this long is cancelled
+CHAT_STREAM_ORPHAN_TIMEOUT = float(os.getenv("CHAT_STREAM_ORPHAN_TIMEOUT", "60"))
+# How long a cancel request waits for the generation to actually stop
+CHAT_CANCEL_WAIT_TIMEOUT = float(os.getenv("CHAT_CANCEL_WAIT_TIMEOUT", "5"))
+
+# (sequence number, event name, JSON data)
+StreamEvent = Tuple[int, str, str]
+
+
+class TurnStream:
+    """
+    Events of one chat turn, numbered from 1, plus the task producing them.
+
+    The producer waits in wait_for_reader() while more than max_lag_bytes
+    have not been read by any client (attached or not), so a slow client
+    still holds back the LLM stream and gets larger coalesced frames, and a
+    running turn buffers at most its answer plus max_lag_bytes.
+    """
+
+    def __init__(
+        self, stream_id: str, conversation_id: int, user_id: int,
+        registry: Optional["StreamRegistry"] = None, max_lag_bytes: int = SSE_MAX_BUFFER_BYTES,
+    ):
+        self.stream_id = stream_id
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.events: List[StreamEvent] = []
+        self.size = 0
+        # Buffered bytes after each event, and the furthest event any client has read
+        self._ends: List[int] = []
+        self.read_seq = 0
+        self._registry = registry
+        self._max_lag_bytes = max_lag_bytes
+        self._read = asyncio.Event()
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # Set by an explicit cancel request, to measure how long stopping takes
+        self.cancel_requested_at: Optional[float] = None
+        self._changed = asyncio.Event()
+        self._orphan_timer: Optional[asyncio.TimerHandle] = None
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.stream_id}:{seq}"
+
+    def publish(self, event: str, data: dict) -> None:
+        payload = json.dumps(data, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        self.events.append((len(self.events) + 1, event, payload))
+        self.size += size
+        self._ends.append(self.size)
+        if self._registry is not None:
+            self._registry.bytes += size
+        self._wake()
+
+    @property
+    def unread_bytes(self) -> int:
+        return self.size - (self._ends[self.read_seq - 1] if self.read_seq else 0)
+
+    async def wait_for_reader(self) -> None:
+        """
+        Backpressure for the producer: return once a client has caught up to
+        within max_lag_bytes, or has read everything while the registry is over
+        its memory bound. With no client attached this waits for a reattach or
+        the orphan timeout, which cancels the turn.
+        """
+        while self.unread_bytes > self._max_lag_bytes or (
+            self.unread_bytes and self._registry is not None and self._registry.over_budget()
+        ):
+            self._read.clear()
+            await self._read.wait()
+
+    def _mark_read(self, seq: int) -> None:
+        if seq > self.read_seq:
+            self.read_seq = seq
+            self._read.set()
+
+    def _wake(self) -> None:
+        # Swap in a fresh event so every current waiter wakes exactly once
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def events_after(self, seq: int) -> AsyncIterator[StreamEvent]:
+        """Buffered events after seq, then live ones until the turn is done."""
+        while True:
+            while seq < len(self.events):
+                yield self.events[seq]
+                # Resumed only once the client has taken the event
+                seq += 1
+                self._mark_read(seq)
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+class StreamRegistry:
+    """Per-worker registry of running and recently finished turn streams."""
+
+    def __init__(
+        self,
+        ttl: float = CHAT_STREAM_REPLAY_TTL,
+        max_bytes: int = CHAT_STREAM_REPLAY_MAX_BYTES,
+        orphan_timeout: float = CHAT_STREAM_ORPHAN_TIMEOUT,
+    ):
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._orphan_timeout = orphan_timeout
+        # Insertion order is start order, so the front holds the oldest streams
+        self._streams: "OrderedDict[str, TurnStream]" = OrderedDict()
+        self._running: Dict[int, Set[str]] = {}
+        # Buffered event bytes of all streams, running ones included
+        self.bytes = 0
+        self.evicted = 0
+        self.orphaned = 0
+        self.cancelled = 0
+        self.cancel_latency_sum = 0.0
+        self.cancel_latency_max = 0.0
+
+    def create(self, conversation_id: int, user_id: int) -> TurnStream:
+        self._evict()
+        stream = TurnStream(uuid.uuid4().hex, conversation_id, user_id, registry=self)
+        self._streams[stream.stream_id] = stream
+        self._running.setdefault(conversation_id, set()).add(stream.stream_id)
+        # Covers a client that is gone before it ever subscribes
+        self._schedule_orphan_check(stream)
+        return stream
+
+    def get(self, stream_id: str) -> Optional[TurnStream]:
+        stream = self._streams.get(stream_id)
+        if stream is not None and stream.done and stream.finished_at + self._ttl < time.monotonic():
+            self._remove(stream)
+            return None
+        return stream
+
+    def running(self, conversation_id: int) -> List[TurnStream]:
+        return [self._streams[sid] for sid in self._running.get(conversation_id, ()) if sid in self._streams]
+
+    def finish(self, stream: TurnStream) -> None:
+        stream.done = True
+        stream.finished_at = time.monotonic()
+        if stream.cancel_requested_at is not None:
+            latency = stream.finished_at - stream.cancel_requested_at
+            self.cancelled += 1
+            self.cancel_latency_sum += latency
+            self.cancel_latency_max = max(self.cancel_latency_max, latency)
+            logger.info(f"Generation of conversation {stream.conversation_id} stopped {latency * 1000:.1f}ms after cancel")
+        self._cancel_orphan_check(stream)
+        running = self._running.get(stream.conversation_id)
+        if running is not None:
+            running.discard(stream.stream_id)
+            if not running:
+                del self._running[stream.conversation_id]
+        stream._wake()
+        self._evict()
+
+    def attach(self, stream: TurnStream) -> None:
+        stream.subscribers += 1
+        self._cancel_orphan_check(stream)
+
+    def detach(self, stream: TurnStream) -> None:
+        stream.subscribers -= 1
+        if stream.subscribers == 0 and not stream.done:
+            self._schedule_orphan_check(stream)
+
+    def _schedule_orphan_check(self, stream: TurnStream) -> None:
+        self._cancel_orphan_check(stream)
+        stream._orphan_timer = asyncio.get_running_loop().call_later(
+            self._orphan_timeout, self._cancel_orphan, stream,
+        )
+
+    def _cancel_orphan_check(self, stream: TurnStream) -> None:
+        if stream._orphan_timer is not None:
+            stream._orphan_timer.cancel()
+            stream._orphan_timer = None
+
+    def _cancel_orphan(self, stream: TurnStream) -> None:
+        stream._orphan_timer = None
+        if stream.subscribers == 0 and not stream.done and stream.task is not None:
+            self.orphaned += 1
+            logger.info(f"No client reattached to stream of conversation {stream.conversation_id}, cancelling")
+            stream.task.cancel()
+
+    async def cancel(self, streams: List[TurnStream]) -> None:
+        """Cancel running generations and wait (bounded) until they have stopped and saved their partial answers."""
+        tasks = []
+        for stream in streams:
+            if stream.done or stream.task is None:
+                continue
+            if stream.cancel_requested_at is None:
+                stream.cancel_requested_at = time.monotonic()
+            stream.task.cancel()
+            tasks.append(stream.task)
+        if tasks:
+            await asyncio.wait(tasks, timeout=CHAT_CANCEL_WAIT_TIMEOUT)
+
+    def over_budget(self) -> bool:
+        """Over the memory bound even after evicting finished streams."""
+        if self.bytes > self._max_bytes:
+            self._evict()
+        return self.bytes > self._max_bytes
+
+    def _remove(self, stream: TurnStream) -> None:
+        if self._streams.pop(stream.stream_id, None) is not None:
+            self.bytes -= stream.size
+            self.evicted += 1
+
+    def _evict(self) -> None:
+        """
+        Drop finished streams past their TTL, then the oldest finished ones while
+        over the memory bound. Running streams count toward the bound but are
+        never dropped; their producers wait for the client instead.
+        """
+        now = time.monotonic()
+        finished = [s for s in self._streams.values() if s.done]
+        for stream in finished:
+            if stream.finished_at + self._ttl < now:
+                self._remove(stream)
+        for stream in finished:
+            if self.bytes <= self._max_bytes:
+                break
+            self._remove(stream)
+
+    async def aclose(self) -> None:
+        """Cancel running generations (application shutdown) so their partial answers get saved."""
+        tasks = [s.task for s in self._streams.values() if not s.done and s.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "streams": len(self._streams),
+            "running": sum(len(ids) for ids in self._running.values()),
+            "bytes": self.bytes,
+            "evicted": self.evicted,
+            "orphaned": self.orphaned,
+            "cancelled": self.cancelled,
+            "cancel_latency_ms_avg": self.cancel_latency_sum / self.cancelled * 1000 if self.cancelled else 0.0,
+            "cancel_latency_ms_max": self.cancel_latency_max * 1000,
+        }
+
+
+stream_registry = StreamRegistry()
@@ -0,0 +1,161 @@
+"""
+Rolling conversation summaries: fold older turns into a per-conversation checkpoint
+"""
+import os
+import logging
+from typing import Set
+from app.repositories.conversation_repo import async_conversation_repository as conversation_repository
+from app.services.llm_service import llm_service
+from app.services.history_builder import count_message_tokens
+from app.services.context_cache import context_cache
+from app.services.message_writer import message_writer
+from app.core.database import get_async_db_session
+
+logger = logging.getLogger(__name__)
+
+# Summarize once unsummarized history grows past this many tokens
+CHAT_SUMMARY_TRIGGER_TOKENS = int(os.getenv("CHAT_SUMMARY_TRIGGER_TOKENS", "3000"))
+# Newest tokens kept verbatim (not folded) when summarizing
+CHAT_SUMMARY_KEEP_RECENT_TOKENS = int(os.getenv("CHAT_SUMMARY_KEEP_RECENT_TOKENS", "1000"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "512"))
+# Messages folded per LLM call (a backlog takes several passes), keeps the summarization prompt bounded
+CHAT_SUMMARY_BATCH_MESSAGES = int(os.getenv("CHAT_SUMMARY_BATCH_MESSAGES", "200"))
+
+SUMMARY_SYSTEM_PROMPT = "You maintain a running summary of a conversation between a user and an AI assistant."
+
+SUMMARY_PROMPT = """Update the running summary with the new conversation turns below.
+Keep facts, names, user preferences, decisions and open questions. Drop small talk.
+Write plain prose, at most {max_words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{transcript}"""
+
+
+class SummaryService:
+
+    def __init__(self):
+        # Conversations with a summarization in flight on this worker
+        self._in_flight: Set[int] = set()
+
+    def needs_summary(self, unsummarized_tokens: int) -> bool:
+        return CHAT_SUMMARY_TRIGGER_TOKENS > 0 and unsummarized_tokens >= CHAT_SUMMARY_TRIGGER_TOKENS
+
+    async def summarize_conversation(self, conversation_id: int, model: str) -> None:
+        """
+        Fold messages older than the kept recent window into the conversation summary.
+
+        Runs as a background task after the response is delivered. DB access is
+        split into short sessions around the LLM call, like a chat turn.
+        """
+        if conversation_id in self._in_flight:
+            return
+        self._in_flight.add(conversation_id)
+        try:
+            await self._summarize(conversation_id, model)
+        except Exception as e:
+            logger.error(f"Failed to summarize conversation {conversation_id}: {e}")
+        finally:
+            self._in_flight.discard(conversation_id)
+
+    async def _summarize(self, conversation_id: int, model: str) -> None:
+        await message_writer.flush_conversation(conversation_id)
+        db = get_async_db_session()
+        try:
+            conv = await conversation_repository.get_conversation_by_id(db, conversation_id)
+            if not conv:
+                return
+            checkpoint = conv.summary_until_message_id
+            summary = conv.summary
+            # Newest first, so the kept window is the prefix of this list
+            recent = await conversation_repository.get_recent_messages(
+                db, conversation_id, CHAT_SUMMARY_BATCH_MESSAGES, after_id=checkpoint,
+            )
+        finally:
+            await db.close()
+
+        keep_from = self._kept_window_start(recent, model)
+        if keep_from is None:
+            return
+
+        # Oldest first, in passes of at most CHAT_SUMMARY_BATCH_MESSAGES, until
+        # everything before the kept window is folded
+        folded = False
+        while True:
+            db = get_async_db_session()
+            try:
+                msgs = await conversation_repository.get_messages_between(
+                    db, conversation_id, checkpoint, keep_from, CHAT_SUMMARY_BATCH_MESSAGES,
+                )
+            finally:
+                await db.close()
+            if not msgs:
+                break
+            to_fold = [m for m in msgs if m.role in ("user", "assistant")]
+            if to_fold:
+                summary = await self._fold(summary, to_fold, model)
+
+            db = get_async_db_session()
+            try:
+                updated = await conversation_repository.update_conversation_summary(
+                    db, conversation_id, summary, msgs[-1].id, expected_until_id=checkpoint,
+                )
+            finally:
+                await db.close()
+            if not updated:
+                logger.info(f"Summary checkpoint for conversation {conversation_id} moved concurrently, skipped")
+                break
+            checkpoint = msgs[-1].id
+            folded = True
+
+        if folded:
+            # Cached messages queued after the summary read have no ids yet, so the
+            # cut cannot be made in the cache; the next turn reloads from the DB
+            context_cache.invalidate(conversation_id)
+
+    @staticmethod
+    def _kept_window_start(recent: list, model: str):
+        """
+        Id from which messages stay verbatim (newest CHAT_SUMMARY_KEEP_RECENT_TOKENS),
+        given the newest messages first; None if there is nothing older to fold.
+        """
+        if not recent:
+            return None
+        kept = 0
+        split = 0
+        for i, msg in enumerate(recent):
+            tokens = msg.tokens_used if msg.tokens_used is not None else count_message_tokens(msg.content, model)
+            if kept + tokens > CHAT_SUMMARY_KEEP_RECENT_TOKENS:
+                break
+            kept += tokens
+            split = i + 1
+        if split == 0:
+            # The newest message alone is over the budget: fold everything
+            return recent[0].id + 1
+        if split == len(recent) and len(recent) < CHAT_SUMMARY_BATCH_MESSAGES:
+            return None
+        # With a full batch of small messages, the window is capped at the batch
+        return recent[split - 1].id
+
+    async def _fold(self, summary, to_fold: list, model: str) -> str:
+        """One LLM call merging to_fold (oldest first) into the summary."""
+        transcript = "\n".join(f"{m.role}: {m.content}" for m in to_fold)
+        new_summary = await llm_service.chat(
+            system_prompt=SUMMARY_SYSTEM_PROMPT,
+            history=[],
+            user_message=SUMMARY_PROMPT.format(
+                max_words=CHAT_SUMMARY_MAX_TOKENS // 2,
+                summary=summary or "(none)",
+                transcript=transcript,
+            ),
+            temperature=0.2,
+            max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+            model=model,
+            call_site="summary",
+        )
+        return new_summary.strip()
+
+
+summary_service = SummaryService()
@@ -0,0 +1,172 @@
+"""
+Streaming, token-budgeted text chunker for knowledge extraction
+"""
+import os
+import re
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+# Hard maximum tokens per chunk, overlap included
+KNOWLEDGE_CHUNK_TOKENS = int(os.getenv("KNOWLEDGE_CHUNK_TOKENS", "400"))
+# Trailing sentences of a chunk repeated at the start of the next, up to this many tokens (0 = none)
+KNOWLEDGE_CHUNK_OVERLAP_TOKENS = int(os.getenv("KNOWLEDGE_CHUNK_OVERLAP_TOKENS", "0"))
+# A paragraph still open after this many characters is cut at a line or sentence end, bounding memory
+PARAGRAPH_BUFFER_CHARS = 64 * 1024
+
+_PARAGRAPH_BREAK = "\n\n"
+# Sentence ends: Latin punctuation followed by whitespace, CJK punctuation anywhere (closing quotes stay attached)
+_SENTENCE_END = re.compile(r"[.!?;…]+[\"')\]’”]*\s+|[。！？；]+[”’）」』]*\s*")
+_LINE_END = re.compile(r"\n")
+_WHITESPACE = re.compile(r"\s")
+
+# (separator before the unit, unit text, tokens of the text)
+Unit = Tuple[str, str, int]
+
+
+def _split_after(pattern: re.Pattern, text: str) -> List[str]:
+    """Cut text after every match of pattern; the pieces concatenate back to text."""
+    pieces, start = [], 0
+    for match in pattern.finditer(text):
+        if match.end() > start:
+            pieces.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+
+class TextChunker:
+    """
+    Splits text arriving in pieces into chunks of at most max_tokens tokens.
+
+    Paragraphs (blank-line separated) are packed greedily. A paragraph too
+    large for one chunk is split at sentence ends, then line ends, and as a
+    last resort at a token-sized slice (preferring whitespace), so no text is
+    dropped and no chunk exceeds the limit. Memory is bounded by the chunk
+    size and PARAGRAPH_BUFFER_CHARS, not by the input size.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        max_tokens: int = KNOWLEDGE_CHUNK_TOKENS,
+        overlap_tokens: int = KNOWLEDGE_CHUNK_OVERLAP_TOKENS,
+        buffer_chars: int = PARAGRAPH_BUFFER_CHARS,
+    ):
+        self._count = count_tokens
+        self.max_tokens = max(max_tokens, 1)
+        # Overlap never takes more than half a chunk
+        self.overlap_tokens = min(max(overlap_tokens, 0), self.max_tokens // 2)
+        self._buffer_chars = max(buffer_chars, 1)
+        self._separator_tokens = count_tokens(_PARAGRAPH_BREAK)
+
+    def chunks(self, pieces: Iterable[str]) -> Iterator[str]:
+        current: List[Unit] = []
+        total = 0
+        for starts_paragraph, paragraph in self._paragraphs(pieces):
+            separator = _PARAGRAPH_BREAK if starts_paragraph else ""
+            for index, (text, tokens) in enumerate(self._units(paragraph)):
+                lead = separator if index == 0 else ""
+                cost = tokens + (self._separator_tokens if current and lead else 0)
+                if current and total + cost > self.max_tokens:
+                    yield self._join(current)
+                    current = self._overlap(current)
+                    total = sum(u[2] for u in current) + self._separator_tokens * sum(1 for u in current[1:] if u[0])
+                    cost = tokens + (self._separator_tokens if current and lead else 0)
+                    if total + cost > self.max_tokens:
+                        current, total, cost = [], 0, tokens
+                current.append((lead if current else "", text, tokens))
+                total += cost
+        if current:
+            yield self._join(current)
+
+    def _paragraphs(self, pieces: Iterable[str]) -> Iterator[Tuple[bool, str]]:
+        """(starts a paragraph, text) for every non-empty paragraph, or part of an over-long one."""
+        buffer = ""
+        starts = True
+        for piece in pieces:
+            buffer += piece
+            # Everything before the last separator is complete; the rest may continue in the next piece
+            *complete, buffer = buffer.split(_PARAGRAPH_BREAK)
+            for paragraph in complete:
+                paragraph = paragraph.strip() if starts else paragraph.rstrip()
+                if paragraph:
+                    yield starts, paragraph
+                starts = True
+            while len(buffer) > self._buffer_chars:
+                cut = self._soft_cut(buffer, self._buffer_chars)
+                head = buffer[:cut].lstrip() if starts else buffer[:cut]
+                buffer = buffer[cut:]
+                if head:
+                    yield starts, head
+                    starts = False
+        buffer = buffer.strip() if starts else buffer.rstrip()
+        if buffer:
+            yield starts, buffer
+
+    @staticmethod
+    def _soft_cut(text: str, limit: int) -> int:
+        """Position at most limit to cut text at: after the last line end, else sentence end, else at limit."""
+        head = text[:limit]
+        newline = head.rfind("\n")
+        if newline > 0:
+            return newline + 1
+        ends = [m.end() for m in _SENTENCE_END.finditer(head)]
+        if ends:
+            return ends[-1]
+        return limit
+
+    def _units(self, text: str) -> Iterator[Tuple[str, int]]:
+        """(text, tokens) pieces of a paragraph, each within max_tokens, concatenating back to the paragraph."""
+        tokens = self._count(text)
+        if tokens <= self.max_tokens:
+            yield text, tokens
+            return
+        for pattern in (_SENTENCE_END, _LINE_END):
+            pieces = _split_after(pattern, text)
+            if len(pieces) > 1:
+                for piece in pieces:
+                    yield from self._units(piece)
+                return
+        yield from self._hard_split(text)
+
+    def _hard_split(self, text: str) -> Iterator[Tuple[str, int]]:
+        """Slices of at most max_tokens tokens, cut at whitespace where there is any in the second half."""
+        while text:
+            n = min(len(text), self.max_tokens * 4)
+            tokens = self._count(text[:n])
+            while tokens > self.max_tokens and n > 1:
+                n = max(1, min(n - 1, int(n * self.max_tokens / tokens)))
+                tokens = self._count(text[:n])
+            if n < len(text):
+                space = max((m.end() for m in _WHITESPACE.finditer(text, n // 2, n)), default=0)
+                if space:
+                    n = space
+                    tokens = self._count(text[:n])
+            yield text[:n], tokens
+            text = text[n:]
+
+    def _overlap(self, units: List[Unit]) -> List[Unit]:
+        """Trailing sentences of a finished chunk, within overlap_tokens, to start the next chunk with."""
+        if not self.overlap_tokens:
+            return []
+        tail: List[Unit] = []
+        total = 0
+        for lead, text, tokens in reversed(units):
+            if total + tokens <= self.overlap_tokens:
+                tail.insert(0, (lead, text, tokens))
+                total += tokens
+                continue
+            for sentence in reversed(_split_after(_SENTENCE_END, text)):
+                sentence_tokens = self._count(sentence)
+                if total + sentence_tokens > self.overlap_tokens:
+                    break
+                tail.insert(0, ("", sentence, sentence_tokens))
+                total += sentence_tokens
+            break
+        if tail:
+            tail[0] = ("", tail[0][1].lstrip(), tail[0][2])
+        return tail
+
+    @staticmethod
+    def _join(units: List[Unit]) -> str:
+        return "".join(lead + text for lead, text, _ in units).strip()
@@ -14,25 +14,26 @@ Copyright (c) 2026 by yuheng li, All Rights Reserved.
 """
 from typing import List, Optional
 from app.schemas.user import UserCreate, UserUpdate, UserResponse
-from app.user_repo import user as user_repo
+from starlette.concurrency import run_in_threadpool
+from app.user_repo import async_user as user_repo
 from app.core.security import get_password_hash, verify_password
-from app.core.database import get_db_session
+from app.core.database import get_async_db_session
 
 
 class UserService:
     """用户业务逻辑服务类"""
     
     @staticmethod
-    def get_all_users() -> List[UserResponse]:
+    async def get_all_users() -> List[UserResponse]:
         """
         获取所有用户
 
         Returns:
             用户响应列表
         """
-        db = get_db_session()
+        db = get_async_db_session()
         try:
-            users = user_repo.get_all_users(db)
+            users = await user_repo.get_all_users(db)
             return [
                 UserResponse(
                     id=u.id,
@@ -45,10 +46,10 @@ class UserService:
                 ) for u in users
             ]
         finally:
-            db.close()
+            await db.close()
     
     @staticmethod
-    def get_user_by_id(user_id: int) -> Optional[UserResponse]:
+    async def get_user_by_id(user_id: int) -> Optional[UserResponse]:
         """
         根据ID获取用户
 
@@ -58,9 +59,9 @@ class UserService:
         Returns:
             用户响应对象，如果不存在返回None
         """
-        db = get_db_session()
+        db = get_async_db_session()
         try:
-            user = user_repo.get_user_by_id(db, user_id)
+            user = await user_repo.get_user_by_id(db, user_id)
             if not user:
                 return None
             return UserResponse(
@@ -73,10 +74,10 @@ class UserService:
                 updated_at=""
             )
         finally:
-            db.close()
+            await db.close()
     
     @staticmethod
-    def create_user(user_create: UserCreate) -> UserResponse:
+    async def create_user(user_create: UserCreate) -> UserResponse:
         """
         创建新用户（包含业务逻辑：检查重复、密码加密）
 
@@ -89,24 +90,24 @@ class UserService:
         Raises:
             ValueError: 用户名或邮箱已存在
         """
-        db = get_db_session()
+        db = get_async_db_session()
         try:
             # 业务逻辑：检查用户名是否已存在
-            existing_user = user_repo.get_user_by_username(db, user_create.username)
+            existing_user = await user_repo.get_user_by_username(db, user_create.username)
             if existing_user:
                 raise ValueError(f"用户名 '{user_create.username}' 已存在")
 
             # 业务逻辑：检查邮箱是否已存在
-            existing_email = user_repo.get_user_by_email(db, user_create.email)
+            existing_email = await user_repo.get_user_by_email(db, user_create.email)
             if existing_email:
                 raise ValueError(f"邮箱 '{user_create.email}' 已被注册")
 
             # 业务逻辑：密码加密
-            hashed_password = get_password_hash(user_create.password)
+            hashed_password = await run_in_threadpool(get_password_hash, user_create.password)
             user_create.password = hashed_password
 
             # 调用Repository层创建用户
-            created_user = user_repo.create_user(db, user_create)
+            created_user = await user_repo.create_user(db, user_create)
             return UserResponse(
                 id=created_user.id,
                 username=created_user.username,
@@ -117,10 +118,10 @@ class UserService:
                 updated_at=""
             )
         finally:
-            db.close()
+            await db.close()
     
     @staticmethod
-    def update_user(user_id: int, user_update: UserUpdate) -> Optional[UserResponse]:
+    async def update_user(user_id: int, user_update: UserUpdate) -> Optional[UserResponse]:
         """
         更新用户（包含业务逻辑：密码加密、重复检查）
 
@@ -134,31 +135,31 @@ class UserService:
         Raises:
             ValueError: 用户名或邮箱已被其他用户使用
         """
-        db = get_db_session()
+        db = get_async_db_session()
         try:
             # 检查用户是否存在
-            existing_user = user_repo.get_user_by_id(db, user_id)
+            existing_user = await user_repo.get_user_by_id(db, user_id)
             if not existing_user:
                 return None
 
             # 业务逻辑：如果更新用户名，检查是否重复
             if user_update.username and user_update.username != existing_user.username:
-                duplicate_username = user_repo.get_user_by_username(db, user_update.username)
+                duplicate_username = await user_repo.get_user_by_username(db, user_update.username)
                 if duplicate_username:
                     raise ValueError(f"用户名 '{user_update.username}' 已被使用")
 
             # 业务逻辑：如果更新邮箱，检查是否重复
             if user_update.email and user_update.email != existing_user.email:
-                duplicate_email = user_repo.get_user_by_email(db, user_update.email)
+                duplicate_email = await user_repo.get_user_by_email(db, user_update.email)
                 if duplicate_email:
                     raise ValueError(f"邮箱 '{user_update.email}' 已被使用")
 
             # 业务逻辑：如果更新密码，需要加密
             if user_update.password:
-                user_update.password = get_password_hash(user_update.password)
+                user_update.password = await run_in_threadpool(get_password_hash, user_update.password)
 
             # 调用Repository层更新用户
-            updated_user = user_repo.update_user(db, user_id, user_update)
+            updated_user = await user_repo.update_user(db, user_id, user_update)
             if not updated_user:
                 return None
 
@@ -172,10 +173,10 @@ class UserService:
                 updated_at=""
             )
         finally:
-            db.close()
+            await db.close()
     
     @staticmethod
-    def delete_user(user_id: int) -> bool:
+    async def delete_user(user_id: int) -> bool:
         """
         删除用户
 
@@ -185,14 +186,14 @@ class UserService:
         Returns:
             是否删除成功
         """
-        db = get_db_session()
+        db = get_async_db_session()
         try:
-            return user_repo.delete_user(db, user_id)
+            return await user_repo.delete_user(db, user_id)
         finally:
-            db.close()
+            await db.close()
     
     @staticmethod
-    def register_user(user_create: UserCreate) -> UserResponse:
+    async def register_user(user_create: UserCreate) -> UserResponse:
         """
         注册新用户（包含完整的业务逻辑）
 
@@ -208,10 +209,10 @@ class UserService:
         Raises:
             ValueError: 用户名或邮箱已存在
         """
-        return UserService.create_user(user_create)
+        return await UserService.create_user(user_create)
     
     @staticmethod
-    def authenticate_user(username: str, password: str) -> Optional[UserResponse]:
+    async def authenticate_user(username: str, password: str) -> Optional[UserResponse]:
         """
         用户认证（业务逻辑：验证密码）
 
@@ -222,14 +223,14 @@ class UserService:
         Returns:
             认证成功返回用户响应对象，失败返回None
         """
-        db = get_db_session()
+        db = get_async_db_session()
         try:
-            user = user_repo.get_user_by_username(db, username)
+            user = await user_repo.get_user_by_username(db, username)
             if not user:
                 return None
 
             # 业务逻辑：验证密码
-            if not verify_password(password, user.password):
+            if not await run_in_threadpool(verify_password, password, user.password):
                 return None
 
             return UserResponse(
@@ -242,7 +243,7 @@ class UserService:
                 updated_at=""
             )
         finally:
-            db.close()
+            await db.close()
 
 
 # 创建单例实例供导入使用
@@ -0,0 +1,74 @@
+"""
+用户 CRUD 操作（AsyncSession 版本）
+
+与 app/user_repo/user.py 一一对应，供请求处理使用；
+同步版本保留给 Alembic 和 init_sample_users.py 等脚本。
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.user import User
+from app.schemas.user import UserCreate, UserUpdate
+from typing import Optional, List
+
+
+async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[User]:
+    """根据 ID 获取用户"""
+    return await db.get(User, user_id)
+
+
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
+    """根据用户名获取用户"""
+    result = await db.execute(select(User).filter(User.username == username))
+    return result.scalars().first()
+
+
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
+    """根据邮箱获取用户"""
+    result = await db.execute(select(User).filter(User.email == email))
+    return result.scalars().first()
+
+
+async def get_all_users(db: AsyncSession, skip: int = 0, limit: int = 100) -> List[User]:
+    """获取所有用户"""
+    result = await db.execute(select(User).offset(skip).limit(limit))
+    return list(result.scalars().all())
+
+
+async def create_user(db: AsyncSession, user: UserCreate) -> User:
+    """创建用户"""
+    db_user = User(
+        username=user.username,
+        email=user.email,
+        password=user.password,  # 应该是已经加密的密码
+        full_name=user.full_name
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+
+async def update_user(db: AsyncSession, user_id: int, user_update: UserUpdate) -> Optional[User]:
+    """更新用户"""
+    db_user = await get_user_by_id(db, user_id)
+    if not db_user:
+        return None
+
+    update_data = user_update.dict(exclude_unset=True)
+    for field, value in update_data.items():
+        setattr(db_user, field, value)
+
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+
+async def delete_user(db: AsyncSession, user_id: int) -> bool:
+    """删除用户"""
+    db_user = await get_user_by_id(db, user_id)
+    if not db_user:
+        return False
+
+    await db.delete(db_user)
+    await db.commit()
+    return True
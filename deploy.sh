@@ -100,6 +100,9 @@ echo -e "${YELLOW}Enter database password for user '$DB_USER':${NC}"
 read -s DB_PASSWORD
 echo ""
 
+# Bearer token for /metrics; reuse an exported one so the Prometheus scrape config keeps working
+METRICS_TOKEN="${METRICS_TOKEN:-$(openssl rand -hex 24)}"
+
 # Deploy to Cloud Run
 echo -e "${YELLOW}Deploying to Cloud Run...${NC}"
 gcloud run deploy "$SERVICE_NAME" \
@@ -110,7 +113,12 @@ gcloud run deploy "$SERVICE_NAME" \
     --allow-unauthenticated \
     --add-cloudsql-instances="$INSTANCE_CONNECTION_NAME" \
     --set-env-vars="DATABASE_URL=mysql+pymysql://${DB_USER}:${DB_PASSWORD}@/cloudsql/${INSTANCE_CONNECTION_NAME}/${DB_NAME}" \
+    --set-env-vars="CLOUDSQL_CONNECTION_NAME=${INSTANCE_CONNECTION_NAME}" \
+    --set-env-vars="DB_USER=${DB_USER}" \
+    --set-env-vars="DB_PASSWORD=${DB_PASSWORD}" \
+    --set-env-vars="DB_NAME=${DB_NAME}" \
     --set-env-vars="SECRET_KEY=$(openssl rand -base64 32)" \
+    --set-env-vars="METRICS_TOKEN=${METRICS_TOKEN}" \
     --set-env-vars="ALLOWED_ORIGINS=https://your-frontend-domain.com" \
     --memory=512Mi \
     --cpu=1 \
@@ -134,5 +142,9 @@ echo ""
 echo "To test your deployment:"
 echo "  curl $SERVICE_URL"
 echo ""
+echo "Metrics (Prometheus, requires the bearer token):"
+echo "  curl -H \"Authorization: Bearer \$METRICS_TOKEN\" $SERVICE_URL/metrics"
+echo "  METRICS_TOKEN=$METRICS_TOKEN"
+echo ""
 echo "To view logs:"
 echo "  gcloud run logs tails $SERVICE_NAME --region=$REGION --project=$PROJECT_ID"
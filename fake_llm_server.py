@@ -0,0 +1,164 @@
+"""
+本地 OpenAI 兼容的假 LLM 服务，用于离线压测对话流和知识抽取
+
+启动：
+    python fake_llm_server.py --port 9000 --ttft-ms 300 --tokens-per-sec 50 --error-rate 0.01
+
+然后让后端指向它（API Key 任意）：
+    OPENAI_BASE_URL=http://localhost:9000/v1
+    OPENAI_API_KEY=fake
+
+支持 /v1/chat/completions（流式与非流式）和 /v1/models。
+知识抽取请求（提示词要求输出 JSON 实体与关系）返回可解析的固定格式 JSON。
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 首个 token 前的延迟（毫秒）
+FAKE_LLM_TTFT_MS = float(os.getenv("FAKE_LLM_TTFT_MS", "200"))
+# 每秒输出 token 数，0 表示不限速
+FAKE_LLM_TOKENS_PER_SEC = float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "50"))
+# 请求失败概率（返回 500），0~1
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+# 普通回答的 token 数（不超过请求的 max_tokens）
+FAKE_LLM_RESPONSE_TOKENS = int(os.getenv("FAKE_LLM_RESPONSE_TOKENS", "64"))
+
+# 识别知识抽取请求
+_EXTRACTION_MARKERS = ("knowledge graph construction", '"entities"')
+_CAPITALIZED = re.compile(r"\b[A-Z][A-Za-z0-9]{2,}\b")
+_CJK_RUN = re.compile(r"[一-鿿]{2,4}")
+_SECTION_HEADER = re.compile(r"^### Section (\d+)$", re.MULTILINE)
+_WORDS = (
+    "the quick answer is that this fake model streams plain words at a fixed pace "
+    "so load tests can measure latency and throughput without a real provider"
+).split()
+
+app = FastAPI(title="Fake LLM")
+
+
+def _extract(text: str) -> dict:
+    """从原文里挑出候选实体，串成关系链。"""
+    names = []
+    for name in _CAPITALIZED.findall(text) + _CJK_RUN.findall(text):
+        if name not in names:
+            names.append(name)
+        if len(names) >= 6:
+            break
+    entities = [{"name": n, "type": "Concept", "description": f"{n} mentioned in the text"} for n in names]
+    relations = [
+        {"from": a, "to": b, "relation": "RELATED_TO", "description": f"{a} appears near {b}"}
+        for a, b in zip(names, names[1:])
+    ]
+    return {"entities": entities, "relations": relations}
+
+
+def _extraction_response(text: str) -> str:
+    """返回抽取提示词要求的 JSON；批量提示词按 "### Section <id>" 分段，每段单独抽取。"""
+    parts = _SECTION_HEADER.split(text)
+    if len(parts) > 1:
+        sections = [{"id": section_id, **_extract(body)} for section_id, body in zip(parts[1::2], parts[2::2])]
+        return json.dumps({"sections": sections}, ensure_ascii=False)
+    return json.dumps(_extract(text.rsplit("Text:", 1)[-1]), ensure_ascii=False)
+
+
+def _tokens_for(body: dict) -> list:
+    """按请求内容生成回答，并切成流式输出的 token。"""
+    messages = body.get("messages") or []
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    if any(marker in prompt for marker in _EXTRACTION_MARKERS):
+        content = _extraction_response(str(messages[-1].get("content", "")) if messages else "")
+        # JSON 按约 4 个字符一个 token 切分
+        return [content[i:i + 4] for i in range(0, len(content), 4)]
+    # 新版 SDK 发送 max_completion_tokens
+    limit = body.get("max_completion_tokens") or body.get("max_tokens") or FAKE_LLM_RESPONSE_TOKENS
+    count = min(FAKE_LLM_RESPONSE_TOKENS, int(limit))
+    return [("" if i == 0 else " ") + _WORDS[i % len(_WORDS)] for i in range(max(count, 1))]
+
+
+def _error_response() -> JSONResponse:
+    return JSONResponse(
+        status_code=500,
+        content={"error": {"message": "Injected failure from fake LLM", "type": "server_error", "code": None}},
+    )
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "fake-llm", "object": "model", "owned_by": "local"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if random.random() < FAKE_LLM_ERROR_RATE:
+        return _error_response()
+
+    model = body.get("model") or "fake-llm"
+    tokens = _tokens_for(body)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    interval = 1 / FAKE_LLM_TOKENS_PER_SEC if FAKE_LLM_TOKENS_PER_SEC > 0 else 0
+
+    if not body.get("stream"):
+        await asyncio.sleep(FAKE_LLM_TTFT_MS / 1000 + interval * (len(tokens) - 1))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+        }
+
+    async def stream():
+        yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+        await asyncio.sleep(FAKE_LLM_TTFT_MS / 1000)
+        for i, token in enumerate(tokens):
+            if i and interval:
+                await asyncio.sleep(interval)
+            yield _chunk(completion_id, model, {"content": token})
+        yield _chunk(completion_id, model, {}, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI-compatible fake LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--ttft-ms", type=float, default=FAKE_LLM_TTFT_MS)
+    parser.add_argument("--tokens-per-sec", type=float, default=FAKE_LLM_TOKENS_PER_SEC)
+    parser.add_argument("--error-rate", type=float, default=FAKE_LLM_ERROR_RATE)
+    parser.add_argument("--response-tokens", type=int, default=FAKE_LLM_RESPONSE_TOKENS)
+    args = parser.parse_args()
+
+    FAKE_LLM_TTFT_MS = args.ttft_ms
+    FAKE_LLM_TOKENS_PER_SEC = args.tokens_per_sec
+    FAKE_LLM_ERROR_RATE = args.error_rate
+    FAKE_LLM_RESPONSE_TOKENS = args.response_tokens
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,32 @@
+"""
+初始化 Neo4j 约束和索引（相当于 Neo4j 侧的 alembic upgrade head）
+
+所有语句均为 IF NOT EXISTS，可重复运行。应用启动时默认也会执行一次
+（NEO4J_SCHEMA_ON_STARTUP=false 可关闭），部署流程中也可单独运行：
+    python init_neo4j_schema.py
+"""
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.repositories.knowledge_repo import knowledge_repository, NEO4J_SCHEMA
+
+
+def init_neo4j_schema(wait_seconds: float = 300):
+    """创建缺失的约束和索引，并等待索引填充完成"""
+    try:
+        created = knowledge_repository.ensure_schema(wait_seconds=wait_seconds)
+        for name, _ in NEO4J_SCHEMA:
+            print(f"{name}: {'已创建' if name in created else '已存在'}")
+        print("\n Neo4j 约束和索引初始化完成！")
+        return True
+    except Exception as e:
+        print(f"初始化失败: {e}")
+        return False
+    finally:
+        knowledge_repository.close()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if init_neo4j_schema() else 1)
@@ -0,0 +1,179 @@
+"""
+对话流并发压测：确认并发流数不再受数据库连接池（pool_size + max_overflow）限制
+
+先启动假 LLM 服务和后端：
+    python fake_llm_server.py --port 9000 --ttft-ms 300 --tokens-per-sec 50
+    OPENAI_BASE_URL=http://localhost:9000/v1 OPENAI_API_KEY=fake uvicorn app.main:app --port 8000
+
+然后：
+    python scripts/chat_load_test.py --base-url http://localhost:8000 --streams 60
+
+每个流使用独立的用户和会话（绕开 CHAT_MAX_STREAMS_PER_USER），问题各不相同（绕开回答缓存）。
+输出首 token 延迟、整轮耗时和同时处于生成中的流数峰值。SQLAlchemy 默认连接池为
+5 + 10 = 15 个连接；若流在生成期间占用连接，峰值会卡在 15 附近、其余流排队或超时。
+CHAT_MAX_CONCURRENT_STREAMS（默认 64）也会限制峰值，压测更多流时需同时调大。
+"""
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from dataclasses import dataclass
+from typing import List, Optional
+
+import httpx
+
+# SQLAlchemy QueuePool 默认 pool_size + max_overflow
+DEFAULT_POOL_LIMIT = 5 + 10
+
+
+@dataclass
+class StreamResult:
+    """一次对话流的客户端观测结果（时间均为相对压测开始的秒数）"""
+    started: float
+    first_token: Optional[float] = None
+    finished: Optional[float] = None
+    frames: int = 0
+    token_bytes: int = 0
+    status: str = "pending"
+    error: Optional[str] = None
+
+
+async def create_session(client: httpx.AsyncClient, index: int) -> tuple:
+    """注册一个压测用户，创建智能体和会话，返回 (请求头, 会话 ID)"""
+    name = f"load_{uuid.uuid4().hex[:12]}"
+    resp = await client.post("/api/v1/auth/register", json={
+        "username": name, "email": f"{name}@example.com", "password": "load-test-password",
+    })
+    resp.raise_for_status()
+    headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+    resp = await client.post("/api/v1/agents/create", json={"name": f"Load agent {index}"}, headers=headers)
+    resp.raise_for_status()
+    agent_id = resp.json()["data"]["id"]
+
+    resp = await client.post("/api/v1/chat/conversations", json={"agent_id": agent_id}, headers=headers)
+    resp.raise_for_status()
+    return headers, resp.json()["data"]["id"]
+
+
+async def run_stream(
+    client: httpx.AsyncClient,
+    headers: dict,
+    conversation_id: int,
+    content: str,
+    t0: float,
+    **options,
+) -> StreamResult:
+    """发起一轮对话流并读到结束事件，options 原样放入请求体（如 flush_interval_ms）"""
+    result = StreamResult(started=time.perf_counter() - t0)
+    event = None
+    try:
+        async with client.stream(
+            "POST", f"/api/v1/chat/conversations/{conversation_id}/stream",
+            json={"content": content, **options}, headers=headers,
+        ) as resp:
+            if resp.status_code != 200:
+                result.status = "http_error"
+                result.error = f"{resp.status_code} {(await resp.aread())[:200]!r}"
+                return result
+            async for line in resp.aiter_lines():
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:") and event is not None:
+                    data = json.loads(line[5:].strip())
+                    if event == "message":
+                        if result.first_token is None:
+                            result.first_token = time.perf_counter() - t0
+                        result.frames += 1
+                        result.token_bytes += len(data["token"].encode("utf-8"))
+                    elif event == "done":
+                        result.status = data.get("status", "complete")
+                    elif event == "error":
+                        result.status = "error"
+                        result.error = data.get("error")
+    except httpx.HTTPError as e:
+        result.status = "http_error"
+        result.error = repr(e)
+    result.finished = time.perf_counter() - t0
+    return result
+
+
+def peak_concurrency(results: List[StreamResult]) -> int:
+    """同时处于生成中（已收到首 token、尚未结束）的流数峰值"""
+    points = []
+    for r in results:
+        if r.first_token is not None and r.finished is not None:
+            points.append((r.first_token, 1))
+            points.append((r.finished, -1))
+    peak = current = 0
+    # 同一时刻先结束后开始，避免把首尾相接的流算作重叠
+    for _, delta in sorted(points, key=lambda p: (p[0], p[1])):
+        current += delta
+        peak = max(peak, current)
+    return peak
+
+
+def summarize(values: List[float]) -> str:
+    """p50 / p95 / max，单位秒"""
+    if not values:
+        return "-"
+    values = sorted(values)
+
+    def at(q: float) -> float:
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+    return f"{at(0.5):.3f}s / {at(0.95):.3f}s / {values[-1]:.3f}s"
+
+
+async def main(args) -> int:
+    limits = httpx.Limits(max_connections=args.streams + 10, max_keepalive_connections=args.streams + 10)
+    timeout = httpx.Timeout(args.timeout, connect=10)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout) as client:
+        print(f"准备 {args.streams} 个用户和会话...")
+        # 准备阶段不在测量范围内，限制并发以免压垮数据库
+        setup_slots = asyncio.Semaphore(8)
+
+        async def setup(index: int) -> tuple:
+            async with setup_slots:
+                return await create_session(client, index)
+
+        sessions = await asyncio.gather(*(setup(i) for i in range(args.streams)))
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(
+            run_stream(client, headers, cid, f"Load test question {i} {uuid.uuid4().hex}", t0)
+            for i, (headers, cid) in enumerate(sessions)
+        ))
+        wall = time.perf_counter() - t0
+
+    completed = [r for r in results if r.status == "complete"]
+    ttft = [r.first_token - r.started for r in completed if r.first_token is not None]
+    duration = [r.finished - r.started for r in completed]
+    peak = peak_concurrency(results)
+
+    print(f"流数: {args.streams}，完成: {len(completed)}，失败: {args.streams - len(completed)}，总耗时: {wall:.2f}s")
+    print(f"首 token 延迟 p50/p95/max: {summarize(ttft)}")
+    print(f"整轮耗时 p50/p95/max: {summarize(duration)}")
+    print(f"同时生成中的流数峰值: {peak}（连接池上限 {args.pool_limit}）")
+    for r in results:
+        if r.status != "complete":
+            print(f"  失败: {r.status} {r.error}")
+
+    if len(completed) < args.streams:
+        return 1
+    if args.streams > args.pool_limit and peak <= args.pool_limit:
+        print("峰值未超过连接池上限：生成期间可能仍占用数据库连接")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent chat stream load test")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--streams", type=int, default=60)
+    parser.add_argument("--pool-limit", type=int, default=DEFAULT_POOL_LIMIT,
+                        help="pool_size + max_overflow of the backend's database engine")
+    parser.add_argument("--timeout", type=float, default=120)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,192 @@
+"""
+Neo4j 图谱写入基准：逐行自动提交写入与 UNWIND 批量单事务写入的对比
+
+需要一个可写的 Neo4j（使用 .env 中的 NEO4J_URI / NEO4J_USER / NEO4J_PASSWORD），例如本地容器：
+    docker run -d --rm -p 7687:7687 -e NEO4J_AUTH=neo4j/knowledge_graph_password neo4j:5
+    python scripts/neo4j_write_benchmark.py --entities 1200 --repeat 3
+
+合成一个含 --entities 个实体、首尾相连关系的文档，分别用逐行写法（user-019 之前
+store_entities_and_relations 的做法：每个实体、每条关系一次 session.run 自动提交）和
+KnowledgeRepository.apply_document_changes 写入，输出耗时中位数、语句数和事务数。
+写入使用负数的文档和数字人 ID，开始和结束时都会删除，不影响已有数据。
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.repositories.knowledge_repo import knowledge_repository
+
+BENCH_AGENT_ID = -1
+PER_ROW_DOCUMENT_ID = -1
+BATCHED_DOCUMENT_ID = -2
+
+
+class CountingTx:
+    """转发 run 并计数的事务包装"""
+
+    def __init__(self, tx, counts: Dict[str, int]):
+        self._tx = tx
+        self._counts = counts
+
+    def run(self, *args, **kwargs):
+        self._counts["statements"] += 1
+        return self._tx.run(*args, **kwargs)
+
+
+class CountingSession:
+    """统计语句数和事务数的会话包装；session.run 自动提交，每次算一个事务"""
+
+    def __init__(self, session, counts: Dict[str, int]):
+        self._session = session
+        self._counts = counts
+
+    def __enter__(self):
+        self._session.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._session.__exit__(*exc)
+
+    def run(self, *args, **kwargs):
+        self._counts["statements"] += 1
+        self._counts["transactions"] += 1
+        return self._session.run(*args, **kwargs)
+
+    def execute_write(self, fn, *args, **kwargs):
+        self._counts["transactions"] += 1
+        return self._session.execute_write(lambda tx, *a, **kw: fn(CountingTx(tx, self._counts), *a, **kw), *args, **kwargs)
+
+
+def synthetic_chunks(entity_count: int, entities_per_chunk: int) -> List[Dict]:
+    """按 apply_document_changes 的输入格式生成分块：实体 E0..En-1，关系 Ei -> Ei+1"""
+    chunks = []
+    for start in range(0, entity_count, entities_per_chunk):
+        names = [f"E{i}" for i in range(start, min(start + entities_per_chunk, entity_count))]
+        chunks.append({
+            "hash": f"bench-{start}",
+            "entities": [{"name": n, "type": "Concept", "description": f"{n} description"} for n in names],
+            "relations": [
+                {"from": f"E{i}", "to": f"E{i + 1}", "relation": "RELATED_TO", "description": f"E{i} to E{i + 1}"}
+                for i in range(start, min(start + entities_per_chunk, entity_count - 1))
+            ],
+        })
+    return chunks
+
+
+def write_per_row(session, document_id: int, agent_id: int, chunks: List[Dict]) -> None:
+    """user-019 之前的写法：每个实体和关系各一次自动提交的 session.run"""
+    session.run(
+        "MERGE (d:Document {id: $doc_id}) SET d.agent_id = $agent_id",
+        doc_id=document_id,
+        agent_id=agent_id,
+    ).consume()
+    for chunk in chunks:
+        for entity in chunk["entities"]:
+            session.run(
+                """
+                MERGE (e:Entity {name: $name, document_id: $doc_id})
+                SET e.type = $type, e.description = $desc, e.agent_id = $agent_id
+                WITH e
+                MATCH (d:Document {id: $doc_id})
+                MERGE (d)-[:CONTAINS]->(e)
+                """,
+                name=entity["name"],
+                type=entity.get("type", "Concept"),
+                desc=entity.get("description", ""),
+                doc_id=document_id,
+                agent_id=agent_id,
+            ).consume()
+    for chunk in chunks:
+        for rel in chunk["relations"]:
+            session.run(
+                """
+                MATCH (e1:Entity {name: $from_name, document_id: $doc_id})
+                MATCH (e2:Entity {name: $to_name, document_id: $doc_id})
+                MERGE (e1)-[:RELATED_TO {relation: $relation, description: $desc}]->(e2)
+                """,
+                from_name=rel["from"],
+                to_name=rel["to"],
+                relation=rel.get("relation", "RELATED_TO"),
+                desc=rel.get("description", ""),
+                doc_id=document_id,
+            ).consume()
+
+
+def graph_size(document_id: int) -> tuple:
+    """文档的 (实体数, 关系数)，用于核对两种写法结果一致"""
+    with knowledge_repository._get_session() as session:
+        record = session.run(
+            """
+            MATCH (e:Entity {document_id: $doc_id})
+            OPTIONAL MATCH (e)-[r:RELATED_TO]->()
+            RETURN count(DISTINCT e) AS entities, count(r) AS relations
+            """,
+            doc_id=document_id,
+        ).single()
+    return record["entities"], record["relations"]
+
+
+def run(name: str, write, document_id: int, repeat: int) -> tuple:
+    """清空文档后写入 repeat 次，返回 (每次耗时, 单次的语句数和事务数)"""
+    timings = []
+    counts = {"statements": 0, "transactions": 0}
+    for _ in range(repeat):
+        knowledge_repository.delete_document_data(document_id)
+        counts = {"statements": 0, "transactions": 0}
+        t0 = time.perf_counter()
+        write(counts)
+        timings.append(time.perf_counter() - t0)
+    entities, relations = graph_size(document_id)
+    print(
+        f"[{name}] 耗时中位数: {statistics.median(timings):.3f}s（最快 {min(timings):.3f}s），"
+        f"语句: {counts['statements']}，事务: {counts['transactions']}，写入实体/关系: {entities}/{relations}"
+    )
+    return timings, counts
+
+
+def main(args) -> int:
+    chunks = synthetic_chunks(args.entities, args.entities_per_chunk)
+    knowledge_repository.ensure_schema(wait_seconds=60)
+
+    def per_row(counts):
+        with CountingSession(knowledge_repository._get_session(), counts) as session:
+            write_per_row(session, PER_ROW_DOCUMENT_ID, BENCH_AGENT_ID, chunks)
+
+    def batched(counts):
+        get_session = knowledge_repository._get_session
+        knowledge_repository._get_session = lambda: CountingSession(get_session(), counts)
+        try:
+            knowledge_repository.apply_document_changes(BATCHED_DOCUMENT_ID, BENCH_AGENT_ID, [], chunks, rebuild=True)
+        finally:
+            knowledge_repository._get_session = get_session
+
+    try:
+        print(f"{args.entities} 个实体，{max(args.entities - 1, 0)} 条关系，{len(chunks)} 个分块，每种写法 {args.repeat} 次")
+        per_row_timings, _ = run("per_row", per_row, PER_ROW_DOCUMENT_ID, args.repeat)
+        batched_timings, _ = run("batched", batched, BATCHED_DOCUMENT_ID, args.repeat)
+        if graph_size(PER_ROW_DOCUMENT_ID) != graph_size(BATCHED_DOCUMENT_ID):
+            print("两种写法的结果不一致")
+            return 1
+        print(f"加速比: {statistics.median(per_row_timings) / statistics.median(batched_timings):.1f}x")
+        return 0
+    finally:
+        knowledge_repository.delete_document_data(PER_ROW_DOCUMENT_ID)
+        knowledge_repository.delete_document_data(BATCHED_DOCUMENT_ID)
+        knowledge_repository.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Neo4j per-row vs UNWIND-batched graph write benchmark")
+    parser.add_argument("--entities", type=int, default=1200)
+    parser.add_argument("--entities-per-chunk", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,100 @@
+"""
+SSE 帧合并基准：逐 token 发帧（flush_interval_ms=0）与默认合并参数的对比
+
+假 LLM 不限速时 token 最密集，最能体现合并效果：
+    python fake_llm_server.py --port 9000 --ttft-ms 50 --tokens-per-sec 0 --response-tokens 512
+    OPENAI_BASE_URL=http://localhost:9000/v1 OPENAI_API_KEY=fake uvicorn app.main:app --port 8000
+
+然后（--server-pid 为后端进程号，用于读取其 CPU 时间，仅 Linux）：
+    python scripts/sse_frame_benchmark.py --base-url http://localhost:8000 --streams 20 --server-pid <pid>
+
+每种模式跑 --rounds 轮、每轮 --streams 个并发流，输出每流帧数、每秒帧数、平均帧大小、
+整轮耗时，以及后端每流消耗的 CPU 毫秒数。
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+from typing import List, Optional
+
+import httpx
+
+from chat_load_test import create_session, run_stream, summarize, StreamResult
+
+# (名称, 请求体中的合并参数)；per_token 即合并之前每个 token 一帧的行为
+MODES = [
+    ("per_token", {"flush_interval_ms": 0}),
+    ("coalesced", {}),
+]
+
+
+def process_cpu_seconds(pid: Optional[int]) -> Optional[float]:
+    """进程累计的用户态 + 内核态 CPU 秒数，无法读取时返回 None"""
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # comm 字段可能含空格，从最后一个 ')' 之后开始数
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    utime, stime = int(fields[11]), int(fields[12])
+    return (utime + stime) / os.sysconf("SC_CLK_TCK")
+
+
+async def run_mode(client: httpx.AsyncClient, sessions: list, options: dict, rounds: int) -> tuple:
+    """按给定合并参数跑若干轮并发流，返回 (全部结果, 测量耗时)"""
+    results: List[StreamResult] = []
+    elapsed = 0.0
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        results += await asyncio.gather(*(
+            run_stream(client, headers, cid, f"Frame benchmark {uuid.uuid4().hex}", t0, **options)
+            for headers, cid in sessions
+        ))
+        elapsed += time.perf_counter() - t0
+    return results, elapsed
+
+
+async def main(args) -> int:
+    limits = httpx.Limits(max_connections=args.streams + 10, max_keepalive_connections=args.streams + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=httpx.Timeout(args.timeout, connect=10)) as client:
+        sessions = []
+        for i in range(args.streams):
+            sessions.append(await create_session(client, i))
+
+        # 预热一轮，排除首次请求的初始化开销
+        await run_mode(client, sessions, {}, 1)
+
+        failed = 0
+        for name, options in MODES:
+            cpu_before = process_cpu_seconds(args.server_pid)
+            results, elapsed = await run_mode(client, sessions, options, args.rounds)
+            cpu_after = process_cpu_seconds(args.server_pid)
+
+            completed = [r for r in results if r.status == "complete"]
+            failed += len(results) - len(completed)
+            frames = sum(r.frames for r in completed)
+            token_bytes = sum(r.token_bytes for r in completed)
+            print(f"[{name}] 流数: {len(results)}，完成: {len(completed)}，耗时: {elapsed:.2f}s")
+            if not completed:
+                continue
+            print(f"  每流帧数: {frames / len(completed):.1f}，每秒帧数: {frames / elapsed:.0f}，平均帧大小: {token_bytes / max(frames, 1):.1f} 字节")
+            print(f"  整轮耗时 p50/p95/max: {summarize([r.finished - r.started for r in completed])}")
+            if cpu_before is not None and cpu_after is not None:
+                print(f"  后端 CPU: {(cpu_after - cpu_before) * 1000 / len(results):.1f} ms/流")
+            else:
+                print("  后端 CPU: 未提供 --server-pid 或无法读取 /proc")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SSE frame coalescing benchmark")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--server-pid", type=int, default=None, help="backend process id, for its CPU time")
+    parser.add_argument("--timeout", type=float, default=120)
+    sys.exit(asyncio.run(main(parser.parse_args())))